@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+"""
+Measure the wall-clock startup time of the command line scripts.
+
+Each script is run with --help, which exits as soon as the options are
+parsed, in a fresh interpreter, and the fastest and median of the runs
+are reported:
+
+    python benchmarks/startup.py [runs]
+"""
+from __future__ import print_function
+
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPTS = ['gist', 'get-github-token']
+
+
+def timeScript(script, runs):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    with open(os.devnull, 'w') as devnull:
+        times = []
+        for i in range(runs):
+            started = time.time()
+            subprocess.call(
+                [sys.executable, os.path.join(ROOT, 'bin', script), '--help'],
+                stdout=devnull, stderr=devnull, env=env)
+            times.append(time.time() - started)
+    return sorted(times)
+
+
+def main(argv):
+    runs = int(argv[1]) if len(argv) > 1 else 20
+    for script in SCRIPTS:
+        times = timeScript(script, runs)
+        print('%-20s min %6.1f ms  median %6.1f ms  (%d runs)' % (
+            script, times[0] * 1000, times[len(times) // 2] * 1000, runs))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -13,20 +13,90 @@
 #
 # Copyright Buildbot Team Members
 
+import collections
+import functools
+import math
+import os
 import re
 import json
-from twisted.python import log
-from twisted.internet import defer, ssl
-from twisted.web import client
+import time
+import urllib
+import urlparse
+from twisted.python import failure, log
+from twisted.internet import defer, threads
+from twisted.internet import error as internet_error
+from twisted.web import client, error
 
 from txgithub.constants import HOSTED_BASE_URL
+from txgithub.diff import DiffParser, DiffPositionIndex
+
+def _timedLoads(data):
+    """
+    Decode C{data}, returning the object and the seconds it took.
+    """
+    started = time.time()
+    return json.loads(data), time.time() - started
+
+
+def _timeoutDeferred(clock, d, timeout, what):
+    """
+    Cancel C{d} if it has not fired after C{timeout} seconds, failing it
+    with L{defer.TimeoutError} instead of L{defer.CancelledError}.
+    """
+    timedOut = []
+
+    def expire():
+        timedOut.append(True)
+        d.cancel()
+    call = clock.callLater(timeout, expire)
+
+    def convert(result):
+        if call.active():
+            call.cancel()
+        elif (timedOut and isinstance(result, failure.Failure) and
+                result.check(defer.CancelledError)):
+            return failure.Failure(defer.TimeoutError(
+                "%s took longer than %s seconds" % (what, timeout)))
+        return result
+    d.addBoth(convert)
+    return d
+
 
 class _GithubPageGetter(client.HTTPPageGetter):
 
+    _idleCall = None
+
     def handleStatus_204(self):
         # github returns 204 for e.g., DELETE operations
         self.handleStatus_200()
 
+    def handleStatus_304(self):
+        # a conditional request found its cached response still valid
+        self.handleStatus_200()
+
+    def connectionMade(self):
+        client.HTTPPageGetter.connectionMade(self)
+        if self.factory.idleTimeout:
+            self._idleCall = self.factory.clock.callLater(
+                self.factory.idleTimeout, self._idle)
+
+    def dataReceived(self, data):
+        if self._idleCall is not None and self._idleCall.active():
+            self._idleCall.reset(self.factory.idleTimeout)
+        client.HTTPPageGetter.dataReceived(self, data)
+
+    def connectionLost(self, reason):
+        if self._idleCall is not None and self._idleCall.active():
+            self._idleCall.cancel()
+        client.HTTPPageGetter.connectionLost(self, reason)
+
+    def _idle(self):
+        self.quietLoss = True
+        self.transport.abortConnection()
+        self.factory.noPage(failure.Failure(defer.TimeoutError(
+            "Nothing received from %s for %s seconds." % (
+                self.factory.url, self.factory.idleTimeout))))
+
 class _GithubHTTPClientFactory(client.HTTPClientFactory):
 
     protocol = _GithubPageGetter
@@ -34,80 +104,820 @@ class _GithubHTTPClientFactory(client.HTTPClientFactory):
     # dont' log about starting and stopping
     noisy = False
 
+    currentProtocol = None
+    idleTimeout = None
+    clock = None
+
+    def buildProtocol(self, addr):
+        self.currentProtocol = client.HTTPClientFactory.buildProtocol(
+            self, addr)
+        return self.currentProtocol
+
+    def abort(self, connector):
+        """
+        Abandon the request, aborting its connection if one has been
+        established and giving up on connecting otherwise.
+        """
+        protocol = self.currentProtocol
+        if protocol is not None and protocol.transport is not None:
+            protocol.transport.abortConnection()
+        else:
+            connector.disconnect()
+
+
+class _GithubPageStreamer(_GithubPageGetter, client.HTTPPageDownloader):
+    # these are old-style classes, whose attributes are looked up depth
+    # first, so the downloader's response handling is picked explicitly
+    _downloader = vars(client.HTTPPageDownloader)
+    transmittingPage = 0
+    handleStatus_200 = _downloader['handleStatus_200']
+    handleStatus_206 = _downloader['handleStatus_206']
+    handleResponsePart = _downloader['handleResponsePart']
+    handleResponseEnd = _downloader['handleResponseEnd']
+    del _downloader
+
+
+class _GithubStreamingFactory(_GithubHTTPClientFactory):
+    """
+    Delivers the body of the response to C{bodyReceived} as it arrives,
+    instead of buffering it.  The deferred fires with C{None}.
+    """
+
+    protocol = _GithubPageStreamer
+
+    def __init__(self, url, bodyReceived, **kwargs):
+        _GithubHTTPClientFactory.__init__(self, url, **kwargs)
+        self.bodyReceived = bodyReceived
+
+    bodyStarted = None
+
+    def pageStart(self, partialContent):
+        if self.bodyStarted is not None:
+            self._deliver(self.bodyStarted, bool(partialContent),
+                          self.response_headers)
+
+    def pagePart(self, data):
+        self._deliver(self.bodyReceived, data)
+
+    def _deliver(self, f, *args):
+        if not self.waiting:
+            return
+        try:
+            f(*args)
+        except Exception:
+            self.noPage(failure.Failure())
+            self.currentProtocol.quietLoss = True
+            self.currentProtocol.transport.abortConnection()
+
+    def pageEnd(self):
+        self.page(None)
+
+
+class CircuitOpenError(Exception):
+    """
+    A request was refused without being sent, because the circuit breaker
+    guarding its route is open.
+    """
+
+
+def _routeGroup(url_args):
+    """
+    Return the name of the group of routes C{url_args} belongs to.
+    Repository routes are grouped by the resource type following the
+    owner and repository name, so that e.g. an outage of the statuses
+    API does not trip requests for hooks.
+    """
+    url_args = [str(arg) for arg in url_args]
+    if url_args[:1] == ['repos'] and len(url_args) > 3:
+        return 'repos/' + url_args[3]
+    return url_args[0] if url_args else ''
+
+
+def _isOutage(failure):
+    """
+    Is C{failure} a sign that GitHub is unavailable, rather than a
+    refusal of this particular request?
+    """
+    if failure.check(error.Error):
+        return str(failure.value.status).startswith('5')
+    return bool(failure.check(internet_error.ConnectError,
+                              internet_error.ConnectionLost,
+                              internet_error.TimeoutError,
+                              defer.TimeoutError))
+
+
+class _CircuitBreaker(object):
+    """
+    Tracks consecutive failures of a group of routes.
+
+    After C{failureThreshold} consecutive failures the breaker opens and
+    requests are refused until C{resetTimeout} seconds have passed.  Then
+    a single probe request is allowed through; if it succeeds the breaker
+    closes again, otherwise it re-opens.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, name, clock, failureThreshold, resetTimeout):
+        self.name = name
+        self.clock = clock
+        self.failureThreshold = failureThreshold
+        self.resetTimeout = resetTimeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.openedAt = None
+        self._probing = False
+
+    def _transition(self, state):
+        log.msg("circuit breaker for %s is now %s" % (self.name, state),
+                system='github')
+        self.state = state
+
+    def allowRequest(self):
+        """
+        May a request be sent now?  If so, the caller must report its
+        outcome with L{recordSuccess} or L{recordFailure}.
+        """
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            if self.clock.seconds() - self.openedAt < self.resetTimeout:
+                return False
+            self._transition(self.HALF_OPEN)
+        if self._probing:
+            return False
+        self._probing = True
+        return True
+
+    def release(self):
+        """
+        Forget about an allowed request whose outcome will never be known.
+        """
+        self._probing = False
+
+    def recordSuccess(self):
+        self._probing = False
+        self.failures = 0
+        if self.state != self.CLOSED:
+            self._transition(self.CLOSED)
+
+    def recordFailure(self):
+        self._probing = False
+        self.failures += 1
+        if (self.state == self.HALF_OPEN or
+                self.failures >= self.failureThreshold):
+            self.openedAt = self.clock.seconds()
+            if self.state != self.OPEN:
+                self._transition(self.OPEN)
+
+
+class _BoundedCache(object):
+    """
+    A mapping keeping at most C{maxEntries} of its most recently used
+    entries.
+    """
+
+    def __init__(self, maxEntries):
+        self.maxEntries = maxEntries
+        self._entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        if key not in self._entries:
+            return default
+        value = self._entries.pop(key)
+        self._entries[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self._entries.pop(key, None)
+        self._entries[key] = value
+        while len(self._entries) > self.maxEntries:
+            self._entries.popitem(last=False)
+
+
+class ETagCache(object):
+    """
+    Remembers the ETags and bodies of GET responses, so that they can be
+    revalidated with conditional requests.  Responses that have not
+    changed do not count against the rate limit.
+
+    @ivar lookups: The number of requests made with this cache.
+    @ivar hits: The number of those answered with 304 Not Modified.
+    """
+
+    def __init__(self, maxEntries=1000):
+        self.lookups = 0
+        self.hits = 0
+        self._entries = _BoundedCache(maxEntries)
+
+    def get(self, url):
+        """
+        Return the C{(etag, body, headers)} cached for C{url}, or C{None}.
+        """
+        self.lookups += 1
+        return self._entries.get(url)
+
+    def put(self, url, etag, body, headers):
+        self._entries[url] = (etag, body, headers)
+
+
+class HedgingPolicy(object):
+    """
+    Decides when GET requests are hedged: if a request has not answered
+    after the C{percentile}th percentile of the recent latencies of its
+    route group, a duplicate request is sent and whichever answers first
+    is used.
+
+    Every request earns C{budget} hedges, up to C{maxBurst}, so that
+    hedging costs at most a fraction C{budget} of extra requests.
+
+    @ivar hedgesSent: The number of duplicate requests sent.
+    @ivar hedgesWon: The number of duplicate requests that answered first.
+    """
+
+    def __init__(self, percentile=95, budget=0.05, maxBurst=10,
+                 initialDelay=1.0, minSamples=20, maxSamples=100):
+        self.percentile = percentile
+        self.budget = budget
+        self.maxBurst = maxBurst
+        self.initialDelay = initialDelay
+        self.minSamples = minSamples
+        self.maxSamples = maxSamples
+        self.tokens = 0.0
+        self.hedgesSent = 0
+        self.hedgesWon = 0
+        self._latencies = {}
+
+    def recordLatency(self, group, latency):
+        samples = self._latencies.setdefault(
+            group, collections.deque(maxlen=self.maxSamples))
+        samples.append(latency)
+
+    def delayFor(self, group):
+        """
+        Return the number of seconds to wait before hedging a request in
+        C{group}.
+        """
+        samples = sorted(self._latencies.get(group, ()))
+        if len(samples) < self.minSamples:
+            return self.initialDelay
+        index = int(math.ceil(self.percentile / 100.0 * len(samples))) - 1
+        return samples[max(index, 0)]
+
+    def requestStarted(self):
+        self.tokens = min(self.tokens + self.budget, self.maxBurst)
+
+    def spend(self):
+        """
+        Take a hedge from the budget, returning C{False} if it is spent.
+        """
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        self.hedgesSent += 1
+        return True
+
+
+class Request(object):
+    """
+    A request on its way through the middleware of a L{GithubApi}.
+
+    @ivar url: The full URL requested.
+    @ivar url_args: The path segments of the URL, below the base URL.
+    @ivar headers: A C{dict} of request headers, which middleware may add
+        to.
+    """
+
+    def __init__(self, url, url_args, method='GET', post=None, headers=None,
+                 timeout=None, connectTimeout=None, idleTimeout=None,
+                 etagCache=None, bodyReceived=None, bodyStarted=None):
+        self.url = url
+        self.url_args = url_args
+        self.method = method
+        self.post = post
+        self.headers = dict(headers or {})
+        self.timeout = timeout
+        self.connectTimeout = connectTimeout
+        self.idleTimeout = idleTimeout
+        self.etagCache = etagCache
+        self.bodyReceived = bodyReceived
+        self.bodyStarted = bodyStarted
+
+
+class Response(object):
+    """
+    The response to a L{Request}.
+
+    @ivar status: The status code, as a string.
+    @ivar headers: A C{dict} mapping lower-cased header names to lists of
+        values.
+    @ivar body: The body, raw until decoded by the JSON middleware.
+    """
+
+    link_re = re.compile('<([^>]*)>; rel="([^"]*)"')
+
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def hasNextPage(self):
+        """
+        Whether the C{Link} header of the response has a C{next} page.
+        """
+        for link_hdr in self.headers.get('link', []):
+            for link in self.link_re.findall(link_hdr):
+                if link[1] == 'next':
+                    # note that we don't *use* the page -- why bother?
+                    return True
+        return False # no 'next' link, so we're done
+
+
 class GithubApi(object):
     # Interface to the github API, using
     # - API v3
     # - optional user/pass auth (token is not available with v3)
     # - async API
 
-    def __init__(self, oauth2_token, baseURL=None, reactor=None):
+    def __init__(self, oauth2_token, baseURL=None, reactor=None,
+                 breakerThreshold=5, breakerResetTimeout=30, breakers=None,
+                 timeout=30, connectTimeout=30, idleTimeout=None,
+                 hedging=None, tokenProvider=None,
+                 jsonThreadThreshold=1024 * 1024, threadPool=None):
+        """
+        :param breakerThreshold: Number of consecutive failures of a route
+                                 group after which its requests fail fast
+                                 with L{CircuitOpenError}, or C{None} to
+                                 disable circuit breaking.
+        :param breakerResetTimeout: Seconds an open breaker waits before
+                                    letting a probe request through.
+        :param breakers: A C{dict} holding breaker state, which may be shared
+                         between clients talking to the same base URL.
+        :param timeout: Default number of seconds a request may take in total.
+        :param connectTimeout: Default number of seconds to wait for a
+                               connection to be established.
+        :param idleTimeout: Default number of seconds a request may go
+                            without receiving any data, or C{None}.
+        :param hedging: A L{HedgingPolicy} to hedge GET requests with, or
+                        C{None}.
+        :param tokenProvider: A callable returning a Deferred firing with
+                              the token to make each request with, such
+                              as L{txgithub.app.AppTokenProvider.
+                              forInstallation}, instead of a fixed
+                              C{oauth2_token}.
+        :param jsonThreadThreshold: Size in bytes of the response bodies
+                                    above which JSON is decoded in a
+                                    thread, so as not to block the
+                                    reactor, or C{None} to always decode
+                                    in the reactor thread.
+        :param threadPool: The thread pool to decode in, by default the
+                           reactor's.
+        """
         self._baseURL = baseURL or HOSTED_BASE_URL
         self.oauth2_token = oauth2_token
         self.rateLimitWarningIssued = False
+        # the last limit, remaining and reset time reported for each rate
+        # limit resource, such as 'core' or 'search'
+        self.rateLimits = {}
+        # pyOpenSSL is slow to import, so only clients load it
+        from twisted.internet import ssl
         self.contextFactory = ssl.ClientContextFactory()
         if reactor is None:
             from twisted.internet import reactor
         self.reactor = reactor
+        self.breakerThreshold = breakerThreshold
+        self.breakerResetTimeout = breakerResetTimeout
+        if breakers is None:
+            breakers = {}
+        self._breakers = breakers
+        self.timeout = timeout
+        self.connectTimeout = connectTimeout
+        self.idleTimeout = idleTimeout
+        self.hedging = hedging
+        self.tokenProvider = tokenProvider
+        self.jsonThreadThreshold = jsonThreadThreshold
+        self.threadPool = threadPool
+        # the bodies decoded in a thread, and the seconds they would have
+        # blocked the reactor for
+        self.threadedDecodes = 0
+        self.threadedDecodeTime = 0.0
+        # a txgithub.outbox.Outbox to send commit statuses and issue
+        # comments through, so they survive restarts
+        self.outbox = None
+        # the middleware every request passes through, outermost first.
+        # Each is called with the Request and a function passing it on to
+        # the next, and returns a Deferred firing with the Response.
+        self.middleware = [self.hedgingMiddleware,
+                           self.circuitBreakerMiddleware,
+                           self.authMiddleware,
+                           self.jsonMiddleware,
+                           self.etagMiddleware,
+                           self.rateLimitMiddleware]
+
+    def _makeHeaders(self, token=None):
+        token = token or self.oauth2_token
+        assert token, "no token specified"
+        return { 'Authorization' : 'token ' + token }
+
+    def _breakerFor(self, url_args):
+        key = (self._baseURL, _routeGroup(url_args))
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            breaker = _CircuitBreaker('%s%s' % key, self.reactor,
+                                      self.breakerThreshold,
+                                      self.breakerResetTimeout)
+            self._breakers[key] = breaker
+        return breaker
+
+    def breakerStates(self):
+        """
+        Return a C{dict} mapping C{(baseURL, route group)} to the state of
+        its circuit breaker: C{'closed'}, C{'open'} or C{'half-open'}.
+        """
+        return dict((key, breaker.state)
+                    for key, breaker in self._breakers.items())
 
-    def _makeHeaders(self):
-        assert self.oauth2_token, "no token specified"
-        return { 'Authorization' : 'token ' + self.oauth2_token }
-
-    def makeRequest(self, url_args, post=None, method='GET', page=0):
-        headers = self._makeHeaders()
-
+    def makeRequest(self, url_args, post=None, method='GET', page=0,
+                    timeout=None, connectTimeout=None, idleTimeout=None,
+                    etagCache=None, params=None, headers=None,
+                    bodyReceived=None, bodyStarted=None, fullResponse=False):
+        """
+        Make a request to the API, passing it through the C{middleware}.
+        The timeouts default to those given to the client.
+
+        :param params: A C{dict} of query parameters.
+        :param headers: A C{dict} of extra request headers, e.g. an
+                        C{Accept} header selecting a media type.
+        :param bodyReceived: A callable to stream the raw response body
+                             to as it arrives, in which case the Deferred
+                             fires with C{None}.  Streamed requests are
+                             neither hedged nor conditional.
+        :param bodyStarted: A callable called before a body is streamed
+                            with whether the response is partial content,
+                            and the response headers.
+        :param timeout: Number of seconds the request may take in total, or
+                        C{0} for no limit.
+        :param connectTimeout: Number of seconds to wait for a connection.
+        :param idleTimeout: Number of seconds the request may go without
+                            receiving any data.
+        :param etagCache: An L{ETagCache} to make a GET request conditional
+                          on.
+        :param fullResponse: Fire with the L{Response}, rather than only
+                             its body.
+        """
         url = self._baseURL
         url += '/'.join(url_args)
+        query = sorted((params or {}).items())
         if page:
-            url += "?page=%d" % page
+            query.append(('page', page))
+        if query:
+            url += "?" + urllib.urlencode(query)
+
+        request = Request(
+            url, url_args, method=method, post=post, headers=headers,
+            timeout=self.timeout if timeout is None else timeout,
+            connectTimeout=connectTimeout or self.connectTimeout,
+            idleTimeout=idleTimeout or self.idleTimeout,
+            etagCache=etagCache, bodyReceived=bodyReceived,
+            bodyStarted=bodyStarted)
+        d = self._proceed(request, 0)
+        if not fullResponse:
+            d.addCallback(lambda response: response.body)
+        return d
+
+    def _proceed(self, request, index):
+        if index == len(self.middleware):
+            return self._transport(request)
+        return self.middleware[index](
+            request, functools.partial(self._proceed, index=index + 1))
 
+    def _transport(self, request):
         postdata = None
-        if post:
-            postdata = json.dumps(post)
+        if request.post:
+            postdata = json.dumps(request.post)
+        d, factory = self._fetch(request.url, request.headers, postdata,
+                                 request.method, request.timeout,
+                                 request.connectTimeout, request.idleTimeout,
+                                 request.bodyReceived, request.bodyStarted)
+        d.addCallback(lambda body: Response(getattr(factory, 'status', None),
+                                            factory.response_headers, body))
+
+        @d.addErrback
+        def withHeaders(reason):
+            # so that e.g. rate limiting can be told from other refusals
+            if reason.check(error.Error):
+                reason.value.response_headers = factory.response_headers or {}
+            return reason
+        return d
+
+    def hedgingMiddleware(self, request, proceed):
+        """
+        Hedge GET requests according to C{hedging}, if set.
+        """
+        if (self.hedging is None or request.method != 'GET' or
+                request.bodyReceived is not None):
+            return proceed(request)
+        return self._hedgedRequest(_routeGroup(request.url_args),
+                                   lambda: proceed(request))
+
+    def circuitBreakerMiddleware(self, request, proceed):
+        """
+        Fail requests fast with L{CircuitOpenError} while the circuit
+        breaker of their route group is open.
+        """
+        if self.breakerThreshold is None:
+            return proceed(request)
+
+        breaker = self._breakerFor(request.url_args)
+        if not breaker.allowRequest():
+            return defer.fail(CircuitOpenError(
+                "circuit breaker for %s is open" % (breaker.name,)))
+
+        try:
+            d = proceed(request)
+        except:
+            breaker.release()
+            raise
+
+        def record(result):
+            if (isinstance(result, failure.Failure) and
+                    result.check(defer.CancelledError)):
+                breaker.release()
+            elif isinstance(result, failure.Failure) and _isOutage(result):
+                breaker.recordFailure()
+            else:
+                breaker.recordSuccess()
+            return result
+        d.addBoth(record)
+        return d
+
+    def _hedgedRequest(self, group, attempt):
+        """
+        Make a request with C{attempt}, and if it has not answered within
+        the hedging delay of C{group}, make a duplicate one.  The first
+        attempt to answer wins, and the others are cancelled.
+        """
+        policy = self.hedging
+        attempts = []
+        done = []
+
+        def cancel(result):
+            if hedgeCall.active():
+                hedgeCall.cancel()
+            for other in attempts[:]:
+                other.cancel()
+        result = defer.Deferred(cancel)
+
+        def launch(d, isHedge):
+            attempts.append(d)
+            d.addBoth(finished, d, isHedge, self.reactor.seconds())
+
+        def finished(outcome, d, isHedge, started):
+            attempts.remove(d)
+            if done:
+                return None
+            if isinstance(outcome, failure.Failure) and attempts:
+                # let the other attempt answer
+                return None
+            done.append(True)
+            if hedgeCall.active():
+                hedgeCall.cancel()
+            if not isinstance(outcome, failure.Failure):
+                policy.recordLatency(group,
+                                     self.reactor.seconds() - started)
+                if isHedge:
+                    policy.hedgesWon += 1
+            for other in attempts[:]:
+                other.cancel()
+            result.callback(outcome)
+
+        def hedge():
+            if policy.spend():
+                launch(defer.maybeDeferred(attempt), True)
+
+        hedgeCall = self.reactor.callLater(policy.delayFor(group), hedge)
+        policy.requestStarted()
+        try:
+            first = attempt()
+        except:
+            hedgeCall.cancel()
+            raise
+        launch(first, False)
+        return result
+
+    def _token(self):
+        if self.tokenProvider is None:
+            return defer.succeed(self.oauth2_token)
+        return self.tokenProvider()
+
+    def authMiddleware(self, request, proceed):
+        """
+        Add the authorization header, with the token of the
+        C{tokenProvider} if set.
+        """
+        def authorize(token):
+            headers = self._makeHeaders(token)
+            headers.update(request.headers)
+            request.headers = headers
+            return proceed(request)
+        if self.tokenProvider is None:
+            return authorize(None)
+        return self._token().addCallback(authorize)
+
+    def jsonMiddleware(self, request, proceed):
+        """
+        Decode JSON response bodies, in a thread if they are larger than
+        C{jsonThreadThreshold}.
+        """
+        d = proceed(request)
 
-        log.msg("fetching '%s'" % (url,), system='github')
-        factory = _GithubHTTPClientFactory(url, headers=headers,
-                    postdata=postdata, method=method,
-                    agent='txgithub', followRedirect=0,
-                    timeout=30)
-
-        self.reactor.connectSSL(factory.host, factory.port, factory,
-                                self.contextFactory)
-        d = factory.deferred
         @d.addCallback
-        def check_ratelimit(data):
-            self.last_response_headers = factory.response_headers
-            remaining = int(factory.response_headers.get(
-                                    'x-ratelimit-remaining', [0])[0])
-            if remaining < 100 and not self.rateLimitWarningIssued:
+        def un_json(response):
+            if not response.body:
+                response.body = None
+                return response
+            if (self.jsonThreadThreshold is None or
+                    len(response.body) <= self.jsonThreadThreshold):
+                response.body = json.loads(response.body)
+                return response
+
+            def decoded(result):
+                body, elapsed = result
+                self.threadedDecodes += 1
+                self.threadedDecodeTime += elapsed
+                response.body = body
+                return response
+            decoding = self._deferToThread(_timedLoads, response.body)
+            return decoding.addCallback(decoded)
+        return d
+
+    def _deferToThread(self, f, *args):
+        threadPool = self.threadPool
+        if threadPool is None:
+            threadPool = self.reactor.getThreadPool()
+        return threads.deferToThreadPool(self.reactor, threadPool, f, *args)
+
+    def etagMiddleware(self, request, proceed):
+        """
+        Make GET requests given an C{etagCache} conditional on it.
+        """
+        etagCache = request.etagCache
+        if (etagCache is None or request.method != 'GET' or
+                request.bodyReceived is not None):
+            return proceed(request)
+        cached = etagCache.get(request.url)
+        if cached is not None:
+            request.headers['If-None-Match'] = cached[0]
+        d = proceed(request)
+
+        @d.addCallback
+        def revalidate(response):
+            if cached is not None and response.status == '304':
+                etagCache.hits += 1
+                etag, response.body, cachedHeaders = cached
+                if 'link' in cachedHeaders:
+                    response.headers.setdefault('link', cachedHeaders['link'])
+            elif 'etag' in response.headers:
+                etagCache.put(request.url, response.headers['etag'][0],
+                              response.body, response.headers)
+            return response
+        return d
+
+    def rateLimitMiddleware(self, request, proceed):
+        """
+        Record the response headers and rate limits, warning when the core
+        rate limit runs low.
+        """
+        d = proceed(request)
+
+        @d.addCallback
+        def check_ratelimit(response):
+            headers = response.headers
+            self.last_response_headers = headers
+            remaining = int(headers.get('x-ratelimit-remaining', [0])[0])
+            resource = headers.get('x-ratelimit-resource', ['core'])[0]
+            if 'x-ratelimit-remaining' in headers:
+                self.rateLimits[resource] = dict(
+                    limit=int(headers.get('x-ratelimit-limit',
+                                          [remaining])[0]),
+                    remaining=remaining,
+                    reset=int(headers.get('x-ratelimit-reset', [0])[0]))
+            # other resources have limits of their own, much smaller
+            if (resource == 'core' and remaining < 100 and
+                    not self.rateLimitWarningIssued):
                 log.msg("warning: only %d Github API requests remaining "
                         "before rate-limiting" % remaining)
                 self.rateLimitWarningIssued = True
-            return data
-        @d.addCallback
-        def un_json(data):
-            if data:
-                return json.loads(data)
+            return response
         return d
 
-    link_re = re.compile('<([^>]*)>; rel="([^"]*)"')
-    @defer.inlineCallbacks
-    def makeRequestAllPages(self, url_args):
-        page = 0
-        data = []
-        while True:
-            data.extend((yield self.makeRequest(url_args, page=page)))
-            if 'link' not in self.last_response_headers:
-                break
-            link_hdr = self.last_response_headers['link'][0]
-            for link in self.link_re.findall(link_hdr):
-                if link[1] == 'next':
-                    # note that we don't *use* the page -- why bother?
-                    break
+    def _fetch(self, url, headers, postdata=None, method='GET',
+               timeout=None, connectTimeout=None, idleTimeout=None,
+               bodyReceived=None, bodyStarted=None):
+        """
+        Fetch any URL, returning a cancellable Deferred firing with the
+        raw response body, and the factory making the request.
+        """
+        log.msg("fetching '%s'" % (url,), system='github')
+        if bodyReceived is not None:
+            factory = _GithubStreamingFactory(url, bodyReceived,
+                        headers=headers, postdata=postdata, method=method,
+                        agent='txgithub', followRedirect=0)
+            factory.bodyStarted = bodyStarted
+        else:
+            factory = _GithubHTTPClientFactory(url, headers=headers,
+                        postdata=postdata, method=method,
+                        agent='txgithub', followRedirect=0)
+        factory.idleTimeout = idleTimeout
+        factory.clock = self.reactor
+
+        connector = self.reactor.connectSSL(factory.host, factory.port,
+                                            factory, self.contextFactory,
+                                            timeout=connectTimeout)
+
+        def cancel(d):
+            factory.abort(connector)
+        d = defer.Deferred(cancel)
+
+        @factory.deferred.addBoth
+        def relay(result):
+            # once cancelled, the outcome of the abandoned request is moot
+            if not d.called:
+                d.callback(result)
+
+        if timeout:
+            _timeoutDeferred(self.reactor, d, timeout, "Getting %s" % (url,))
+        return d, factory
+
+    def makeRequestPages(self, url_args, pageReceived, timeout=None,
+                         **kwargs):
+        """
+        Fetch the pages of C{url_args} one after the other, calling
+        C{pageReceived} with the content of each.  Pagination stops after
+        the last page, or when C{pageReceived} returns C{False}.  Other
+        keyword arguments are passed to L{makeRequest} for every page.
+
+        Returns a Deferred firing with C{None} once done.  Cancelling it
+        cancels the page being fetched and stops pagination.
+
+        :param timeout: Number of seconds fetching all pages may take, or
+                        C{None} to only limit each page's request.
+        """
+        pending = []
+
+        def cancel(result):
+            if pending:
+                pending[0].cancel()
+        result = defer.Deferred(cancel)
+
+        def fetch(page):
+            d = self.makeRequest(url_args, page=page, fullResponse=True,
+                                 **kwargs)
+            pending[:] = [d]
+            d.addCallback(gotPage, page)
+            d.addErrback(gotFailure)
+
+        def gotPage(response, page):
+            del pending[:]
+            if result.called:
+                return
+            # the next page is known from this response's own headers:
+            # other requests may have completed while it was decoded
+            if (pageReceived(response.body) is not False and
+                    response.hasNextPage()):
+                fetch(page + 1)
             else:
-                break # no 'next' link, so we're done
-            page += 1
-        defer.returnValue(data)
+                result.callback(None)
+
+        def gotFailure(reason):
+            del pending[:]
+            if not result.called:
+                result.errback(reason)
+
+        fetch(1)
+        if timeout:
+            _timeoutDeferred(self.reactor, result, timeout,
+                             "Getting all pages of %s" % ('/'.join(url_args),))
+        return result
+
+    def makeRequestAllPages(self, url_args, timeout=None, **kwargs):
+        """
+        Fetch every page of C{url_args} with L{makeRequestPages},
+        returning a Deferred firing with the concatenated results.
+        """
+        data = []
+        d = self.makeRequestPages(url_args, data.extend, timeout=timeout,
+                                  **kwargs)
+        d.addCallback(lambda ignored: data)
+        return d
 
     _repos = None
     @property
@@ -144,6 +954,34 @@ class GithubApi(object):
             self._reviews = ReviewCommentsEndpoint(self)
         return self._reviews
 
+    _graphql = None
+    @property
+    def graphql(self):
+        if not self._graphql:
+            self._graphql = GraphQLEndpoint(self)
+        return self._graphql
+
+    _checks = None
+    @property
+    def checks(self):
+        if not self._checks:
+            self._checks = ChecksEndpoint(self)
+        return self._checks
+
+    _git = None
+    @property
+    def git(self):
+        if not self._git:
+            self._git = GitDataEndpoint(self)
+        return self._git
+
+    _search = None
+    @property
+    def search(self):
+        if not self._search:
+            self._search = SearchEndpoint(self)
+        return self._search
+
 
 class BaseEndpoint(object):
 
@@ -151,19 +989,110 @@ class BaseEndpoint(object):
         self.api = api
 
 
+_FULL_SHA_RE = re.compile('^[0-9a-f]{40}$')
+
+_TERMINAL_STATES = frozenset(['success', 'failure', 'error'])
+
+
+class _ArchiveWriter(object):
+    """
+    Writes a streamed body to a file or consumer in chunks of C{chunkSize}
+    bytes, reporting progress.
+
+    A file given by name may be resumed: the bytes it already holds are
+    requested to be skipped, and it is rewritten if the server sends the
+    whole body anyway.
+    """
+
+    def __init__(self, dest, chunkSize, progress, resume):
+        self.chunkSize = chunkSize
+        self.progress = progress
+        self.offset = 0
+        self.received = 0
+        self.total = None
+        self._buffer = []
+        self._buffered = 0
+        self._opened = isinstance(dest, basestring)
+        if not self._opened:
+            self.file = dest
+        elif resume and os.path.exists(dest):
+            self.file = open(dest, 'r+b')
+            self.file.seek(0, os.SEEK_END)
+            self.offset = self.file.tell()
+        else:
+            self.file = open(dest, 'wb')
+
+    def requestHeaders(self):
+        if self.offset:
+            return {'Range': 'bytes=%d-' % (self.offset,)}
+        return {}
+
+    def start(self, partialContent, headers):
+        if partialContent:
+            self.received = self.offset
+        else:
+            self.received = 0
+            if self.offset:
+                self.file.seek(0)
+                self.file.truncate()
+        length = headers.get('content-length')
+        if length:
+            self.total = self.received + int(length[0])
+
+    def write(self, data):
+        self._buffer.append(data)
+        self._buffered += len(data)
+        self.received += len(data)
+        if self._buffered >= self.chunkSize:
+            data = b''.join(self._buffer)
+            end = len(data) - len(data) % self.chunkSize
+            for i in range(0, end, self.chunkSize):
+                self.file.write(data[i:i + self.chunkSize])
+            self._buffer = [data[end:]]
+            self._buffered = len(data) - end
+        if self.progress is not None:
+            self.progress(self.received, self.total)
+
+    def finish(self, result):
+        # what was received is kept, so that the download can be resumed
+        try:
+            if self._buffered:
+                self.file.write(b''.join(self._buffer))
+                self._buffer, self._buffered = [], 0
+        finally:
+            if self._opened:
+                self.file.close()
+        if isinstance(result, failure.Failure):
+            return result
+        return self.received
+
+
 class ReposEndpoint(BaseEndpoint):
 
+    # combined statuses of full SHAs whose contexts have all finished
+    maxCombinedStatuses = 1000
+
+    archiveChunkSize = 64 * 1024
+    # seconds a download may go without receiving any data, unless the
+    # client has an idle timeout of its own
+    archiveIdleTimeout = 60
+    maxRedirects = 5
+
+    def __init__(self, api):
+        BaseEndpoint.__init__(self, api)
+        self._combinedStatuses = _BoundedCache(self.maxCombinedStatuses)
+
     @defer.inlineCallbacks
     def getEvents(self, repo_user, repo_name, until_id=None):
         """Get all repository events, following paging, until the end
         or until UNTIL_ID is seen.  Returns a Deferred."""
         done = False
-        page = 0
+        page = 1
         events = []
         while not done:
             new_events = yield self.api.makeRequest(
                     ['repos', repo_user, repo_name, 'events'],
-                    page)
+                    page=page)
 
             # terminate if we find a matching ID
             if new_events:
@@ -262,15 +1191,128 @@ class ReposEndpoint(BaseEndpoint):
             ['repos', repo_user, repo_name, 'statuses', sha],
             method='GET')
 
+    def getCombinedStatus(self, repo_user, repo_name, ref):
+        """
+        GET /repos/:owner/:repo/commits/:ref/status
+
+        :param ref: A SHA, branch or tag name.
+        :return: A deferred with the combined status, whose C{statuses}
+                 hold the latest status of every context, from all pages.
+
+        The combined status of a full SHA is cached once it and every
+        context have reached a terminal state, since it will not change.
+        """
+        key = (repo_user, repo_name, ref)
+        if key in self._combinedStatuses:
+            return defer.succeed(self._combinedStatuses.get(key))
+
+        combined = {}
+
+        def pageReceived(page):
+            if not combined:
+                combined.update(page)
+                combined['statuses'] = list(page.get('statuses', []))
+            else:
+                combined['statuses'].extend(page.get('statuses', []))
+
+        def cache(ignored):
+            if (_FULL_SHA_RE.match(ref) and
+                    combined.get('state') in _TERMINAL_STATES and
+                    all(status['state'] in _TERMINAL_STATES
+                        for status in combined['statuses'])):
+                self._combinedStatuses[key] = combined
+            return combined
+
+        d = self.api.makeRequestPages(
+            ['repos', repo_user, repo_name, 'commits', ref, 'status'],
+            pageReceived)
+        d.addCallback(cache)
+        return d
+
+    def downloadArchive(self, repo_user, repo_name, dest,
+                        archive_format='tarball', ref=None, progress=None,
+                        resume=False, timeout=None, idleTimeout=None):
+        """
+        GET /repos/:owner/:repo/:archive_format/:ref
+
+        The archive is streamed to C{dest} in chunks of
+        C{archiveChunkSize} bytes as it arrives, following the redirect
+        to the archive's download location.  The token is only sent to
+        the API's own host.
+
+        :param dest: The name of a file, or a file or consumer to call
+                     C{write} on.
+        :param archive_format: 'tarball' or 'zipball'.
+        :param ref: A branch, tag or SHA; the default branch if C{None}.
+        :param progress: Called with the number of bytes of the archive
+                         received so far, and its total size if known.
+        :param resume: Whether to resume the download into the existing
+                       file C{dest} with a range request.
+        :param timeout: Seconds each request may take, or C{None} for no
+                        limit, since archives may be large.
+        :param idleTimeout: Seconds each request may go without receiving
+                            any data; the client's C{idleTimeout} or
+                            C{archiveIdleTimeout} if C{None}.
+        :return: A deferred firing with the size of the archive.
+        """
+        if archive_format not in ('tarball', 'zipball'):
+            raise ValueError("archive_format must be either 'tarball' or"
+                             " 'zipball'")
+        url_args = ['repos', repo_user, repo_name, archive_format]
+        if ref is not None:
+            url_args.append(ref)
+
+        if idleTimeout is None:
+            idleTimeout = self.api.idleTimeout or self.archiveIdleTimeout
+
+        writer = _ArchiveWriter(dest, self.archiveChunkSize, progress,
+                                resume)
+        d = self.api.makeRequest(url_args, headers=writer.requestHeaders(),
+                                 timeout=timeout or 0,
+                                 idleTimeout=idleTimeout,
+                                 bodyReceived=writer.write,
+                                 bodyStarted=writer.start)
+
+        def redirected(reason, url, hops):
+            reason.trap(error.PageRedirect)
+            if hops >= self.maxRedirects:
+                return reason
+            location = urlparse.urljoin(url, reason.value.location)
+
+            def fetch(token):
+                headers = writer.requestHeaders()
+                if token is not None:
+                    headers.update(self.api._makeHeaders(token))
+                d, factory = self.api._fetch(
+                    location, headers, timeout=timeout,
+                    connectTimeout=self.api.connectTimeout,
+                    idleTimeout=idleTimeout,
+                    bodyReceived=writer.write, bodyStarted=writer.start)
+                return d
+            if (urlparse.urlparse(location).netloc ==
+                    urlparse.urlparse(self.api._baseURL).netloc):
+                d = self.api._token()
+            else:
+                d = defer.succeed(None)
+            d.addCallback(fetch)
+            d.addErrback(redirected, location, hops + 1)
+            return d
+        d.addErrback(redirected,
+                     self.api._baseURL + '/'.join(url_args), 0)
+        d.addBoth(writer.finish)
+        return d
+
     def createStatus(self,
             repo_user, repo_name, sha, state, target_url=None,
-            description=None, context=None):
+            description=None, context=None, timeout=None):
         """
         :param sha: Full sha to create the status for.
         :param state: one of the following 'pending', 'success', 'error'
                       or 'failure'.
         :param target_url: Target url to associate with this status.
         :param description: Short description of the status.
+        :param timeout: Seconds the request may take, instead of the
+                        client's default.
         :return: A defered with the result from GitHub.
         """
         payload = {'state': state}
@@ -284,10 +1326,18 @@ class ReposEndpoint(BaseEndpoint):
         if context is not None:
             payload['context'] = context
 
+        url_args = ['repos', repo_user, repo_name, 'statuses', sha]
+        if self.api.outbox is not None:
+            # a newer status for the same context replaces an unsent one
+            return self.api.outbox.send(
+                url_args, post=payload,
+                key=['statuses', repo_user, repo_name, sha, context],
+                timeout=timeout)
         return self.api.makeRequest(
-            ['repos', repo_user, repo_name, 'statuses', sha],
+            url_args,
             method='POST',
-            post=payload)
+            post=payload,
+            timeout=timeout)
 
 
 class GistsEndpoint(BaseEndpoint):
@@ -302,6 +1352,79 @@ class GistsEndpoint(BaseEndpoint):
 
 
 class PullsEndpoint(BaseEndpoint):
+
+    DIFF_MEDIA_TYPE = 'application/vnd.github.diff'
+
+    def list(self, repo_user, repo_name, state=None, sort=None,
+             direction=None, head=None, base=None):
+        """
+        GET /repos/:owner/:repo/pulls
+
+        :param state: One of 'open', 'closed' or 'all'.
+        :param sort: One of 'created', 'updated', 'popularity' or
+                     'long-running'.
+        :param direction: 'asc' or 'desc'.
+        :param head: Filter by head user and branch, as 'user:ref-name'.
+        :param base: Filter by base branch name.
+        :return: A deferred with the pull requests of every page.
+        """
+        pulls = []
+        d = self.listPages(repo_user, repo_name, pulls.extend, state=state,
+                           sort=sort, direction=direction, head=head,
+                           base=base)
+        d.addCallback(lambda ignored: pulls)
+        return d
+
+    def listPages(self, repo_user, repo_name, pageReceived, state=None,
+                  sort=None, direction=None, head=None, base=None):
+        """
+        Like L{list}, but calls C{pageReceived} with each page of pull
+        requests as it arrives.  Pagination stops early if C{pageReceived}
+        returns C{False}.
+        """
+        if state is not None and state not in ('open', 'closed', 'all'):
+            raise ValueError("state must be one of 'open', 'closed'"
+                             " or 'all'")
+        if direction is not None and direction not in ('asc', 'desc'):
+            raise ValueError("direction must be either 'asc' or 'desc'")
+        params = dict(state=state, sort=sort, direction=direction,
+                      head=head, base=base)
+        return self.api.makeRequestPages(
+            ['repos', repo_user, repo_name, 'pulls'],
+            pageReceived,
+            params=dict((key, value) for key, value in params.items()
+                        if value is not None))
+
+    def getDiff(self, repo_user, repo_name, pull_number, hunkReceived):
+        """
+        GET /repos/:owner/:repo/pulls/:number, as a diff
+
+        The diff is streamed and parsed as it arrives, so that it never
+        needs to be held in memory whole.
+
+        :param hunkReceived: Called with each L{txgithub.diff.DiffHunk} of
+                             the diff, in order.
+        :return: A deferred firing with C{None} after the last hunk.
+        """
+        parser = DiffParser(hunkReceived)
+        d = self.api.makeRequest(
+            ['repos', repo_user, repo_name, 'pulls', str(pull_number)],
+            headers={'Accept': self.DIFF_MEDIA_TYPE},
+            bodyReceived=parser.dataReceived)
+        d.addCallback(lambda ignored: parser.finish())
+        return d
+
+    def getDiffIndex(self, repo_user, repo_name, pull_number):
+        """
+        Return a deferred firing with a L{txgithub.diff.DiffPositionIndex}
+        of the diff of a pull request, giving the C{position} to pass to
+        L{ReviewCommentsEndpoint.createComment} for a line of a file.
+        """
+        index = DiffPositionIndex()
+        d = self.getDiff(repo_user, repo_name, pull_number, index.addHunk)
+        d.addCallback(lambda ignored: index)
+        return d
+
     def edit(self, repo_user, repo_name, pull_number,
              title=None, body=None, state=None):
         """
@@ -340,20 +1463,60 @@ class IssueCommentsEndpoint(BaseEndpoint):
         :param issue_number: The issue's (or pull request's) number
         :param body: The body of this comment
         """
+        url_args = ['repos', repo_user, repo_name,
+                    'issues', issue_number, 'comments']
+        if self.api.outbox is not None:
+            return self.api.outbox.send(url_args, post=dict(body=body))
         return self.api.makeRequest(
-            ['repos', repo_user, repo_name,
-             'issues', issue_number, 'comments'],
+            url_args,
             method='POST',
             post=dict(body=body))
 
 
 class ReviewCommentsEndpoint(BaseEndpoint):
-    def getRepoComments(self, repo_user, repo_name):
+
+    # a txgithub.sync.ReviewCommentIndex kept current with our writes
+    index = None
+
+    def getRepoComments(self, repo_user, repo_name, since=None, sort=None,
+                        direction=None):
         """
         GET /repos/:owner/:repo/pulls/comments
+
+        :param since: Only comments updated at or after this ISO 8601
+                      timestamp are returned.
+        :param sort: 'created' or 'updated'.
+        :param direction: 'asc' or 'desc'.
         """
         return self.api.makeRequestAllPages(
-            ['repos', repo_user, repo_name, 'pulls', 'comments'])
+            ['repos', repo_user, repo_name, 'pulls', 'comments'],
+            params=self._listParams(since, sort, direction))
+
+    def getRepoCommentsPages(self, repo_user, repo_name, pageReceived,
+                             since=None, sort=None, direction=None,
+                             etagCache=None):
+        """
+        Like L{getRepoComments}, but calls C{pageReceived} with each page
+        of comments as it arrives.  Pagination stops early if
+        C{pageReceived} returns C{False}.
+
+        :param etagCache: An L{ETagCache} to make the requests conditional
+                          on.
+        """
+        return self.api.makeRequestPages(
+            ['repos', repo_user, repo_name, 'pulls', 'comments'],
+            pageReceived,
+            params=self._listParams(since, sort, direction),
+            etagCache=etagCache)
+
+    def _listParams(self, since, sort, direction):
+        if sort is not None and sort not in ('created', 'updated'):
+            raise ValueError("sort must be either 'created' or 'updated'")
+        if direction is not None and direction not in ('asc', 'desc'):
+            raise ValueError("direction must be either 'asc' or 'desc'")
+        params = dict(since=since, sort=sort, direction=direction)
+        return dict((key, value) for key, value in params.items()
+                    if value is not None)
 
     def getPullRequestComments(self, repo_user, repo_name, pull_number):
         """
@@ -386,14 +1549,15 @@ class ReviewCommentsEndpoint(BaseEndpoint):
         :param path: The relative path of the file to comment on.
         :param position: The line index in the diff to comment on.
         """
-        return self.api.makeRequest(
+        d = self.api.makeRequest(
             ["repos", repo_user, repo_name,
              "pulls", str(pull_number), "comments"],
             method="POST",
-            data=dict(body=body,
+            post=dict(body=body,
                       commit_id=commit_id,
                       path=path,
                       position=position))
+        return self._indexed(d, repo_user, repo_name)
 
     def replyToComment(self, repo_user, repo_name, pull_number,
                        body, in_reply_to):
@@ -405,12 +1569,13 @@ class ReviewCommentsEndpoint(BaseEndpoint):
         :param body: The text of the comment.
         :param in_reply_to: The comment ID to reply to.
         """
-        return self.api.makeRequest(
+        d = self.api.makeRequest(
             ["repos", repo_user, repo_name,
              "pulls", str(pull_number), "comments"],
             method="POST",
-            data=dict(body=body,
+            post=dict(body=body,
                       in_reply_to=in_reply_to))
+        return self._indexed(d, repo_user, repo_name)
 
     def editComment(self, repo_user, repo_name, comment_id, body):
         """
@@ -419,11 +1584,12 @@ class ReviewCommentsEndpoint(BaseEndpoint):
         :param comment_id: The ID of the comment to edit
         :param body: The new body of the comment.
         """
-        return self.api.makeRequest(
+        d = self.api.makeRequest(
             ["repos", repo_user, repo_name,
              "pulls", "comments", str(comment_id)],
-            method="POST",
-            data=dict(body=body))
+            method="PATCH",
+            post=dict(body=body))
+        return self._indexed(d, repo_user, repo_name)
 
     def deleteComment(self, repo_user, repo_name, comment_id):
         """
@@ -432,7 +1598,499 @@ class ReviewCommentsEndpoint(BaseEndpoint):
         :param comment_id: The ID of the comment to edit
         :param body: The new body of the comment.
         """
-        return self.api.makeRequest(
+        d = self.api.makeRequest(
             ["repos", repo_user, repo_name,
              "pulls", "comments", str(comment_id)],
             method="DELETE")
+        if self.index is not None:
+            @d.addCallback
+            def unindex(result):
+                self.index.remove((repo_user, repo_name), comment_id)
+                return result
+        return d
+
+    def _indexed(self, d, repo_user, repo_name):
+        if self.index is not None:
+            @d.addCallback
+            def index(comment):
+                self.index.add((repo_user, repo_name), comment)
+                return comment
+        return d
+
+
+class GraphQLError(Exception):
+    """
+    GitHub reported errors for a GraphQL lookup.  The argument is the list
+    of errors GitHub returned.
+    """
+
+
+class GraphQLEndpoint(BaseEndpoint):
+    """
+    Batches GraphQL lookups.
+
+    Lookups made in the same reactor iteration are packed into queries of
+    aliased fields, within the limits GitHub sets on the number of nodes a
+    query may request.  The batches are sent concurrently and the result
+    of each lookup is delivered to its own Deferred.
+
+    @ivar rateLimit: The C{rateLimit} GitHub reported with the last
+        response.  GraphQL requests are charged against a separate limit
+        from REST requests.
+    @ivar cost: The total rate limit cost of the queries sent.
+    """
+
+    maxLookups = 50
+    maxNodes = 500000
+    concurrency = 4
+
+    _RATE_LIMIT = 'rateLimit { cost remaining resetAt }'
+
+    def __init__(self, api):
+        BaseEndpoint.__init__(self, api)
+        self._pending = []
+        self._flushCall = None
+        self._semaphore = defer.DeferredSemaphore(self.concurrency)
+        self.rateLimit = None
+        self.cost = 0
+
+    def query(self, selection, nodes=1):
+        """
+        Look up a top-level field selection, such as
+        C{'repository(owner: "o", name: "n") { name }'}.
+
+        :param nodes: An estimate of the number of nodes the selection
+                      requests, used to keep batches within GitHub's limits.
+        :return: A Deferred firing with the selected data.  It fails with
+                 L{GraphQLError} if GitHub reports errors for the lookup.
+                 An error GitHub cannot attribute to a lookup, such as a
+                 syntax error, fails every lookup of its batch.
+        """
+        d = defer.Deferred()
+        self._pending.append((selection, nodes, d))
+        if self._flushCall is None:
+            self._flushCall = self.api.reactor.callLater(0, self._flush)
+        return d
+
+    def pullRequest(self, repo_user, repo_name, pull_number, fields):
+        """
+        Look up C{fields} of a pull request.
+
+        :param fields: The GraphQL selection of pull request fields, e.g.
+                       C{'title commits(last: 1) { nodes { commit {
+                       status { state } } } }'}.
+        """
+        d = self.query('repository(owner: %s, name: %s) '
+                       '{ pullRequest(number: %d) { %s } }' % (
+                           json.dumps(repo_user), json.dumps(repo_name),
+                           int(pull_number), fields))
+        d.addCallback(lambda repository: repository['pullRequest'])
+        return d
+
+    def _flush(self):
+        self._flushCall = None
+        pending, self._pending = self._pending, []
+        # lookups cancelled while waiting are not sent
+        pending = [lookup for lookup in pending if not lookup[2].called]
+        for batch in self._batches(pending):
+            self._semaphore.run(self._send, batch)
+
+    def _batches(self, lookups):
+        batch, nodes = [], 0
+        for lookup in lookups:
+            if batch and (len(batch) >= self.maxLookups or
+                          nodes + lookup[1] > self.maxNodes):
+                yield batch
+                batch, nodes = [], 0
+            batch.append(lookup)
+            nodes += lookup[1]
+        if batch:
+            yield batch
+
+    def _send(self, batch):
+        fields = ' '.join('l%d: %s' % (i, selection)
+                          for i, (selection, nodes, d) in enumerate(batch))
+        d = self.api.makeRequest(
+            ['graphql'],
+            method='POST',
+            post={'query': 'query { %s %s }' % (fields, self._RATE_LIMIT)})
+        d.addCallbacks(self._split, self._failAll,
+                       callbackArgs=(batch,), errbackArgs=(batch,))
+        return d
+
+    def _split(self, response, batch):
+        data = response.get('data') or {}
+        rateLimit = data.get('rateLimit')
+        if rateLimit is not None:
+            self.rateLimit = rateLimit
+            self.cost += rateLimit.get('cost', 0)
+
+        errors = {}
+        general = []
+        for error in response.get('errors', []):
+            path = error.get('path')
+            if path:
+                errors.setdefault(path[0], []).append(error)
+            else:
+                general.append(error)
+
+        for i, (selection, nodes, d) in enumerate(batch):
+            alias = 'l%d' % (i,)
+            if d.called:
+                continue
+            lookupErrors = errors.get(alias, general)
+            if lookupErrors:
+                d.errback(GraphQLError(lookupErrors))
+            else:
+                d.callback(data.get(alias))
+
+    def _failAll(self, reason, batch):
+        for selection, nodes, d in batch:
+            if not d.called:
+                d.errback(reason)
+
+
+class ChecksEndpoint(BaseEndpoint):
+    """
+    Creates and updates check runs.
+
+    GitHub accepts at most C{maxAnnotations} annotations per request, but
+    any number may be given: they are sent in as few requests as possible.
+    The first batch goes with the creation or update of the check run, and
+    the others follow concurrently, at most C{concurrency} at a time.  The
+    fields completing the run are held back until the last request, once
+    every other batch has been accepted, so that a run never shows as
+    completed with annotations missing.
+    """
+
+    maxAnnotations = 50
+    concurrency = 4
+
+    _STATUSES = ('queued', 'in_progress', 'completed')
+
+    def createCheckRun(self, repo_user, repo_name, name, head_sha,
+                       status=None, conclusion=None, details_url=None,
+                       external_id=None, started_at=None, completed_at=None,
+                       output=None, annotations=None):
+        """
+        POST /repos/:owner/:repo/check-runs
+
+        :param status: One of 'queued', 'in_progress' or 'completed'.
+        :param conclusion: The conclusion of a completed run, such as
+                           'success' or 'failure'.
+        :param output: A C{dict} with the C{title} and C{summary} of the
+                       run, and optionally its C{text}.
+        :param annotations: A list of annotation C{dict}s, of any length.
+                            They require an C{output}.
+        :return: A deferred firing with the check run returned by the
+                 last request.
+        """
+        payload = dict(name=name, head_sha=head_sha, status=status,
+                       conclusion=conclusion, details_url=details_url,
+                       external_id=external_id, started_at=started_at,
+                       completed_at=completed_at)
+        return self._send(['repos', repo_user, repo_name, 'check-runs'],
+                          'POST', payload, output, annotations)
+
+    def updateCheckRun(self, repo_user, repo_name, check_run_id, name=None,
+                       status=None, conclusion=None, details_url=None,
+                       external_id=None, started_at=None, completed_at=None,
+                       output=None, annotations=None):
+        """
+        PATCH /repos/:owner/:repo/check-runs/:check_run_id
+
+        Annotations are added to those already on the run.  See
+        L{createCheckRun} for the parameters.
+        """
+        payload = dict(name=name, status=status, conclusion=conclusion,
+                       details_url=details_url, external_id=external_id,
+                       started_at=started_at, completed_at=completed_at)
+        return self._send(
+            ['repos', repo_user, repo_name, 'check-runs', str(check_run_id)],
+            'PATCH', payload, output, annotations)
+
+    def _send(self, url_args, method, payload, output, annotations):
+        payload = dict((key, value) for key, value in payload.items()
+                       if value is not None)
+        if payload.get('status', 'queued') not in self._STATUSES:
+            raise ValueError("status must be one of 'queued', "
+                             "'in_progress' or 'completed'")
+        annotations = list(annotations or [])
+        if output is not None:
+            output = dict(output)
+            annotations[:0] = output.pop('annotations', [])
+        if annotations and (output is None or 'title' not in output or
+                            'summary' not in output):
+            raise ValueError("annotations need an output with a title and"
+                             " a summary")
+
+        size = self.maxAnnotations
+        batches = [annotations[i:i + size]
+                   for i in range(0, len(annotations), size)] or [[]]
+        completion = {}
+        if len(batches) > 1:
+            for key in ('conclusion', 'completed_at'):
+                if key in payload:
+                    completion[key] = payload.pop(key)
+            if payload.get('status') == 'completed':
+                completion['status'] = payload.pop('status')
+
+        def withOutput(fields, batch):
+            if output is not None:
+                fields['output'] = dict(output)
+                if batch:
+                    fields['output']['annotations'] = batch
+            return fields
+
+        d = self.api.makeRequest(url_args, method=method,
+                                 post=withOutput(payload, batches[0]))
+        if len(batches) == 1:
+            return d
+
+        @d.addCallback
+        def sendRest(run):
+            runArgs = url_args[:4] + [str(run['id'])]
+            semaphore = defer.DeferredSemaphore(self.concurrency)
+            ds = [semaphore.run(self.api.makeRequest, runArgs,
+                                method='PATCH', post=withOutput({}, batch))
+                  for batch in batches[1:-1]]
+            sent = defer.gatherResults(ds, consumeErrors=True)
+            sent.addErrback(lambda reason: reason.value.subFailure)
+            sent.addCallback(
+                lambda ignored: self.api.makeRequest(
+                    runArgs, method='PATCH',
+                    post=withOutput(completion, batches[-1])))
+            return sent
+        return d
+
+
+class GitDataEndpoint(BaseEndpoint):
+    """
+    Reads git objects: blobs, trees and commits.
+
+    Git objects never change, so they are kept in a cache keyed by their
+    SHA and shared between repositories, and are never requested again
+    while they remain among the C{maxObjects} most recently used.
+    Objects requested by a name other than a full SHA, such as a branch
+    name for a tree, are fetched and then cached under their SHA.
+    """
+
+    maxObjects = 1000
+    concurrency = 4
+
+    def __init__(self, api):
+        BaseEndpoint.__init__(self, api)
+        self._objects = _BoundedCache(self.maxObjects)
+
+    def _get(self, url_args, key, params=None):
+        if _FULL_SHA_RE.match(key[1]) and key in self._objects:
+            return defer.succeed(self._objects.get(key))
+
+        def cache(obj):
+            self._objects[(key[0], obj['sha']) + key[2:]] = obj
+            return obj
+        d = self.api.makeRequest(url_args, params=params)
+        d.addCallback(cache)
+        return d
+
+    def getBlob(self, repo_user, repo_name, sha):
+        """
+        GET /repos/:owner/:repo/git/blobs/:sha
+
+        :return: A deferred with the blob, whose C{content} is encoded as
+                 given by its C{encoding}.
+        """
+        return self._get(['repos', repo_user, repo_name, 'git', 'blobs', sha],
+                         ('blob', sha))
+
+    def getCommit(self, repo_user, repo_name, sha):
+        """
+        GET /repos/:owner/:repo/git/commits/:sha
+        """
+        return self._get(
+            ['repos', repo_user, repo_name, 'git', 'commits', sha],
+            ('commit', sha))
+
+    def getTree(self, repo_user, repo_name, sha, recursive=False):
+        """
+        GET /repos/:owner/:repo/git/trees/:sha
+
+        :param sha: The SHA of the tree, or a branch or tag name.
+        :param recursive: Whether to list the entries of subtrees too.
+                          GitHub truncates very large recursive listings,
+                          as indicated by the tree's C{truncated}.
+        """
+        params = {'recursive': '1'} if recursive else None
+        return self._get(['repos', repo_user, repo_name, 'git', 'trees', sha],
+                         ('tree', sha, bool(recursive)), params=params)
+
+    def getTreeBlobs(self, repo_user, repo_name, sha):
+        """
+        Fetch a tree recursively along with all of its blobs.  The blobs
+        missing from the cache are fetched concurrently, at most
+        C{concurrency} at a time, and each distinct blob only once.
+
+        :return: A deferred with a C{dict} mapping the path of every file
+                 of the tree to its blob.
+        """
+        semaphore = defer.DeferredSemaphore(self.concurrency)
+
+        def fetchBlobs(tree):
+            entries = [entry for entry in tree['tree']
+                       if entry['type'] == 'blob']
+            fetches = {}
+            for entry in entries:
+                if entry['sha'] not in fetches:
+                    fetches[entry['sha']] = semaphore.run(
+                        self.getBlob, repo_user, repo_name, entry['sha'])
+            shas = list(fetches)
+            d = defer.gatherResults([fetches[blobSha] for blobSha in shas],
+                                    consumeErrors=True)
+            d.addErrback(lambda reason: reason.value.subFailure)
+            d.addCallback(lambda blobs: dict(zip(shas, blobs)))
+            d.addCallback(lambda blobs: dict(
+                (entry['path'], blobs[entry['sha']]) for entry in entries))
+            return d
+
+        d = self.getTree(repo_user, repo_name, sha, recursive=True)
+        d.addCallback(fetchBlobs)
+        return d
+
+
+class SearchEndpoint(BaseEndpoint):
+    """
+    Searches code, issues, repositories, commits and users.
+
+    Search requests are charged against the C{search} rate limit, which is
+    much smaller than the one of other requests and resets every minute.
+    Requests are held back while it is used up, and sent once it resets.
+    Until the first answer reports it, a single request is sent at a time.
+
+    GitHub returns at most C{maxResults} results for a search, so results
+    are fetched C{perPage} at a time, up to that many.
+    """
+
+    maxResults = 1000
+    perPage = 100
+
+    _KINDS = ('code', 'issues', 'repositories', 'commits', 'users')
+
+    def __init__(self, api):
+        BaseEndpoint.__init__(self, api)
+        self._waiting = collections.deque()
+        self._inFlight = 0
+        self._wakeCall = None
+
+    def search(self, kind, q, pageReceived, sort=None, order=None):
+        """
+        GET /search/:kind
+
+        :param kind: One of 'code', 'issues', 'repositories', 'commits' or
+                     'users'.
+        :param q: The search query, such as C{'addClass repo:o/r'}.
+        :param pageReceived: Called with the items of each page of results
+                             as it arrives.  Pagination stops early if it
+                             returns C{False}.
+        :param sort: The field to sort by, depending on the C{kind}.
+        :param order: 'asc' or 'desc'.
+        :return: A deferred firing with the C{total_count} of results
+                 GitHub reported, which may exceed those it returns.
+        """
+        if kind not in self._KINDS:
+            raise ValueError("kind must be one of %s" % (
+                ", ".join(repr(k) for k in self._KINDS),))
+        if order is not None and order not in ('asc', 'desc'):
+            raise ValueError("order must be either 'asc' or 'desc'")
+        params = dict(q=q, per_page=self.perPage)
+        if sort is not None:
+            params['sort'] = sort
+        if order is not None:
+            params['order'] = order
+        received = [0]
+
+        def fetch(page):
+            d = self._schedule(self.api.makeRequest, ['search', kind],
+                               page=page, params=params, fullResponse=True)
+            d.addCallback(gotPage, page)
+            return d
+
+        def gotPage(response, page):
+            hasNext = response.hasNextPage()
+            response = response.body
+            items = response.get('items', [])
+            items = items[:self.maxResults - received[0]]
+            received[0] += len(items)
+            if (pageReceived(items) is False or not hasNext or
+                    received[0] >= self.maxResults):
+                return response.get('total_count')
+            return fetch(page + 1)
+        return fetch(1)
+
+    def code(self, q, pageReceived, sort=None, order=None):
+        return self.search('code', q, pageReceived, sort, order)
+
+    def issues(self, q, pageReceived, sort=None, order=None):
+        return self.search('issues', q, pageReceived, sort, order)
+
+    def repositories(self, q, pageReceived, sort=None, order=None):
+        return self.search('repositories', q, pageReceived, sort, order)
+
+    def _schedule(self, f, *args, **kwargs):
+        """
+        Call C{f} once the search rate limit allows it, returning a
+        Deferred firing with its result.  Cancelling it takes the call off
+        the queue, or cancels it if it was made.
+        """
+        # the Deferred returned, the call, and its Deferred once made
+        entry = [None, (f, args, kwargs), None]
+
+        def cancel(d):
+            if entry in self._waiting:
+                self._waiting.remove(entry)
+            elif entry[2] is not None:
+                entry[2].cancel()
+        entry[0] = defer.Deferred(cancel)
+        self._waiting.append(entry)
+        self._pump()
+        return entry[0]
+
+    def _available(self):
+        limit = self.api.rateLimits.get('search')
+        if limit is None:
+            # one request at a time until an answer tells how many are left
+            return self._inFlight == 0, None
+        now = self.api.reactor.seconds()
+        if now < limit['reset']:
+            remaining = limit['remaining']
+        else:
+            remaining = limit['limit']
+        if remaining - self._inFlight > 0:
+            return True, None
+        if now < limit['reset']:
+            return False, limit['reset'] - now
+        # wait for the answers of the requests in flight
+        return False, None
+
+    def _pump(self):
+        while self._waiting:
+            available, delay = self._available()
+            if not available:
+                if delay is not None and self._wakeCall is None:
+                    self._wakeCall = self.api.reactor.callLater(
+                        delay, self._wake)
+                return
+            entry = self._waiting.popleft()
+            d, (f, args, kwargs), _ = entry
+            self._inFlight += 1
+            result = entry[2] = defer.maybeDeferred(f, *args, **kwargs)
+            result.addBoth(self._done)
+            result.chainDeferred(d)
+
+    def _wake(self):
+        self._wakeCall = None
+        self._pump()
+
+    def _done(self, result):
+        self._inFlight -= 1
+        self._pump()
+        return result
@@ -0,0 +1,207 @@
+# This file is part of txgithub.  txgithub is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+"""
+Authentication as a GitHub App, with installation tokens.
+"""
+
+import base64
+import calendar
+import functools
+import json
+import time
+
+from OpenSSL import crypto
+from twisted.internet import defer
+from twisted.python import failure, log
+from twisted.web import client
+
+from txgithub.api import _timeoutDeferred
+from txgithub.constants import HOSTED_BASE_URL
+
+__all__ = ["AppTokenProvider", "makeJWT"]
+
+
+def _b64url(data):
+    return base64.urlsafe_b64encode(data).rstrip('=')
+
+
+def makeJWT(appId, privateKey, now, lifetime=540):
+    """
+    Make a JSON Web Token authenticating as the app C{appId}, signed with
+    RS256.
+
+    @param privateKey: The app's private key, as a PEM string or a
+        L{crypto.PKey}.
+    @param now: The current POSIX time.
+    @param lifetime: Seconds until the token expires, at most ten minutes.
+    """
+    if not isinstance(privateKey, crypto.PKey):
+        privateKey = crypto.load_privatekey(crypto.FILETYPE_PEM, privateKey)
+    header = {'alg': 'RS256', 'typ': 'JWT'}
+    # allow for clock drift
+    payload = {'iat': int(now) - 60, 'exp': int(now) + lifetime,
+               'iss': str(appId)}
+    signingInput = '.'.join(
+        _b64url(json.dumps(part, sort_keys=True, separators=(',', ':')))
+        for part in (header, payload))
+    signature = crypto.sign(privateKey, signingInput, 'sha256')
+    return signingInput + '.' + _b64url(signature)
+
+
+def _parseTime(timestamp):
+    """
+    Parse an ISO 8601 time ending in C{Z} or a C{+HH:MM} offset into a
+    POSIX time.
+    """
+    offset = 0
+    if timestamp.endswith('Z'):
+        timestamp = timestamp[:-1]
+    elif timestamp[-6:-5] in ('+', '-'):
+        sign = -1 if timestamp[-6] == '-' else 1
+        offset = sign * (int(timestamp[-5:-3]) * 3600 +
+                         int(timestamp[-2:]) * 60)
+        timestamp = timestamp[:-6]
+    return calendar.timegm(
+        time.strptime(timestamp, '%Y-%m-%dT%H:%M:%S')) - offset
+
+
+def _parseMinted(body):
+    """
+    Return the token and the expiry time of a minted installation token.
+    """
+    result = json.loads(body)
+    return result['token'], _parseTime(result['expires_at'])
+
+
+class AppTokenProvider(object):
+    """
+    Mints installation tokens for a GitHub App, and keeps them fresh.
+
+    Tokens are cached per installation.  Once a token has been minted, a
+    new one is minted in the background C{refreshMargin} seconds before
+    it expires, so that requests never wait for a token after the first.
+
+    Give a L{txgithub.api.GithubApi} the C{tokenProvider} returned by
+    L{forInstallation} to make requests as an installation.
+    """
+
+    retryDelay = 30
+    # seconds minting a token may take, as every request of the
+    # installation waits for it
+    mintTimeout = 30
+
+    def __init__(self, appId, privateKey, baseURL=None, reactor=None,
+                 refreshMargin=300, _getPage=client.getPage):
+        """
+        :param privateKey: The app's private key, as a PEM string.
+        :param refreshMargin: Seconds before expiry at which tokens are
+                              refreshed.
+        """
+        self.appId = appId
+        self.privateKey = crypto.load_privatekey(crypto.FILETYPE_PEM,
+                                                 privateKey)
+        baseURL = baseURL or HOSTED_BASE_URL
+        if baseURL[-1] != '/':
+            baseURL += '/'
+        self.baseURL = baseURL
+        if reactor is None:
+            from twisted.internet import reactor
+        self.reactor = reactor
+        self.refreshMargin = refreshMargin
+        self._getPage = _getPage
+        # installation id -> (token, expiry time)
+        self._tokens = {}
+        # installation id -> Deferreds waiting for a token being minted
+        self._minting = {}
+        self._refreshCalls = {}
+
+    def forInstallation(self, installationId):
+        """
+        Return a callable returning a Deferred firing with a token of
+        installation C{installationId}.
+        """
+        return functools.partial(self.getToken, installationId)
+
+    def getToken(self, installationId):
+        """
+        Return a Deferred firing with a valid token of installation
+        C{installationId}, minting one only if there is none.
+        """
+        cached = self._tokens.get(installationId)
+        if cached is not None and self.reactor.seconds() < cached[1]:
+            return defer.succeed(cached[0])
+        return self._mint(installationId)
+
+    def _mint(self, installationId):
+        d = defer.Deferred()
+        if installationId in self._minting:
+            self._minting[installationId].append(d)
+            return d
+        self._minting[installationId] = [d]
+
+        jwt = makeJWT(self.appId, self.privateKey, self.reactor.seconds())
+        url = '%sapp/installations/%s/access_tokens' % (self.baseURL,
+                                                        installationId)
+        minted = self._getPage(
+            url=url, method='POST',
+            headers={'Authorization': 'Bearer ' + jwt,
+                     'Accept': 'application/vnd.github+json'},
+            timeout=self.mintTimeout)
+        _timeoutDeferred(self.reactor, minted, self.mintTimeout,
+                         "Getting %s" % (url,))
+        # a response which cannot be parsed fails the waiters, too
+        minted.addCallback(_parseMinted)
+        minted.addBoth(self._minted, installationId)
+        return d
+
+    def _minted(self, result, installationId):
+        waiters = self._minting.pop(installationId)
+        if not isinstance(result, failure.Failure):
+            token, expiresAt = result
+            self._tokens[installationId] = result
+            self._scheduleRefresh(
+                installationId,
+                expiresAt - self.refreshMargin - self.reactor.seconds())
+            result = token
+        for waiter in waiters:
+            waiter.callback(result)
+
+    def _scheduleRefresh(self, installationId, delay):
+        call = self._refreshCalls.get(installationId)
+        if call is not None and call.active():
+            call.cancel()
+        self._refreshCalls[installationId] = self.reactor.callLater(
+            max(delay, 0), self._refresh, installationId)
+
+    def _refresh(self, installationId):
+        del self._refreshCalls[installationId]
+
+        def failed(reason):
+            log.err(reason, "refreshing the token of installation %s" % (
+                installationId,))
+            expiresAt = self._tokens[installationId][1]
+            if self.reactor.seconds() + self.retryDelay < expiresAt:
+                self._scheduleRefresh(installationId, self.retryDelay)
+        self._mint(installationId).addErrback(failed)
+
+    def stop(self):
+        """
+        Stop refreshing tokens in the background.
+        """
+        for call in self._refreshCalls.values():
+            if call.active():
+                call.cancel()
+        self._refreshCalls.clear()
@@ -0,0 +1,183 @@
+# This file is part of txgithub.  txgithub is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+"""
+Incremental parsing of unified diffs, and the diff positions review
+comments are placed at.
+"""
+
+import array
+import bisect
+import collections
+import re
+
+__all__ = ["DiffHunk", "DiffParser", "DiffPositionIndex"]
+
+
+class DiffHunk(collections.namedtuple(
+        'DiffHunk', ['path', 'oldStart', 'oldCount', 'newStart', 'newCount',
+                     'position', 'lines'])):
+    """
+    A hunk of a unified diff.
+
+    @ivar path: The path of the file the hunk changes.
+    @ivar position: The diff position of the first line of the hunk, that
+        is the number of lines it is below the first hunk header of the
+        file.
+    @ivar lines: The lines of the hunk, with their C{' '}, C{'+'}, C{'-'}
+        or C{'\\\\'} prefix and without their line ending.
+    """
+
+    __slots__ = ()
+
+
+_HUNK_HEADER_RE = re.compile(r'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+
+
+def _stripPrefix(path):
+    if path == '/dev/null':
+        return None
+    if path[:2] in ('a/', 'b/'):
+        return path[2:]
+    return path
+
+
+class DiffParser(object):
+    """
+    Parses a unified diff, as returned by GitHub, fed to it in chunks of
+    any size, and calls C{hunkReceived} with a L{DiffHunk} as soon as each
+    hunk is complete.  Only the current hunk is held in memory.
+    """
+
+    def __init__(self, hunkReceived):
+        self.hunkReceived = hunkReceived
+        self._buffer = b''
+        self._path = None
+        self._oldPath = None
+        # the diff position of the next line, or None in a file header
+        self._position = None
+        self._hunk = None
+
+    def dataReceived(self, data):
+        lines = (self._buffer + data).split(b'\n')
+        self._buffer = lines.pop()
+        for line in lines:
+            self._lineReceived(line)
+
+    def finish(self):
+        """
+        Signal the end of the diff, delivering the last hunk.
+        """
+        if self._buffer:
+            self._lineReceived(self._buffer)
+            self._buffer = b''
+        self._endHunk()
+
+    def _lineReceived(self, line):
+        if line.startswith(b'diff '):
+            self._endHunk()
+            self._position = None
+            parts = line.split(b' b/', 1)
+            self._path = parts[1] if len(parts) == 2 else None
+            self._oldPath = None
+        elif line.startswith(b'@@'):
+            self._startHunk(line)
+        elif self._position is None:
+            if line.startswith(b'--- '):
+                self._oldPath = _stripPrefix(line[4:])
+            elif line.startswith(b'+++ '):
+                self._path = _stripPrefix(line[4:]) or self._oldPath
+        elif self._hunk is not None:
+            self._hunk[-1].append(line)
+            self._position += 1
+
+    def _startHunk(self, line):
+        match = _HUNK_HEADER_RE.match(line)
+        if match is None:
+            raise ValueError("malformed hunk header: %r" % (line,))
+        self._endHunk()
+        if self._position is None:
+            # positions start at the line below the first hunk header
+            self._position = 1
+        else:
+            # further hunk headers are counted as lines
+            self._position += 1
+        oldStart, oldCount, newStart, newCount = match.groups()
+        self._hunk = [self._path, int(oldStart),
+                      1 if oldCount is None else int(oldCount),
+                      int(newStart),
+                      1 if newCount is None else int(newCount),
+                      self._position, []]
+
+    def _endHunk(self):
+        if self._hunk is not None:
+            hunk, self._hunk = DiffHunk(*self._hunk), None
+            self.hunkReceived(hunk)
+
+
+class DiffPositionIndex(object):
+    """
+    Maps the line numbers of the new version of the files of a diff to the
+    diff positions review comments are placed at.
+
+    Consecutive lines at consecutive positions are stored as a single run
+    of three integers, so the index takes a small fraction of the memory
+    of the diff it was built from.  Feed it the hunks of a L{DiffParser}
+    with L{addHunk}.
+    """
+
+    def __init__(self):
+        # path -> (first lines, first positions, lengths) of its runs
+        self._runs = {}
+
+    def __contains__(self, path):
+        return path in self._runs
+
+    def paths(self):
+        return sorted(self._runs)
+
+    def addHunk(self, hunk):
+        runs = self._runs.get(hunk.path)
+        if runs is None:
+            runs = (array.array('l'), array.array('l'), array.array('l'))
+            self._runs[hunk.path] = runs
+        starts, positions, lengths = runs
+
+        line, position = hunk.newStart, hunk.position
+        for text in hunk.lines:
+            if text[:1] not in (b'-', b'\\'):
+                if (starts and starts[-1] + lengths[-1] == line and
+                        positions[-1] + lengths[-1] == position):
+                    lengths[-1] += 1
+                else:
+                    starts.append(line)
+                    positions.append(position)
+                    lengths.append(1)
+                line += 1
+            position += 1
+
+    def position(self, path, line):
+        """
+        Return the diff position of C{line} of the new version of C{path},
+        or C{None} if the line is not part of the diff.
+        """
+        runs = self._runs.get(path)
+        if runs is None:
+            return None
+        starts, positions, lengths = runs
+        i = bisect.bisect_right(starts, line) - 1
+        if i < 0 or line >= starts[i] + lengths[i]:
+            return None
+        return positions[i] + line - starts[i]
@@ -0,0 +1,159 @@
+# This file is part of txgithub.  txgithub is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+"""
+Polling the events of many repositories as a single stream.
+"""
+
+import heapq
+import time
+
+from twisted.internet import defer, task
+from twisted.python import log
+
+from txgithub.api import _BoundedCache
+
+__all__ = ["EventMerger"]
+
+
+def _timestamp(seconds):
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(seconds))
+
+
+class EventMerger(object):
+    """
+    Polls the events of many repositories and merges them into a single
+    stream, ordered by C{created_at}.
+
+    Every round polls each repository for the events since the newest one
+    it has seen, at most C{concurrency} at a time.  New events go on a
+    heap, and once the round is over, those created before it started are
+    handed to C{eventReceived} oldest first: every repository has been
+    polled since, so no older event can turn up later.  Events of a
+    repository whose poll failed may still arrive late.
+
+    C{eventReceived} is called with the C{(owner, name)} of the repository
+    and the event, and may return a Deferred, in which case no further
+    event is delivered until it fires.  Rounds are skipped while
+    C{maxBuffered} events wait to be delivered, and while fewer than
+    C{reserve} requests of the core rate limit are left.
+
+    @ivar marks: A C{dict} mapping C{(owner, name)} to the ID of the
+        newest event seen.  It may be persisted and passed to a new merger
+        to resume from where it left off.
+    @ivar duplicates: The number of events dropped as already delivered.
+    """
+
+    def __init__(self, api, repos, eventReceived, interval=60, concurrency=8,
+                 maxSeen=100000, maxBuffered=10000, reserve=500, lag=0,
+                 marks=None):
+        """
+        :param repos: The C{(owner, name)} tuples of the repositories.
+        :param interval: Seconds between the starts of rounds.
+        :param maxSeen: Number of the most recent event IDs remembered to
+                        drop duplicates.
+        :param lag: Seconds events are held back, allowing for GitHub
+                    publishing them late.
+        """
+        self.api = api
+        self.repos = [tuple(repo) for repo in repos]
+        self.eventReceived = eventReceived
+        self.interval = interval
+        self.maxBuffered = maxBuffered
+        self.reserve = reserve
+        self.lag = lag
+        self.marks = {} if marks is None else marks
+        self.duplicates = 0
+        self._semaphore = defer.DeferredSemaphore(concurrency)
+        self._seen = _BoundedCache(maxSeen)
+        # (created_at, id, repo, event) of the events not yet delivered
+        self._heap = []
+        # events created before this time may be delivered
+        self._watermark = None
+        # the Deferred returned by eventReceived, while it has not fired
+        self._waiting = None
+        self._loop = None
+
+    def __len__(self):
+        return len(self._heap)
+
+    def start(self):
+        """
+        Poll every C{interval} seconds, until L{stop}ped.
+        """
+        self._loop = task.LoopingCall(self.poll)
+        self._loop.clock = self.api.reactor
+        self._loop.start(self.interval)
+
+    def stop(self):
+        if self._loop is not None and self._loop.running:
+            self._loop.stop()
+        self._loop = None
+
+    def _budgetLeft(self):
+        core = self.api.rateLimits.get('core')
+        return (core is None or core['remaining'] >= self.reserve or
+                core['reset'] <= self.api.reactor.seconds())
+
+    def poll(self):
+        """
+        Poll every repository once.
+
+        :return: A Deferred firing once the round is over.
+        """
+        if len(self._heap) >= self.maxBuffered or not self._budgetLeft():
+            return defer.succeed(None)
+        started = self.api.reactor.seconds() - self.lag
+        d = defer.gatherResults([self._semaphore.run(self._pollRepo, repo)
+                                 for repo in self.repos])
+
+        @d.addCallback
+        def release(ignored):
+            self._watermark = _timestamp(started)
+            self._drain()
+        return d
+
+    def _pollRepo(self, repo):
+        d = self.api.repos.getEvents(repo[0], repo[1],
+                                     until_id=self.marks.get(repo))
+
+        @d.addCallback
+        def received(events):
+            if events:
+                self.marks[repo] = events[0]['id']
+            for event in events:
+                if event['id'] in self._seen:
+                    self.duplicates += 1
+                    continue
+                self._seen[event['id']] = True
+                heapq.heappush(self._heap, (event['created_at'],
+                                            int(event['id']), repo, event))
+
+        d.addErrback(log.err, "polling the events of %s/%s" % repo)
+        return d
+
+    def _drain(self):
+        while (self._waiting is None and self._heap and
+               self._heap[0][0] < self._watermark):
+            _, _, repo, event = heapq.heappop(self._heap)
+            d = defer.maybeDeferred(self.eventReceived, repo, event)
+            d.addErrback(log.err, "delivering event %s" % (event['id'],))
+            if not d.called:
+                self._waiting = d
+                d.addCallback(self._delivered)
+
+    def _delivered(self, ignored):
+        self._waiting = None
+        self._drain()
@@ -0,0 +1,142 @@
+# This file is part of txgithub.  txgithub is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+"""
+Declarative management of the hooks of many repositories.
+"""
+
+from twisted.internet import defer
+
+from txgithub.api import ETagCache
+
+__all__ = ["HookReconciler"]
+
+
+# GitHub never returns a hook's secret
+_MASKED = '********'
+
+
+def _matches(hook, name, config):
+    """
+    Is C{hook} the hook described by C{name} and C{config}?  Web hooks are
+    told apart by their URL, other services by their name only.
+    """
+    if hook['name'] != name:
+        return False
+    if name == 'web':
+        return hook.get('config', {}).get('url') == config.get('url')
+    return True
+
+
+def _isUpToDate(hook, config, events, active):
+    current = hook.get('config', {})
+    for key, value in config.items():
+        if key == 'secret' and current.get(key) == _MASKED:
+            continue
+        # GitHub returns settings such as insecure_ssl as strings
+        if key not in current or str(current[key]) != str(value):
+            return False
+    return (set(hook.get('events', [])) == set(events) and
+            hook.get('active') == active)
+
+
+class HookReconciler(object):
+    """
+    Makes a hook exist, exactly once and as specified, on many
+    repositories.
+
+    The current hooks are fetched with conditional requests, so a
+    repository whose hooks have not changed since the last run costs no
+    rate limit.  Only the calls needed to bring each repository in line
+    with the specification are made.
+    """
+
+    def __init__(self, api, concurrency=4, etagCache=None):
+        """
+        :param concurrency: The maximum number of repositories being
+                            reconciled at once.
+        :param etagCache: The L{ETagCache} used to fetch hooks.
+        """
+        self.api = api
+        self.concurrency = concurrency
+        if etagCache is None:
+            etagCache = ETagCache()
+        self.etagCache = etagCache
+
+    def reconcile(self, repos, name, config, events, active=True):
+        """
+        Reconcile the hooks of C{repos}, a list of C{(owner, name)}
+        tuples.
+
+        :return: A Deferred firing with a C{dict} summarizing the run: the
+                 number of hooks C{created}, C{edited}, C{deleted} and left
+                 C{unchanged}, the number of hook listings that were
+                 C{notModified}, the C{callsMade} and the C{callsSaved}
+                 compared to editing every repository unconditionally, and
+                 the L{Failure} of every repository that C{failed}.
+        """
+        summary = dict(created=0, edited=0, deleted=0, unchanged=0,
+                       notModified=0, callsMade=0, callsSaved=0, failed={})
+        lookups, hits = self.etagCache.lookups, self.etagCache.hits
+        semaphore = defer.DeferredSemaphore(self.concurrency)
+
+        def failed(reason, repo):
+            summary['failed'][repo] = reason
+
+        ds = []
+        for repo in repos:
+            d = semaphore.run(self._reconcileRepo, repo, name, config,
+                              events, active, summary)
+            d.addErrback(failed, repo)
+            ds.append(d)
+
+        def summarize(ignored):
+            fetches = self.etagCache.lookups - lookups
+            summary['notModified'] = self.etagCache.hits - hits
+            summary['callsMade'] += fetches
+            summary['callsSaved'] = (summary['unchanged'] +
+                                     summary['notModified'])
+            return summary
+        return defer.gatherResults(ds).addCallback(summarize)
+
+    @defer.inlineCallbacks
+    def _reconcileRepo(self, repo, name, config, events, active, summary):
+        repo_user, repo_name = repo
+        hooks = yield self.api.makeRequestAllPages(
+            ['repos', repo_user, repo_name, 'hooks'],
+            etagCache=self.etagCache)
+        matching = [hook for hook in hooks if _matches(hook, name, config)]
+
+        repos = self.api.repos
+        if not matching:
+            yield repos.createHook(repo_user, repo_name, name, config,
+                                   events, active)
+            summary['created'] += 1
+            summary['callsMade'] += 1
+            return
+
+        hook, duplicates = matching[0], matching[1:]
+        for duplicate in duplicates:
+            yield repos.deleteHook(repo_user, repo_name, duplicate['id'])
+            summary['deleted'] += 1
+            summary['callsMade'] += 1
+
+        if _isUpToDate(hook, config, events, active):
+            summary['unchanged'] += 1
+        else:
+            yield repos.editHook(repo_user, repo_name, hook['id'], name,
+                                 config, events=events, active=active)
+            summary['edited'] += 1
+            summary['callsMade'] += 1
@@ -0,0 +1,237 @@
+# This file is part of txgithub.  txgithub is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+"""
+A persistent outbox for write requests, so they survive restarts.
+"""
+
+import json
+import sqlite3
+
+from twisted.internet import defer
+from twisted.python import failure, log
+from twisted.web import error
+
+from txgithub.api import CircuitOpenError, _isOutage
+
+__all__ = ["Outbox"]
+
+
+def _retryable(reason):
+    """
+    Is C{reason} a failure a later attempt of the same write may not meet?
+    """
+    if reason.check(CircuitOpenError) or _isOutage(reason):
+        return True
+    if not reason.check(error.Error):
+        return False
+    status = str(reason.value.status)
+    if status == '429':
+        return True
+    # a 403 is only rate limiting if the headers say so, and otherwise a
+    # refusal which resending will not change
+    headers = getattr(reason.value, 'response_headers', None) or {}
+    return status == '403' and (
+        headers.get('x-ratelimit-remaining') == ['0'] or
+        'retry-after' in headers)
+
+
+def _native(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+class Outbox(object):
+    """
+    Records write requests in a sqlite database before they are sent, and
+    resends them in the background until GitHub has answered them, across
+    restarts of the process.
+
+    Delivery is at least once: a write that reached GitHub just before
+    the process stopped is sent again by the next L{start}.  Writes which
+    GitHub refuses, other than for rate limiting, are dropped, as are
+    writes which failed C{maxAttempts} times.
+
+    A write recorded with a C{key} supersedes the undelivered writes with
+    the same key, which are removed from the outbox, so that only the
+    newest of a burst of commit statuses for the same context is sent.
+    Writes with the same key are never sent concurrently.
+
+    Set an outbox as the C{outbox} of its L{txgithub.api.GithubApi} to send
+    commit statuses and issue comments through it.
+
+    The database is committed to synchronously, on the reactor thread,
+    whenever a write is recorded, fails or is delivered, so it should be
+    kept on a local disk.
+
+    @ivar compacted: The number of writes removed as superseded.
+    """
+
+    concurrency = 4
+    retryDelay = 5
+    maxRetryDelay = 300
+    # None to resend until delivered
+    maxAttempts = 20
+
+    def __init__(self, api, path, reactor=None):
+        """
+        :param path: The path of the sqlite database, which is created if
+                     it does not exist.
+        """
+        self.api = api
+        if reactor is None:
+            reactor = api.reactor
+        self.reactor = reactor
+        self._db = sqlite3.connect(path)
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS outbox ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " key TEXT,"
+                " url_args TEXT NOT NULL,"
+                " method TEXT NOT NULL,"
+                " post TEXT,"
+                " attempts INTEGER NOT NULL DEFAULT 0)")
+        self.compacted = 0
+        # write id -> Deferreds waiting for it to be delivered
+        self._waiters = {}
+        # write id -> key, of the writes being sent
+        self._sending = {}
+        # write id -> delayed call resending it
+        self._retries = {}
+        # write id -> timeout of each attempt to send it, if not the API's
+        self._timeouts = {}
+        self._semaphore = defer.DeferredSemaphore(self.concurrency)
+
+    def depth(self):
+        """
+        Return the number of writes not yet delivered.
+        """
+        return self._db.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def start(self):
+        """
+        Send the writes left in the outbox by a previous run.
+        """
+        for (id,) in self._db.execute(
+                "SELECT id FROM outbox ORDER BY id").fetchall():
+            self._deliver(id)
+
+    def stop(self):
+        """
+        Stop resending writes.  Those not yet delivered stay in the outbox.
+        """
+        for call in self._retries.values():
+            call.cancel()
+        self._retries.clear()
+
+    def send(self, url_args, method='POST', post=None, key=None,
+             timeout=None):
+        """
+        Record a write request, and send it.
+
+        :param key: A tuple identifying the resource written, or C{None}
+                    if the write supersedes no other.
+        :param timeout: Seconds each attempt to send the write may take,
+                        instead of the API's default.  It is not recorded:
+                        writes resent by a later outbox use the default.
+        :return: A Deferred firing with GitHub's answer once the write, or
+                 one superseding it, is delivered.
+        """
+        if key is not None:
+            key = json.dumps(list(key))
+        waiters = [defer.Deferred()]
+        with self._db:
+            if key is not None:
+                for (old,) in self._db.execute(
+                        "SELECT id FROM outbox WHERE key = ?",
+                        (key,)).fetchall():
+                    waiters.extend(self._waiters.pop(old, []))
+                    self._timeouts.pop(old, None)
+                    call = self._retries.pop(old, None)
+                    if call is not None:
+                        call.cancel()
+                    self.compacted += 1
+                self._db.execute("DELETE FROM outbox WHERE key = ?", (key,))
+            id = self._db.execute(
+                "INSERT INTO outbox (key, url_args, method, post)"
+                " VALUES (?, ?, ?, ?)",
+                (key, json.dumps(url_args), method,
+                 json.dumps(post))).lastrowid
+        self._waiters[id] = waiters
+        if timeout is not None:
+            self._timeouts[id] = timeout
+        self._deliver(id)
+        return waiters[0]
+
+    def _deliver(self, id):
+        if id in self._sending:
+            return
+        row = self._db.execute(
+            "SELECT key, url_args, method, post FROM outbox WHERE id = ?",
+            (id,)).fetchone()
+        if row is None:
+            return
+        key, url_args, method, post = row
+        if key is not None and key in self._sending.values():
+            # sent once the write it supersedes is answered
+            return
+        self._sending[id] = key
+        url_args = [_native(arg) for arg in json.loads(url_args)]
+        d = self._semaphore.run(self.api.makeRequest, url_args,
+                                method=_native(method), post=json.loads(post),
+                                timeout=self._timeouts.get(id))
+        d.addBoth(self._sent, id, key)
+
+    def _sent(self, result, id, key):
+        del self._sending[id]
+        # None if the write was superseded while it was being sent
+        row = self._db.execute(
+            "SELECT attempts FROM outbox WHERE id = ?", (id,)).fetchone()
+        if (row is not None and
+                isinstance(result, failure.Failure) and _retryable(result) and
+                (self.maxAttempts is None or row[0] + 1 < self.maxAttempts)):
+            attempts = row[0] + 1
+            with self._db:
+                self._db.execute(
+                    "UPDATE outbox SET attempts = ? WHERE id = ?",
+                    (attempts, id))
+            delay = min(self.retryDelay * 2 ** (attempts - 1),
+                        self.maxRetryDelay)
+            log.msg("outbox: resending write %d in %d seconds after %s; "
+                    "%d writes pending" % (id, delay,
+                                           result.getErrorMessage(),
+                                           self.depth()))
+            self._retries[id] = self.reactor.callLater(delay, self._retry, id)
+            return
+
+        with self._db:
+            self._db.execute("DELETE FROM outbox WHERE id = ?", (id,))
+        self._timeouts.pop(id, None)
+        waiters = self._waiters.pop(id, [])
+        for waiter in waiters:
+            waiter.callback(result)
+        if (isinstance(result, failure.Failure) and not waiters and
+                row is not None):
+            log.err(result, "outbox: dropping write %d" % (id,))
+        if key is not None:
+            for (following,) in self._db.execute(
+                    "SELECT id FROM outbox WHERE key = ?", (key,)).fetchall():
+                self._deliver(following)
+
+    def _retry(self, id):
+        del self._retries[id]
+        self._deliver(id)
@@ -1,27 +1,79 @@
 from __future__ import print_function
-from sys import exit, stdin
-from os import path
+from sys import exit, stderr, stdin
+from os import listdir, path
 from twisted.python import usage
 from twisted.internet import defer
-from txgithub.api import GithubApi
-from txgithub.token import getToken
 
-__all__ = ["Options", "postGist", "run"]
+__all__ = ["Options", "postGist", "postGists", "run"]
 
 
 _print = print
 _open = open
 
 
+def _printError(message):
+    _print(message, file=stderr)
+
+
+# txgithub.api imports the TLS and HTTP client machinery, which is slow;
+# load it only once a gist is posted, not for --help or usage errors
+def GithubApi(*args, **kwargs):
+    from txgithub.api import GithubApi
+    return GithubApi(*args, **kwargs)
+
+
+def getToken(*args, **kwargs):
+    from txgithub.token import getToken
+    return getToken(*args, **kwargs)
+
+
+# the size of the reads of files posted in batches
+_CHUNK_SIZE = 64 * 1024
+
+
 class Options(usage.Options):
-    synopsis = "[-t <token>] <files>"
-    optParameters = [["token", "t", None, "oauth token"]]
+    synopsis = "[-t <token>] [-g <files>]... [-d <directory>]... <files>"
+    optParameters = [["token", "t", None, "oauth token"],
+            ["concurrency", "c", 4, "number of gists to post at once", int]
+            ]
+
+    longdesc = ("Posts a gist of the files, or of stdin.  With --group or "
+                "--directory, posts many gists, printing their URLs as "
+                "they are posted, and skipping binary files.")
+
+    def __init__(self):
+        usage.Options.__init__(self)
+        self['groups'] = []
 
-    longdesc = "Posts a gist."
+    def opt_group(self, files):
+        """
+        Post a gist of the comma-separated files.
+        """
+        self['groups'].append(files.split(','))
+    opt_g = opt_group
+
+    def opt_directory(self, directory):
+        """
+        Post a gist of each file in the directory.
+        """
+        try:
+            names = listdir(directory)
+        except OSError as e:
+            raise usage.UsageError("cannot read directory %s: %s" % (
+                directory, e.strerror))
+        for name in sorted(names):
+            filename = path.join(directory, name)
+            if path.isfile(filename):
+                self['groups'].append([filename])
+    opt_d = opt_directory
 
     def parseArgs(self, *files):
         self['files'] = files
 
+    def postOptions(self):
+        if self['concurrency'] < 1:
+            raise usage.UsageError("--concurrency must be at least 1")
+
 
 @defer.inlineCallbacks
 def postGist(reactor, token, files):
@@ -42,6 +94,66 @@ def postGist(reactor, token, files):
     _print(response['html_url'])
 
 
+def _readText(name):
+    """
+    Read the file C{name} in chunks, returning its content, or C{None} if
+    it is binary.
+    """
+    chunks = []
+    with _open(name, 'rb') as f:
+        while True:
+            chunk = f.read(_CHUNK_SIZE)
+            if not chunk:
+                break
+            if b'\0' in chunk:
+                return None
+            chunks.append(chunk)
+    try:
+        return b''.join(chunks).decode('utf-8')
+    except UnicodeDecodeError:
+        return None
+
+
+@defer.inlineCallbacks
+def postGists(reactor, token, groups, concurrency=4):
+    """
+    Post a gist of each group of files, C{concurrency} at a time, and
+    print their URLs as they are posted.  The files of a group are only
+    read once it is its turn.  Binary files are skipped.
+    """
+    if not token:
+        token = yield getToken()
+
+    github = GithubApi(token)
+    semaphore = defer.DeferredSemaphore(concurrency)
+    failed = []
+
+    def post(group):
+        gistFiles = {}
+        for name in group:
+            content = _readText(name)
+            if content is None:
+                _printError('%s: skipping binary file' % (name,))
+            else:
+                gistFiles[path.basename(name)] = {"content": content}
+        if not gistFiles:
+            return None
+        d = github.gists.create(files=gistFiles)
+        d.addCallback(lambda response: _print(response['html_url']))
+        return d
+
+    def report(reason, group):
+        failed.append(group)
+        _printError('%s: %s' % (', '.join(group),
+                                reason.getErrorMessage()))
+
+    yield defer.gatherResults([
+        semaphore.run(post, group).addErrback(report, group)
+        for group in groups])
+    if failed:
+        exit(1)
+
+
 def run(reactor, *argv):
     config = Options()
     try:
@@ -51,4 +163,10 @@ def run(reactor, *argv):
         _print('%s: Try --help for usage details.' % (argv[0]))
         exit(1)
 
-    return postGist(reactor, **config)
+    if config.get('groups'):
+        groups = list(config['groups'])
+        if config['files']:
+            groups.append(config['files'])
+        return postGists(reactor, config['token'], groups,
+                         config['concurrency'])
+    return postGist(reactor, config['token'], config['files'])
@@ -0,0 +1,36 @@
+"""
+Checking that scripts leave slow modules unimported until they need them.
+"""
+import os
+import subprocess
+import sys
+
+from twisted.trial.unittest import SynchronousTestCase
+
+import txgithub
+
+
+# slow to import, and not needed to parse options
+_SLOW_MODULES = ("OpenSSL", "twisted.internet.ssl", "twisted.web.client",
+                 "txgithub.api")
+
+# resolved now, as trial changes directory before running tests
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(txgithub.__file__)))
+
+
+class _LazyImportTestCaseMixin(SynchronousTestCase):
+    """
+    A mixin that checks what a script imports, in a fresh interpreter.
+    """
+
+    def assert_lazy_imports(self, module):
+        """
+        Assert that importing C{module} imports none of the slow modules.
+        """
+        code = ("import sys; import %s; "
+                "print(' '.join(m for m in %r if m in sys.modules))" % (
+                    module, _SLOW_MODULES))
+        output = subprocess.check_output(
+            [sys.executable, "-c", code],
+            env=dict(os.environ, PYTHONPATH=_ROOT))
+        self.assertEqual(output.split(), [])
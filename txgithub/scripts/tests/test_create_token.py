@@ -14,6 +14,7 @@ from . _options import (_OptionsTestCaseMixin,
                         _FakePrintTestCaseMixin,
                         _FakeSystemExitTestCaseMixin,
                         _SystemExit)
+from . _imports import _LazyImportTestCaseMixin
 
 
 class OptionsTestCase(_OptionsTestCaseMixin):
@@ -245,3 +246,16 @@ class RunTests(_FakeOptionsTestCaseMixin,
         self.assertEqual(kwargs, dict(self.options))
 
         self.assertEqual(result, self.createToken_returns)
+
+
+class LazyImportTests(_LazyImportTestCaseMixin):
+    """
+    Tests for the imports of L{txgithub.scripts.create_token}.
+    """
+
+    def test_lazy_imports(self):
+        """
+        The TLS and HTTP client modules are not imported with the script,
+        so that --help is quick.
+        """
+        self.assert_lazy_imports("txgithub.scripts.create_token")
@@ -4,6 +4,7 @@ Tests for L{txgithub.scripts.gist}
 import io
 from collections import namedtuple
 from twisted.python import usage
+from twisted.python.filepath import FilePath
 from twisted.trial.unittest import SynchronousTestCase
 from twisted.internet.defer import Deferred, succeed
 
@@ -14,6 +15,7 @@ from . _options import (_OptionsTestCaseMixin,
                         _FakePrintTestCaseMixin,
                         _FakeSystemExitTestCaseMixin,
                         _SystemExit)
+from . _imports import _LazyImportTestCaseMixin
 
 
 class OptionsTestCase(_OptionsTestCaseMixin):
@@ -52,6 +54,46 @@ class OptionsTestCase(_OptionsTestCaseMixin):
         token = 'some token'
         self.assert_option(['-t', token], 'token', token)
 
+    def test_groups(self):
+        """
+        --group, or -g, adds a group of comma-separated files.
+        """
+        self.assert_option(['--group=a,b', '-g', 'c'], 'groups',
+                           [['a', 'b'], ['c']])
+
+    def test_directory(self):
+        """
+        --directory, or -d, adds a group for each file in the directory.
+        """
+        directory = FilePath(self.mktemp())
+        directory.child('sub').makedirs()
+        directory.child('b.log').setContent(b'b')
+        directory.child('a.log').setContent(b'a')
+        self.assert_option(['-d', directory.path], 'groups',
+                           [[directory.child('a.log').path],
+                            [directory.child('b.log').path]])
+
+    def test_concurrency(self):
+        """
+        --concurrency, or -c, is the number of gists posted at once.
+        """
+        self.assert_option(['-c', '8'], 'concurrency', 8)
+
+    def test_directory_missing(self):
+        """
+        A --directory which cannot be listed is a usage error.
+        """
+        self.assertRaises(usage.UsageError, self.config.parseOptions,
+                          ['-d', self.mktemp()])
+
+    def test_concurrency_positive(self):
+        """
+        A --concurrency below 1 is a usage error.
+        """
+        for concurrency in ['0', '-2']:
+            self.assertRaises(usage.UsageError, gist.Options().parseOptions,
+                              ['-c', concurrency, 'files'])
+
 
 class RecordsFakeGistsEndpoint(object):
     """
@@ -220,6 +262,90 @@ class PostGistTests(SynchronousTestCase):
         self.assertEqual(self.print_calls, [(url,)])
 
 
+class PostGistsTests(_FakeSystemExitTestCaseMixin,
+                     _FakePrintTestCaseMixin):
+    """
+    Tests for L{gist.postGists}.
+    """
+
+    def setUp(self):
+        super(PostGistsTests, self).setUp()
+        self.contents = {}
+        self.reads = []
+        self.creates = []
+        self.errors = []
+        self.patch(gist, "GithubApi", lambda token: self)
+        self.patch(gist, "_open", self.fake_open)
+        self.patch(gist, "_print", self.fake_print)
+        self.patch(gist, "_printError", self.errors.append)
+        self.patch(gist, "exit", self.fake_exit)
+
+    @property
+    def gists(self):
+        return self
+
+    def create(self, files):
+        self.creates.append((files, Deferred()))
+        return self.creates[-1][1]
+
+    def fake_open(self, name, mode):
+        self.assertEqual(mode, 'rb')
+        self.reads.append(name)
+        return io.BytesIO(self.contents[name])
+
+    def test_concurrency(self):
+        """
+        At most C{concurrency} gists are posted at once, and the files of
+        a group are only read once it is posted.  URLs are printed as the
+        gists are posted.
+        """
+        for name in 'abc':
+            self.contents[name] = name.encode('ascii')
+        d = gist.postGists("reactor", "token", [['a'], ['b'], ['c']],
+                           concurrency=2)
+        self.assertEqual(self.reads, ['a', 'b'])
+        self.assertEqual(self.creates[0][0], {'a': {'content': u'a'}})
+        self.creates[1][1].callback({'html_url': 'https://b'})
+        self.assertEqual(self.print_calls, [('https://b',)])
+        self.assertEqual(self.reads, ['a', 'b', 'c'])
+        self.creates[2][1].callback({'html_url': 'https://c'})
+        self.assertNoResult(d)
+        self.creates[0][1].callback({'html_url': 'https://a'})
+        self.successResultOf(d)
+        self.assertEqual(self.print_calls, [('https://b',), ('https://c',),
+                                            ('https://a',)])
+
+    def test_binary_skipped(self):
+        """
+        Binary files are skipped, and groups of only binary files are not
+        posted.
+        """
+        self.patch(gist, "_CHUNK_SIZE", 4)
+        self.contents.update({'log': b'text', 'late': b'text\0',
+                              'latin': b'caf\xe9'})
+        gist.postGists("reactor", "token", [['log', 'late'], ['latin']])
+        self.assertEqual([files for files, _ in self.creates],
+                         [{'log': {'content': u'text'}}])
+        self.assertEqual(self.errors, ['late: skipping binary file',
+                                       'latin: skipping binary file'])
+        self.assertEqual(self.print_calls, [])
+
+    def test_failures(self):
+        """
+        Gists that cannot be posted are reported, the others are still
+        posted, and the exit code is 1.
+        """
+        self.contents['a'] = b'a'
+        d = gist.postGists("reactor", "token", [['missing', 'a'], ['a']])
+        self.creates[0][1].errback(Exception("rate limited"))
+        self.failureResultOf(d, _SystemExit)
+        self.assertEqual(self.exit_calls, [1])
+        self.assertEqual(len(self.creates), 1)
+        self.assertEqual(self.errors[0][:9], 'missing, ')
+        self.assertEqual(self.errors[1], 'a: rate limited')
+        self.assertEqual(self.print_calls, [])
+
+
 _PostGistCall = namedtuple("_PostGistCall",
                            ["reactor", "token", "files"])
 
@@ -295,3 +421,36 @@ class RunTests(_FakeOptionsTestCaseMixin,
         self.assertEqual(call.files, self.options["files"])
 
         self.assertIs(result, self.postGist_returns)
+
+    def test_run_batch(self):
+        """
+        With groups of files, the gists are posted in a batch, with the
+        files on the command line as one more group.
+        """
+        calls = []
+        self.patch(gist, "postGists",
+                   lambda *args: calls.append(args) or "postGists")
+        self.options["token"] = "the token"
+        self.options["files"] = ("file1",)
+        self.options["groups"] = [["a", "b"]]
+        self.options["concurrency"] = 3
+
+        result = gist.run("reactor", self.argv0, "good args")
+
+        self.assertEqual(calls, [("reactor", "the token",
+                                  [["a", "b"], ("file1",)], 3)])
+        self.assertEqual(result, "postGists")
+        self.assertNot(self.postGist_calls)
+
+
+class LazyImportTests(_LazyImportTestCaseMixin):
+    """
+    Tests for the imports of L{txgithub.scripts.gist}.
+    """
+
+    def test_lazy_imports(self):
+        """
+        The TLS and HTTP client modules are not imported with the script,
+        so that --help is quick.
+        """
+        self.assert_lazy_imports("txgithub.scripts.gist")
@@ -0,0 +1,338 @@
+# This file is part of txgithub.  txgithub is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+"""
+Polling the events of very many repositories from several processes.
+
+The parent process runs an L{txgithub.events.EventMerger}, which decides
+when every repository is polled, and so keeps all the workers within a
+single rate limit budget.  Each poll is sent to the worker process the
+repository hashes to, which makes the requests and decodes the events,
+and sends them back to the parent as length-prefixed JSON messages over
+its standard input and output.  Only the C{fields} of each event the
+parent asks for are sent, so that it decodes far less than the workers.
+
+Run a worker with C{python -m txgithub.shard [baseURL]}; it finds its
+token with L{txgithub.token.getToken}.
+"""
+
+import bisect
+import hashlib
+import json
+import os
+import sys
+
+from twisted.internet import defer, protocol
+from twisted.protocols import basic
+from twisted.python import failure, log
+
+from txgithub.events import EventMerger
+
+__all__ = ["EVENT_FIELDS", "HashRing", "ShardPool", "ShardedEventMerger",
+           "WorkerError", "main"]
+
+# the fields of the events sent back by the workers by default
+EVENT_FIELDS = ('id', 'created_at', 'type', 'repo', 'actor', 'payload')
+
+
+def _hash(key):
+    return int(hashlib.md5(key).hexdigest()[:8], 16)
+
+
+def _encode(message):
+    return json.dumps(message, separators=(',', ':'))
+
+
+def _project(event, fields):
+    return dict((field, event[field]) for field in fields if field in event)
+
+
+class HashRing(object):
+    """
+    Maps keys to nodes by consistent hashing, so that adding or removing
+    a node only moves the keys of its share of the ring.
+    """
+
+    def __init__(self, nodes, replicas=100):
+        self._points = []
+        self._nodes = []
+        for node in nodes:
+            for i in range(replicas):
+                point = _hash('%s-%d' % (node, i))
+                index = bisect.bisect(self._points, point)
+                self._points.insert(index, point)
+                self._nodes.insert(index, node)
+
+    def nodeFor(self, key):
+        index = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._nodes[index]
+
+
+class WorkerError(Exception):
+    """
+    A worker process failed to poll a repository.
+    """
+
+
+class _Channel(basic.Int32StringReceiver):
+    """
+    Frames JSON messages, sending them with C{transport.write}.
+    """
+
+    def __init__(self, messageReceived):
+        self.messageReceived = messageReceived
+
+    def send(self, message):
+        self.sendString(_encode(message))
+
+    def stringReceived(self, string):
+        self.messageReceived(json.loads(string))
+
+
+class _WorkerProcess(protocol.ProcessProtocol):
+    """
+    The parent's end of the channel to a worker process.
+    """
+
+    def __init__(self, pool, name):
+        self.pool = pool
+        self.name = name
+        self._channel = _Channel(self._messageReceived)
+        self._nextId = 0
+        # request id -> Deferred waiting for the answer
+        self._pending = {}
+
+    def connectionMade(self):
+        self._channel.makeConnection(self.transport)
+
+    def outReceived(self, data):
+        self._channel.dataReceived(data)
+
+    def errReceived(self, data):
+        log.msg("shard %s: %s" % (self.name, data.rstrip()))
+
+    def getEvents(self, repo_user, repo_name, until_id):
+        self._nextId += 1
+        d = self._pending[self._nextId] = defer.Deferred()
+        self._channel.send(dict(id=self._nextId, repo=[repo_user, repo_name],
+                                until_id=until_id, fields=self.pool.fields))
+        return d
+
+    def _messageReceived(self, message):
+        d = self._pending.pop(message['id'])
+        if message.get('rateLimit'):
+            self.pool.rateLimitReported(message['rateLimit'])
+        if 'error' in message:
+            d.errback(WorkerError(message['error']))
+        else:
+            d.callback(message['events'])
+
+    def processEnded(self, reason):
+        pending, self._pending = self._pending, {}
+        for d in pending.values():
+            d.errback(reason)
+        self.pool.workerEnded(self)
+
+
+class ShardPool(object):
+    """
+    Worker processes polling the events of the repositories hashed to
+    them, restarted when they end.  It has the C{getEvents} of a
+    L{txgithub.api.ReposEndpoint}, and is used as such by
+    L{ShardedEventMerger}.
+
+    @ivar rateLimits: The rate limits reported by the workers, like
+        L{txgithub.api.GithubApi.rateLimits}.
+    @ivar fields: The fields of the events the workers send back, or
+        C{None} for whole events.
+    """
+
+    restartDelay = 1
+
+    def __init__(self, reactor, workers, token, baseURL=None,
+                 executable=sys.executable, fields=EVENT_FIELDS):
+        self.reactor = reactor
+        self.token = token
+        self.baseURL = baseURL
+        self.executable = executable
+        self.fields = None if fields is None else list(fields)
+        self.rateLimits = {}
+        self._names = ['shard-%d' % (i,) for i in range(workers)]
+        self._ring = HashRing(self._names)
+        self._workers = {}
+        self._stopping = False
+
+    def start(self):
+        for name in self._names:
+            self._spawn(name)
+
+    def stop(self):
+        self._stopping = True
+        for worker in self._workers.values():
+            worker.transport.closeStdin()
+
+    def _spawn(self, name):
+        if self._stopping:
+            return
+        worker = _WorkerProcess(self, name)
+        env = dict(os.environ, GITHUB_TOKEN=self.token)
+        args = [self.executable, '-m', 'txgithub.shard']
+        if self.baseURL is not None:
+            args.append(self.baseURL)
+        self.reactor.spawnProcess(worker, self.executable, args, env=env)
+        self._workers[name] = worker
+
+    def workerEnded(self, worker):
+        if self._workers.get(worker.name) is worker:
+            del self._workers[worker.name]
+            self.reactor.callLater(self.restartDelay, self._spawn,
+                                   worker.name)
+
+    def rateLimitReported(self, limit):
+        # the workers share a token, and so a rate limit: the latest window
+        # and the fewest requests left in it are the truth
+        core = self.rateLimits.get('core')
+        if (core is None or limit['reset'] > core['reset'] or
+                (limit['reset'] == core['reset'] and
+                 limit['remaining'] < core['remaining'])):
+            self.rateLimits['core'] = limit
+
+    def getEvents(self, repo_user, repo_name, until_id=None):
+        name = self._ring.nodeFor('%s/%s' % (repo_user, repo_name))
+        worker = self._workers.get(name)
+        if worker is None:
+            return defer.fail(WorkerError("%s is not running" % (name,)))
+        return worker.getEvents(repo_user, repo_name, until_id)
+
+
+class _PoolApi(object):
+    """
+    What an L{EventMerger} needs of a L{txgithub.api.GithubApi}, served by
+    a L{ShardPool}.
+    """
+
+    def __init__(self, pool):
+        self.reactor = pool.reactor
+        self.rateLimits = pool.rateLimits
+        self.repos = pool
+
+
+class ShardedEventMerger(EventMerger):
+    """
+    An L{EventMerger} polling repositories from C{workers} processes.
+    Call L{start} to spawn the workers and start polling, and L{stop} to
+    stop both.
+
+    Events are delivered with only their C{fields}, which must include
+    C{id} and C{created_at}, or whole if C{fields} is C{None}.
+    """
+
+    def __init__(self, reactor, token, repos, eventReceived, workers=4,
+                 baseURL=None, fields=EVENT_FIELDS, **kwargs):
+        self.pool = ShardPool(reactor, workers, token, baseURL,
+                              fields=fields)
+        EventMerger.__init__(self, _PoolApi(self.pool), repos,
+                             eventReceived, **kwargs)
+
+    def start(self):
+        self.pool.start()
+        EventMerger.start(self)
+
+    def stop(self):
+        EventMerger.stop(self)
+        self.pool.stop()
+
+
+class _ShardWorker(object):
+    """
+    The worker's end of the channel: polls repositories for the parent.
+    """
+
+    def __init__(self, api):
+        self.api = api
+        self.channel = _Channel(self.messageReceived)
+
+    def messageReceived(self, message):
+        # JSON strings decode as unicode, but URLs must be bytes
+        repo_user, repo_name = [part.encode('utf-8')
+                                for part in message['repo']]
+        d = self.api.repos.getEvents(repo_user, repo_name,
+                                     until_id=message['until_id'])
+        fields = message.get('fields')
+
+        def answer(result):
+            reply = dict(id=message['id'],
+                         rateLimit=self.api.rateLimits.get('core'))
+            if isinstance(result, failure.Failure):
+                reply['error'] = result.getErrorMessage()
+            elif fields is None:
+                reply['events'] = result
+            else:
+                reply['events'] = [_project(event, fields)
+                                   for event in result]
+            self.channel.send(reply)
+        d.addBoth(answer)
+
+
+class _WorkerStdio(protocol.Protocol):
+    def __init__(self, worker, reactor):
+        self.worker = worker
+        self.reactor = reactor
+
+    def connectionMade(self):
+        self.worker.channel.makeConnection(self.transport)
+
+    def dataReceived(self, data):
+        self.worker.channel.dataReceived(data)
+
+    def connectionLost(self, reason):
+        self.reactor.stop()
+
+
+def main(argv=None, reactor=None, standardIO=None):
+    """
+    Run a worker process, serving the parent on standard input and
+    output until it closes them.
+
+    :param standardIO: Called with the protocol to connect to standard
+                       input and output; L{twisted.internet.stdio.
+                       StandardIO} by default.
+    """
+    if reactor is None:
+        from twisted.internet import reactor
+    if standardIO is None:
+        from twisted.internet.stdio import StandardIO as standardIO
+    from txgithub.api import GithubApi
+    from txgithub.token import getToken
+
+    argv = sys.argv if argv is None else argv
+    baseURL = argv[1] if len(argv) > 1 else None
+
+    def serve(token):
+        api = GithubApi(token, baseURL=baseURL, reactor=reactor)
+        standardIO(_WorkerStdio(_ShardWorker(api), reactor))
+
+    def failed(reason):
+        log.err(reason, "starting shard worker")
+        reactor.stop()
+
+    log.startLogging(sys.stderr)
+    reactor.callWhenRunning(
+        lambda: getToken().addCallback(serve).addErrback(failed))
+    reactor.run()
+
+
+if __name__ == '__main__':
+    main()
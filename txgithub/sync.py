@@ -0,0 +1,238 @@
+# This file is part of txgithub.  txgithub is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+"""
+Incremental synchronisation of repository resources.
+"""
+
+from twisted.internet import defer
+
+from txgithub.api import ETagCache
+
+__all__ = ["PullRequestSync", "ReviewCommentIndex", "ReviewCommentSync"]
+
+
+def _advanceMark(mark, seen, changed, identify):
+    """
+    Return the mark following C{(mark, seen)} once C{changed} items have
+    been seen: the newest C{updated_at}, and the identities of the items
+    updated at that time.
+    """
+    if not changed:
+        return mark, seen
+    newest = max(item['updated_at'] for item in changed)
+    identities = [identify(item) for item in changed
+                  if item['updated_at'] == newest]
+    if newest == mark:
+        identities.extend(seen)
+    return newest, identities
+
+
+class PullRequestSync(object):
+    """
+    Fetches the pull requests of repositories that changed since they
+    were last synced.
+
+    For every repository, the sync remembers the newest C{updated_at} it
+    has seen, and the numbers of the pull requests updated at that time.
+    Pull requests are listed most recently updated first, and pagination
+    stops at the first one updated before that time.
+
+    @ivar marks: A C{dict} mapping C{(owner, name)} to a
+        C{(updated_at, numbers)} tuple.  It may be persisted and passed
+        to a new sync to resume from where it left off.
+    """
+
+    def __init__(self, api, marks=None):
+        self.api = api
+        if marks is None:
+            marks = {}
+        self.marks = marks
+
+    def sync(self, repo_user, repo_name):
+        """
+        Return a Deferred firing with a list of the pull requests of the
+        repository created or updated since the last sync, most recently
+        updated first.  The first sync returns every pull request.
+        """
+        key = (repo_user, repo_name)
+        mark, seen = self.marks.get(key, (None, ()))
+        changed = []
+
+        def pageReceived(pulls):
+            for pull in pulls:
+                if mark is not None and pull['updated_at'] < mark:
+                    return False
+                if pull['updated_at'] == mark and pull['number'] in seen:
+                    continue
+                changed.append(pull)
+
+        def advance(ignored):
+            if changed:
+                self.marks[key] = _advanceMark(
+                    mark, seen, changed, lambda pull: pull['number'])
+            return changed
+
+        d = self.api.pulls.listPages(repo_user, repo_name, pageReceived,
+                                     state='all', sort='updated',
+                                     direction='desc')
+        d.addCallback(advance)
+        return d
+
+
+class ReviewCommentSync(object):
+    """
+    Fetches the review comments of repositories that were created or
+    edited since they were last synced, using the C{since} parameter.
+
+    Deleted comments do not show up in those listings.  Every
+    C{fullSyncInterval} seconds a sync also lists the IDs of all comments,
+    with conditional requests so that unchanged pages cost no rate limit,
+    and reports the comments that have disappeared.
+
+    @ivar marks: A C{dict} mapping C{(owner, name)} to a
+        C{(updated_at, ids)} tuple: the newest update seen, and the IDs of
+        the comments updated at that time.
+    @ivar known: A C{dict} mapping C{(owner, name)} to the C{set} of IDs
+        of the comments known to exist.
+    @ivar lastFullSync: A C{dict} mapping C{(owner, name)} to the time of
+        the last full listing.
+
+    All three may be persisted and passed to a new sync to resume from
+    where it left off.
+    """
+
+    def __init__(self, api, fullSyncInterval=3600, marks=None, known=None,
+                 lastFullSync=None, etagCache=None, index=None):
+        """
+        :param index: A L{ReviewCommentIndex} to keep current with the
+                      changes found.
+        """
+        self.api = api
+        self.index = index
+        self.fullSyncInterval = fullSyncInterval
+        self.marks = {} if marks is None else marks
+        self.known = {} if known is None else known
+        self.lastFullSync = {} if lastFullSync is None else lastFullSync
+        if etagCache is None:
+            etagCache = ETagCache()
+        self.etagCache = etagCache
+
+    @defer.inlineCallbacks
+    def sync(self, repo_user, repo_name):
+        """
+        Return a Deferred firing with C{(changed, deleted)}: a list of the
+        review comments created or edited since the last sync, oldest
+        update first, and a list of the IDs of comments found to have
+        been deleted.  The first sync returns every comment.
+        """
+        key = (repo_user, repo_name)
+        mark, seen = self.marks.get(key, (None, ()))
+        changed = []
+
+        def pageReceived(comments):
+            for comment in comments:
+                if (comment['updated_at'] == mark and
+                        comment['id'] in seen):
+                    continue
+                changed.append(comment)
+
+        yield self.api.reviews.getRepoCommentsPages(
+            repo_user, repo_name, pageReceived, since=mark, sort='updated',
+            direction='asc')
+
+        known = self.known.setdefault(key, set())
+        known.update(comment['id'] for comment in changed)
+        deleted = []
+
+        now = self.api.reactor.seconds()
+        if mark is None:
+            self.lastFullSync[key] = now
+        elif now - self.lastFullSync.get(key, 0) >= self.fullSyncInterval:
+            existing = set()
+
+            def idsReceived(comments):
+                existing.update(comment['id'] for comment in comments)
+
+            yield self.api.reviews.getRepoCommentsPages(
+                repo_user, repo_name, idsReceived, etagCache=self.etagCache)
+            deleted = sorted(known - existing)
+            known.difference_update(deleted)
+            self.lastFullSync[key] = now
+
+        self.marks[key] = _advanceMark(mark, seen, changed,
+                                       lambda comment: comment['id'])
+        if self.index is not None:
+            for comment in changed:
+                self.index.add(key, comment)
+            for commentId in deleted:
+                self.index.remove(key, commentId)
+        defer.returnValue((changed, deleted))
+
+
+def _pullNumber(comment):
+    return int(comment['pull_request_url'].rstrip('/').rsplit('/', 1)[1])
+
+
+class ReviewCommentIndex(object):
+    """
+    An in-process index of review comments by repository, pull request,
+    path, diff position and the comment they reply to, so that a bot can
+    check whether it already commented on a line without asking GitHub.
+
+    It is kept current by L{ReviewCommentSync} when given as its
+    C{index}, and by the writes of
+    L{txgithub.api.ReviewCommentsEndpoint} when set as its C{index}.
+    """
+
+    def __init__(self):
+        self._byKey = {}
+        self._keys = {}
+
+    def __len__(self):
+        return len(self._keys)
+
+    def _key(self, repo, comment):
+        return (tuple(repo), _pullNumber(comment), comment.get('path'),
+                comment.get('position'), comment.get('in_reply_to_id'))
+
+    def add(self, repo, comment):
+        """
+        Index C{comment} of C{repo}, an C{(owner, name)} tuple, replacing
+        any earlier version of it.
+        """
+        self.remove(repo, comment['id'])
+        key = self._key(repo, comment)
+        self._byKey.setdefault(key, {})[comment['id']] = comment
+        self._keys[(tuple(repo), comment['id'])] = key
+
+    def remove(self, repo, commentId):
+        key = self._keys.pop((tuple(repo), commentId), None)
+        if key is None:
+            return
+        comments = self._byKey[key]
+        del comments[commentId]
+        if not comments:
+            del self._byKey[key]
+
+    def find(self, repo, pull_number, path, position, in_reply_to=None):
+        """
+        Return the comments on C{path} at diff C{position} of a pull
+        request, replying to the comment C{in_reply_to} or starting a
+        thread if it is C{None}, oldest first.
+        """
+        key = (tuple(repo), int(pull_number), path, position, in_reply_to)
+        return sorted(self._byKey.get(key, {}).values(),
+                      key=lambda comment: comment['id'])
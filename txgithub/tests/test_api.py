@@ -4,15 +4,28 @@ Tests for Twisted GitHub API bindings.
 from collections import namedtuple
 from twisted.trial.unittest import SynchronousTestCase
 
-from twisted.internet.defer import succeed
+from twisted.internet.defer import (CancelledError, Deferred, TimeoutError,
+                                    succeed)
+from twisted.internet.task import Clock
+from twisted.internet.error import ConnectionRefusedError
 from twisted.internet.main import CONNECTION_DONE
 from twisted.python import log
-from twisted.test.proto_helpers import MemoryReactor
+from twisted.python.failure import Failure
+from twisted.test.proto_helpers import MemoryReactorClock, StringTransport
+from twisted.web.error import Error, PageRedirect
 
 from txgithub.api import GithubApi as GitHubAPI
-from txgithub.api import (_GithubPageGetter,
+from txgithub.api import (CircuitOpenError,
+                          ETagCache,
+                          GitDataEndpoint,
+                          GraphQLError,
+                          HedgingPolicy,
+                          ReposEndpoint,
+                          Response,
+                          _GithubPageGetter,
                           _GithubHTTPClientFactory)
 from txgithub.constants import HOSTED_BASE_URL
+from txgithub.sync import ReviewCommentIndex
 
 import urlparse
 
@@ -75,7 +88,7 @@ class _GithubApiTestCase(SynchronousTestCase):
     """
 
     def setUp(self):
-        self.reactor = MemoryReactor()
+        self.reactor = MemoryReactorClock()
 
         self.base_url = "https://baseurl"
 
@@ -113,6 +126,21 @@ class GithubApiTest(_GithubApiTestCase):
         with self.assertRaises(AssertionError):
             GitHubAPI("")._makeHeaders()
 
+    def test_tokenProvider(self):
+        """
+        With a token provider, each request is made with the token it
+        provides.
+        """
+        token = Deferred()
+        api = GitHubAPI(None, reactor=self.reactor,
+                        tokenProvider=lambda: token)
+        api.makeRequest(["a"])
+        self.assertEqual(self.reactor.sslClients, [])
+        token.callback("installation token")
+        factory = self.reactor.sslClients[-1][2]
+        self.assertEqual(factory.headers["Authorization"],
+                         "token installation token")
+
     def test_makeHeaders(self):
         """
         The provided OAuth token is added to the request headers.
@@ -168,10 +196,13 @@ class GithubApiMakeRequestTests(_GithubApiTestCase):
 
     def test_timeout(self):
         """
-        Requests have a timeout.
+        Requests time out after 30 seconds by default.
         """
-        # just hard coded for now
-        self.assertEqual(self.factory_from_makeRequest([]).timeout, 30)
+        d = self.api.makeRequest([])
+        self.reactor.advance(29)
+        self.assertNoResult(d)
+        self.reactor.advance(1)
+        self.failureResultOf(d, TimeoutError)
 
     def test_agent_set(self):
         """
@@ -202,6 +233,16 @@ class GithubApiMakeRequestTests(_GithubApiTestCase):
         factory = self.factory_from_makeRequest(["a", "b", "c"], page=1)
         self.assertEqual(factory.url, self.base_url + "a/b/c?page=1")
 
+    def test_constructs_url_with_params(self):
+        """
+        The request URL contains the query parameters, before the page
+        number.
+        """
+        factory = self.factory_from_makeRequest(
+            ["a"], params={"state": "all", "sort": "updated"}, page=2)
+        self.assertEqual(factory.url,
+                         self.base_url + "a?sort=updated&state=all&page=2")
+
     def test_default_GET(self):
         """
         The default method is GET.
@@ -237,6 +278,21 @@ class GithubApiMakeRequestTests(_GithubApiTestCase):
         self.complete_response(factory)
         self.assertIs(self.api.last_response_headers, headers)
 
+    def test_error_response_headers(self):
+        """
+        The headers of a response with an error status are set on its
+        L{Error}.
+        """
+        headers = {"x-ratelimit-remaining": ["0"]}
+
+        d = self.api.makeRequest([])
+        factory = self.connectSSL_call().factory
+        factory.response_headers = headers
+        factory.noPage(Failure(Error(b"403", b"Forbidden")))
+        self.complete_response(factory)
+        failure = self.failureResultOf(d, Error)
+        self.assertIs(failure.value.response_headers, headers)
+
     def test_check_ratelimit_almost_exhausted(self):
         """
         A log message is generated when the number of remaining requests
@@ -274,6 +330,25 @@ class GithubApiMakeRequestTests(_GithubApiTestCase):
         self.assertFalse(self.api.rateLimitWarningIssued)
         self.assertFalse(self.log_events)
 
+    def test_rate_limits_per_resource(self):
+        """
+        The rate limit of each resource is recorded, and the warning is
+        only about the core rate limit.
+        """
+        factory = self.factory_from_makeRequest([])
+        factory.response_headers = {'x-ratelimit-resource': ['search'],
+                                    'x-ratelimit-limit': ['30'],
+                                    'x-ratelimit-remaining': ['1'],
+                                    'x-ratelimit-reset': ['1060']}
+        del self.log_events[:]
+        factory.page("")
+        self.complete_response(factory)
+
+        self.assertEqual(self.api.rateLimits,
+                         {'search': dict(limit=30, remaining=1, reset=1060)})
+        self.assertFalse(self.api.rateLimitWarningIssued)
+        self.assertFalse(self.log_events)
+
     def test_json_deserialize(self):
         """
         The body of the response is deserialized as JSON.
@@ -290,44 +365,886 @@ class GithubApiMakeRequestTests(_GithubApiTestCase):
         result = self.successResultOf(response_deferred)
         self.assertEqual(result, {u"body": u"value"})
 
-    def assert_makeRequestAllPages_downloads(self, pages, headers):
+    def test_extra_headers(self):
+        """
+        Extra headers are sent along with the authorization header.
+        """
+        factory = self.factory_from_makeRequest(
+            [], headers={"Accept": "application/vnd.github.diff"})
+        self.assertEqual(factory.headers["Accept"],
+                         "application/vnd.github.diff")
+        self.assertEqual(factory.headers["Authorization"], self.token_header)
+
+    def streamed_request(self, chunks, status=b"200 OK"):
+        """
+        Make a request streaming its body to a list, answered with
+        C{chunks}.
+        """
+        received = []
+        d = self.api.makeRequest([], bodyReceived=received.append)
+        factory = self.connectSSL_call().factory
+        protocol = factory.buildProtocol("ignored")
+        protocol.makeConnection(StringTransport())
+        protocol.dataReceived(b"HTTP/1.0 " + status + b"\r\n"
+                              b"Content-Length: %d\r\n\r\n"
+                              % (sum(len(chunk) for chunk in chunks),))
+        for chunk in chunks:
+            protocol.dataReceived(chunk)
+        protocol.connectionLost(Failure(CONNECTION_DONE))
+        return d, received
+
+    def test_streamed_body(self):
+        """
+        A streamed response body is delivered as it arrives instead of
+        being deserialized.
+        """
+        d, received = self.streamed_request([b"one ", b"two"])
+        self.assertEqual(received, [b"one ", b"two"])
+        self.assertIsNone(self.successResultOf(d))
+
+    def test_streamed_error(self):
+        """
+        The body of an error response is not streamed.
+        """
+        d, received = self.streamed_request([b"nope"], b"404 Not Found")
+        self.assertEqual(received, [])
+        self.assertEqual(self.failureResultOf(d, Error).value.status,
+                         b"404")
+
+    def test_streamed_consumer_failure(self):
+        """
+        An exception raised by the consumer of a streamed body fails the
+        request.
+        """
+        d = self.api.makeRequest([], bodyReceived=lambda data: 1 / 0)
+        factory = self.connectSSL_call().factory
+        protocol = factory.buildProtocol("ignored")
+        transport = StringTransport()
+        protocol.makeConnection(transport)
+        protocol.dataReceived(b"HTTP/1.0 200 OK\r\n\r\nbody")
+        self.assertTrue(transport.disconnecting)
+        protocol.connectionLost(Failure(CONNECTION_DONE))
+        self.failureResultOf(d, ZeroDivisionError)
+
+    def assert_makeRequestAllPages_downloads(self, pages, headers):
+        """
+        Assert all C{pages} have been downloaded.
+        """
+        page_headers = iter(zip(pages, headers))
+        calls = []
+
+        def fake_makeRequest(url_args, page, fullResponse):
+            calls.append((url_args, page))
+            page, headers = next(page_headers)
+            return succeed(Response('200', headers, [page]))
+
+        self.api.makeRequest = fake_makeRequest
+        data = self.successResultOf(self.api.makeRequestAllPages([]))
+
+        self.assertEqual(calls, [([], i) for i in range(1, len(pages) + 1)])
+        self.assertEqual(data, pages)
+
+    def test_makeRequestAllPages_single_page(self):
+        """
+        A single page resource is retrieved and returned.
+        """
+        pages = [{"page": 1}]
+        headers = [{}]
+        self.assert_makeRequestAllPages_downloads(pages, headers)
+
+    def test_makeRequestAllPages_multiple_pages(self):
+        """
+        All pages of a multi-page resource are retrieved and returned
+        together.
+        """
+        pages = [{"page": 1}, {"page": 2}, {"page": 3}]
+        headers = [{"link": ['<https://something>; rel="next"']},
+                   {"link": ['<https://else>; rel="next", '
+                             '<https://something>; rel="last"']},
+                   {"link": ['<https://else>; rel="last"']}]
+        self.assert_makeRequestAllPages_downloads(pages, headers)
+
+    def test_makeRequestPages_stops(self):
+        """
+        L{GithubApi.makeRequestPages} stops fetching pages when the page
+        callback returns C{False}.
+        """
+        calls = []
+
+        def fake_makeRequest(url_args, page, fullResponse):
+            calls.append(page)
+            return succeed(Response(
+                '200', {"link": ['<https://something>; rel="next"']},
+                [page]))
+
+        self.api.makeRequest = fake_makeRequest
+        received = []
+
+        def pageReceived(content):
+            received.extend(content)
+            return len(received) < 2
+
+        d = self.api.makeRequestPages([], pageReceived)
+        self.assertIsNone(self.successResultOf(d))
+        self.assertEqual(received, [1, 2])
+        self.assertEqual(calls, [1, 2])
+
+
+class GithubApiCancellationTests(_GithubApiTestCase):
+    """
+    Tests for cancelling the L{Deferred}s returned by
+    L{GithubApi.makeRequest} and L{GithubApi.makeRequestAllPages}.
+    """
+
+    def test_cancel_while_connecting(self):
+        """
+        Cancelling a request that has not connected yet stops the
+        connection attempt.
+        """
+        d = self.api.makeRequest([])
+        d.cancel()
+        self.failureResultOf(d, CancelledError)
+        [connector] = self.reactor.connectors
+        self.assertTrue(connector._disconnected)
+
+    def test_cancel_while_connected(self):
+        """
+        Cancelling a request in flight aborts its connection, and the
+        subsequent loss of the connection is ignored.
+        """
+        d = self.api.makeRequest([])
+        factory = self.reactor.sslClients[-1][2]
+        protocol = factory.buildProtocol("ignored")
+        transport = StringTransport()
+        protocol.makeConnection(transport)
+
+        d.cancel()
+        self.failureResultOf(d, CancelledError)
+        self.assertTrue(transport.disconnecting)
+        self.assertFalse(self.reactor.connectors[-1]._disconnected)
+
+        protocol.connectionLost(Failure(ConnectionRefusedError()))
+
+    def test_cancel_releases_breaker_probe(self):
+        """
+        Cancelling a half-open probe lets another probe through.
+        """
+        self.api = GitHubAPI(self.oauth_token, baseURL=self.base_url,
+                             reactor=self.reactor, breakerThreshold=1,
+                             breakerResetTimeout=10)
+        self.api._breakerFor([]).recordFailure()
+        self.reactor.advance(10)
+
+        probe = self.api.makeRequest([])
+        probe.cancel()
+        self.failureResultOf(probe, CancelledError)
+        self.api.makeRequest([])
+        self.assertEqual(len(self.reactor.sslClients), 2)
+
+    def test_cancel_makeRequestAllPages(self):
+        """
+        Cancelling L{GithubApi.makeRequestAllPages} cancels the page in
+        flight and fetches no further pages.
+        """
+        pages = []
+        cancelled = []
+
+        def fake_makeRequest(url_args, page, fullResponse):
+            pages.append(Deferred(cancelled.append))
+            return pages[-1]
+
+        self.api.makeRequest = fake_makeRequest
+        d = self.api.makeRequestAllPages([])
+        pages[0].callback(Response(
+            '200', {"link": ['<https://something>; rel="next"']}, [1]))
+
+        d.cancel()
+        self.failureResultOf(d, CancelledError)
+        self.assertEqual(cancelled, [pages[1]])
+        self.assertEqual(len(pages), 2)
+
+    def test_makeRequestAllPages_failure(self):
+        """
+        A failure fetching any page fails L{GithubApi.makeRequestAllPages}.
+        """
+        self.api.makeRequest = lambda url_args, page, fullResponse: succeed(
+            Response('200', {}, None))
+        self.failureResultOf(self.api.makeRequestAllPages([]), TypeError)
+
+
+class GithubApiTimeoutTests(_GithubApiTestCase):
+    """
+    Tests for the timeouts of L{GithubApi.makeRequest} and
+    L{GithubApi.makeRequestAllPages}.
+    """
+
+    def connect(self, factory):
+        """
+        Connect C{factory} to a L{StringTransport}, returning its
+        protocol.
+        """
+        protocol = factory.buildProtocol("ignored")
+        protocol.makeConnection(StringTransport())
+        return protocol
+
+    def test_client_timeout(self):
+        """
+        The client's C{timeout} is the default total timeout of requests.
+        """
+        self.api = GitHubAPI(self.oauth_token, baseURL=self.base_url,
+                             reactor=self.reactor, timeout=5)
+        d = self.api.makeRequest([])
+        self.reactor.advance(5)
+        self.failureResultOf(d, TimeoutError)
+
+    def test_call_timeout(self):
+        """
+        A C{timeout} given to a call overrides the client's.
+        """
+        d = self.api.makeRequest([], timeout=2)
+        self.reactor.advance(2)
+        self.failureResultOf(d, TimeoutError)
+        self.assertTrue(self.reactor.connectors[-1]._disconnected)
+
+    def test_no_timeout(self):
+        """
+        A C{timeout} of C{0} given to a call disables the client's.
+        """
+        d = self.api.makeRequest([], timeout=0)
+        self.reactor.advance(self.api.timeout)
+        self.assertNoResult(d)
+        self.assertEqual(self.reactor.getDelayedCalls(), [])
+
+    def test_timeout_cancelled(self):
+        """
+        The timeout is cancelled once the request completes.
+        """
+        d = self.api.makeRequest([])
+        factory = self.reactor.sslClients[-1][2]
+        factory.response_headers = {}
+        factory.page("")
+        factory.buildProtocol("ignored").connectionLost(CONNECTION_DONE)
+        self.successResultOf(d)
+        self.assertEqual(self.reactor.getDelayedCalls(), [])
+
+    def test_connect_timeout(self):
+        """
+        The connect timeout is passed to the reactor.
+        """
+        self.api.makeRequest([])
+        self.api.makeRequest([], connectTimeout=3)
+        self.assertEqual([args[4] for args in self.reactor.sslClients],
+                         [30, 3])
+
+    def test_idle_timeout(self):
+        """
+        A request fails once no data has been received for its idle
+        timeout.
+        """
+        d = self.api.makeRequest([], idleTimeout=5)
+        protocol = self.connect(self.reactor.sslClients[-1][2])
+        self.reactor.advance(4)
+        protocol.dataReceived(b"HTTP/1.1 200 OK\r\n")
+        self.reactor.advance(4)
+        self.assertNoResult(d)
+
+        self.reactor.advance(1)
+        self.assertTrue(protocol.transport.disconnecting)
+        protocol.connectionLost(CONNECTION_DONE)
+        self.failureResultOf(d, TimeoutError)
+
+    def test_no_idle_timeout(self):
+        """
+        By default, requests have no idle timeout.
+        """
+        self.api = GitHubAPI(self.oauth_token, baseURL=self.base_url,
+                             reactor=self.reactor, timeout=None)
+        self.api.makeRequest([])
+        self.connect(self.reactor.sslClients[-1][2])
+        self.assertEqual(self.reactor.getDelayedCalls(), [])
+
+    def test_makeRequestAllPages_deadline(self):
+        """
+        The timeout of L{GithubApi.makeRequestAllPages} covers all pages.
+        """
+        pages = []
+
+        def fake_makeRequest(url_args, page, fullResponse):
+            pages.append(Deferred())
+            return pages[-1]
+
+        self.api.makeRequest = fake_makeRequest
+        d = self.api.makeRequestAllPages([], timeout=10)
+        self.reactor.advance(6)
+        pages[0].callback(Response(
+            '200', {"link": ['<https://something>; rel="next"']}, [1]))
+        self.reactor.advance(4)
+
+        self.failureResultOf(d, TimeoutError)
+        self.assertEqual(len(pages), 2)
+
+    def test_createStatus_timeout(self):
+        """
+        L{ReposEndpoint.createStatus} accepts a timeout for its request.
+        """
+        d = self.api.repos.createStatus("user", "repo", "sha", "success",
+                                        timeout=2)
+        self.reactor.advance(2)
+        self.failureResultOf(d, TimeoutError)
+
+
+class HedgingPolicyTests(SynchronousTestCase):
+    """
+    Tests for L{HedgingPolicy}.
+    """
+
+    def test_initial_delay(self):
+        """
+        Until enough latencies have been recorded, the initial delay is
+        used.
+        """
+        policy = HedgingPolicy(initialDelay=2, minSamples=3)
+        policy.recordLatency("group", 0.1)
+        policy.recordLatency("group", 0.1)
+        self.assertEqual(policy.delayFor("group"), 2)
+
+    def test_percentile_delay(self):
+        """
+        The delay is the requested percentile of recent latencies of the
+        route group.
+        """
+        policy = HedgingPolicy(percentile=90, minSamples=10)
+        for latency in range(1, 11):
+            policy.recordLatency("group", latency)
+        self.assertEqual(policy.delayFor("group"), 9)
+        self.assertEqual(policy.delayFor("other"), policy.initialDelay)
+
+    def test_budget(self):
+        """
+        Each request earns a fraction of a hedge, up to a limit.
+        """
+        policy = HedgingPolicy(budget=0.5, maxBurst=1)
+        policy.requestStarted()
+        self.assertFalse(policy.spend())
+        for i in range(4):
+            policy.requestStarted()
+        self.assertTrue(policy.spend())
+        self.assertFalse(policy.spend())
+        self.assertEqual(policy.hedgesSent, 1)
+
+
+class GithubApiHedgingTests(_GithubApiTestCase):
+    """
+    Tests for hedged requests made by L{GithubApi.makeRequest}.
+    """
+
+    def setUp(self):
+        super(GithubApiHedgingTests, self).setUp()
+        self.policy = HedgingPolicy(budget=1, initialDelay=2)
+        self.api = GitHubAPI(self.oauth_token, baseURL=self.base_url,
+                             reactor=self.reactor, hedging=self.policy)
+
+    def respond(self, index, body=b"[]"):
+        """
+        Complete the request made by the C{index}th connection.
+        """
+        factory = self.reactor.sslClients[index][2]
+        factory.response_headers = {}
+        factory.page(body)
+        factory.buildProtocol("ignored").connectionLost(CONNECTION_DONE)
+
+    def test_hedge_wins(self):
+        """
+        A duplicate request is sent after the hedging delay, and when it
+        answers first its response is used and the original cancelled.
+        """
+        d = self.api.makeRequest(["repos", "user", "name", "hooks", "1"])
+        self.assertEqual(len(self.reactor.sslClients), 1)
+        self.reactor.advance(2)
+        self.assertEqual(len(self.reactor.sslClients), 2)
+
+        self.respond(1, b'{"id": 1}')
+        self.assertEqual(self.successResultOf(d), {"id": 1})
+        self.assertTrue(self.reactor.connectors[0]._disconnected)
+        self.assertEqual(self.policy.hedgesWon, 1)
+
+    def test_original_wins(self):
+        """
+        When the original request answers first the hedge is cancelled.
+        """
+        d = self.api.makeRequest([])
+        self.reactor.advance(2)
+        self.respond(0)
+        self.assertEqual(self.successResultOf(d), [])
+        self.assertTrue(self.reactor.connectors[1]._disconnected)
+        self.assertEqual(self.policy.hedgesWon, 0)
+
+    def test_fast_response_not_hedged(self):
+        """
+        No duplicate is sent for a request answering within the delay,
+        and its latency is recorded.
+        """
+        d = self.api.makeRequest([])
+        self.reactor.advance(1)
+        self.respond(0)
+        self.successResultOf(d)
+        self.reactor.advance(10)
+        self.assertEqual(len(self.reactor.sslClients), 1)
+        self.assertEqual(list(self.policy._latencies[""]), [1])
+
+    def test_failure_waits_for_other_attempt(self):
+        """
+        If one attempt fails while the other is pending, the other one's
+        outcome is used.
+        """
+        d = self.api.makeRequest([])
+        self.reactor.advance(2)
+        factory = self.reactor.sslClients[0][2]
+        factory.noPage(Failure(ConnectionRefusedError()))
+        factory.buildProtocol("ignored").connectionLost(CONNECTION_DONE)
+        self.assertNoResult(d)
+
+        self.respond(1)
+        self.assertEqual(self.successResultOf(d), [])
+
+    def test_budget_exhausted(self):
+        """
+        No duplicate is sent once the hedging budget is spent.
+        """
+        self.policy.budget = 0
+        self.api.makeRequest([])
+        self.reactor.advance(2)
+        self.assertEqual(len(self.reactor.sslClients), 1)
+
+    def test_writes_not_hedged(self):
+        """
+        Only GET requests are hedged.
+        """
+        self.api.makeRequest([], method="POST", post={"a": 1})
+        self.reactor.advance(2)
+        self.assertEqual(len(self.reactor.sslClients), 1)
+
+    def test_cancel(self):
+        """
+        Cancelling a hedged request cancels every attempt.
+        """
+        d = self.api.makeRequest([])
+        self.reactor.advance(2)
+        d.cancel()
+        self.failureResultOf(d, CancelledError)
+        self.assertTrue(self.reactor.connectors[0]._disconnected)
+        self.assertTrue(self.reactor.connectors[1]._disconnected)
+
+
+class GithubApiConditionalRequestTests(_GithubApiTestCase):
+    """
+    Tests for conditional requests made with an L{ETagCache}.
+    """
+
+    def setUp(self):
+        super(GithubApiConditionalRequestTests, self).setUp()
+        self.cache = ETagCache()
+
+    def respond(self, status, body, headers):
+        """
+        Complete the last request with C{status}, C{body} and
+        C{headers}.
+        """
+        factory = self.reactor.sslClients[-1][2]
+        factory.status = status
+        factory.response_headers = headers
+        factory.page(body)
+        factory.buildProtocol("ignored").connectionLost(CONNECTION_DONE)
+        return factory
+
+    def test_etag_remembered(self):
+        """
+        The ETag of a response is remembered and sent with the next
+        request for the same URL.
+        """
+        d = self.api.makeRequest(["a"], etagCache=self.cache)
+        factory = self.respond("200", b'[1]', {"etag": ['"abc"']})
+        self.assertNotIn("If-None-Match", factory.headers)
+        self.assertEqual(self.successResultOf(d), [1])
+
+        self.api.makeRequest(["a"], etagCache=self.cache)
+        factory = self.reactor.sslClients[-1][2]
+        self.assertEqual(factory.headers["If-None-Match"], '"abc"')
+
+    def test_not_modified(self):
+        """
+        A 304 response is answered from the cache, keeping the pagination
+        links of the cached response.
+        """
+        self.api.makeRequest(["a"], etagCache=self.cache)
+        link = ['<https://something>; rel="next"']
+        self.respond("200", b'[1]', {"etag": ['"abc"'], "link": link})
+
+        d = self.api.makeRequest(["a"], etagCache=self.cache)
+        self.respond("304", b"", {})
+        self.assertEqual(self.successResultOf(d), [1])
+        self.assertEqual(self.api.last_response_headers["link"], link)
+        self.assertEqual((self.cache.lookups, self.cache.hits), (2, 1))
+
+    def test_writes_not_conditional(self):
+        """
+        Only GET requests are conditional.
+        """
+        self.api.makeRequest(["a"], etagCache=self.cache)
+        self.respond("200", b'[1]', {"etag": ['"abc"']})
+        self.api.makeRequest(["a"], method="PATCH", post={"a": 1},
+                             etagCache=self.cache)
+        factory = self.reactor.sslClients[-1][2]
+        self.assertNotIn("If-None-Match", factory.headers)
+        self.assertEqual(self.cache.lookups, 1)
+
+    def test_cache_bounded(self):
+        """
+        The least recently used entries are evicted from a full cache.
+        """
+        cache = ETagCache(maxEntries=2)
+        cache.put("a", "1", "", {})
+        cache.put("b", "2", "", {})
+        cache.get("a")
+        cache.put("c", "3", "", {})
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), ("1", "", {}))
+
+
+class GithubApiCircuitBreakerTests(_GithubApiTestCase):
+    """
+    Tests for the circuit breaking of L{GithubApi.makeRequest}.
+    """
+
+    def setUp(self):
+        super(GithubApiCircuitBreakerTests, self).setUp()
+        self.api = GitHubAPI(self.oauth_token,
+                             baseURL=self.base_url,
+                             reactor=self.reactor,
+                             breakerThreshold=2,
+                             breakerResetTimeout=10)
+
+    def request(self, url_args=("repos", "user", "name", "statuses")):
+        """
+        Make a request and return its L{Deferred} and the factory it
+        connected with, or C{None} if no connection was attempted.
+        """
+        connections = len(self.reactor.sslClients)
+        d = self.api.makeRequest(list(url_args))
+        if len(self.reactor.sslClients) == connections:
+            return d, None
+        return d, self.reactor.sslClients[-1][2]
+
+    def fail_request(self, reason=None, url_args=None):
+        """
+        Make a request that fails with C{reason}.
+        """
+        d, factory = self.request(*filter(None, [url_args]))
+        factory.noPage(Failure(reason or ConnectionRefusedError()))
+        self.complete(factory)
+        self.failureResultOf(d)
+
+    def complete(self, factory):
+        """
+        Lose C{factory}'s connection so its C{deferred} fires.
+        """
+        factory.buildProtocol("ignored").connectionLost(CONNECTION_DONE)
+
+    def succeed_request(self):
+        """
+        Make a request that succeeds.
+        """
+        d, factory = self.request()
+        factory.response_headers = {}
+        factory.page("")
+        self.complete(factory)
+        self.successResultOf(d)
+
+    def test_opens_after_consecutive_failures(self):
+        """
+        Once the threshold of consecutive failures is reached, requests
+        fail with L{CircuitOpenError} without connecting.
+        """
+        self.fail_request()
+        self.fail_request()
+
+        d, factory = self.request()
+        self.assertIsNone(factory)
+        self.failureResultOf(d, CircuitOpenError)
+        self.assertEqual(
+            self.api.breakerStates(),
+            {(self.base_url, "repos/statuses"): "open"})
+
+    def test_success_resets_count(self):
+        """
+        A success between failures resets the count of consecutive
+        failures.
+        """
+        self.fail_request()
+        self.succeed_request()
+        self.fail_request()
+        self.succeed_request()
+
+    def test_client_errors_are_not_outages(self):
+        """
+        HTTP 4xx responses do not count as failures.
+        """
+        self.fail_request(Error(b"404", b"Not Found"))
+        self.fail_request(Error(b"404", b"Not Found"))
+        self.succeed_request()
+
+    def test_server_errors_are_outages(self):
+        """
+        HTTP 5xx responses count as failures.
+        """
+        self.fail_request(Error(b"502", b"Bad Gateway"))
+        self.fail_request(Error(b"503", b"Unavailable"))
+        self.failureResultOf(self.request()[0], CircuitOpenError)
+
+    def test_scoped_per_route_group(self):
+        """
+        An open breaker only affects its own group of routes.
+        """
+        self.fail_request()
+        self.fail_request()
+        d, factory = self.request(["repos", "user", "name", "hooks"])
+        self.assertIsNotNone(factory)
+        self.assertEqual(self.api.breakerStates()[
+            (self.base_url, "repos/hooks")], "closed")
+
+    def test_shared_breakers(self):
+        """
+        Clients given the same C{breakers} share breaker state.
+        """
+        breakers = {}
+        self.api = GitHubAPI(self.oauth_token, baseURL=self.base_url,
+                             reactor=self.reactor, breakerThreshold=2,
+                             breakers=breakers)
+        self.fail_request()
+        self.fail_request()
+
+        other = GitHubAPI(self.oauth_token, baseURL=self.base_url,
+                          reactor=self.reactor, breakers=breakers)
+        self.failureResultOf(other.makeRequest(["repos", "user", "name",
+                                                "statuses"]),
+                             CircuitOpenError)
+
+    def test_half_open_probe_closes(self):
+        """
+        After the reset timeout a single probe is let through, and its
+        success closes the breaker.
+        """
+        self.fail_request()
+        self.fail_request()
+        self.reactor.advance(10)
+
+        probe, factory = self.request()
+        self.assertIsNotNone(factory)
+        self.failureResultOf(self.request()[0], CircuitOpenError)
+        self.assertEqual(
+            self.api.breakerStates()[(self.base_url, "repos/statuses")],
+            "half-open")
+
+        factory.response_headers = {}
+        factory.page("")
+        self.complete(factory)
+        self.successResultOf(probe)
+        self.succeed_request()
+        self.assertEqual(
+            self.api.breakerStates()[(self.base_url, "repos/statuses")],
+            "closed")
+
+    def test_half_open_probe_reopens(self):
+        """
+        A failed probe re-opens the breaker for another reset timeout.
+        """
+        self.fail_request()
+        self.fail_request()
+        self.reactor.advance(10)
+        self.fail_request()
+
+        self.failureResultOf(self.request()[0], CircuitOpenError)
+        self.reactor.advance(10)
+        self.assertIsNotNone(self.request()[1])
+
+    def test_disabled(self):
+        """
+        A C{breakerThreshold} of C{None} disables circuit breaking.
+        """
+        self.api = GitHubAPI(self.oauth_token, baseURL=self.base_url,
+                             reactor=self.reactor, breakerThreshold=None)
+        for i in range(5):
+            self.fail_request()
+        self.assertEqual(self.api.breakerStates(), {})
+
+
+class _RespondingTestCase(_GithubApiTestCase):
+    """
+    Answers the last request with a response.
+    """
+
+    def respond(self, body=b'{"a": 1}', headers=b""):
+        factory = self.reactor.sslClients[-1][2]
+        protocol = factory.buildProtocol(None)
+        protocol.makeConnection(StringTransport())
+        protocol.dataReceived(b"HTTP/1.0 200 OK\r\n" + headers +
+                              b"Content-Length: %d\r\n\r\n" % len(body) +
+                              body)
+        protocol.connectionLost(Failure(CONNECTION_DONE))
+
+
+class GithubApiMiddlewareTests(_RespondingTestCase):
+    """
+    Tests for the C{middleware} of L{GithubApi}.
+    """
+
+    def test_short_circuit(self):
+        """
+        Middleware may answer a request without passing it on.
+        """
+        def canned(request, proceed):
+            return succeed(Response(None, {}, {"canned": request.url}))
+        self.api.middleware.insert(0, canned)
+        d = self.api.makeRequest(["a"], params={"x": "1"})
+        self.assertEqual(self.successResultOf(d),
+                         {"canned": "https://baseurla?x=1"})
+        self.assertEqual(self.reactor.sslClients, [])
+
+    def test_order(self):
         """
-        Assert all C{pages} have been downloaded.
+        Middleware is called outermost first, and sees the response on the
+        way back in the reverse order.
         """
-        page_headers = iter(zip(pages, headers))
         calls = []
 
-        def fake_makeRequest(url_args, page):
-            calls.append((url_args, page))
-            page, headers = next(page_headers)
-            self.api.last_response_headers = headers
-            return succeed([page])
+        def observe(name):
+            def middleware(request, proceed):
+                calls.append((name, "request"))
+                d = proceed(request)
+
+                @d.addCallback
+                def observed(response):
+                    calls.append((name, response.body))
+                    return response
+                return d
+            return middleware
+        self.api.middleware.insert(0, observe("outer"))
+        self.api.middleware.append(observe("inner"))
+        d = self.api.makeRequest(["a"])
+        self.respond()
+        self.assertEqual(self.successResultOf(d), {"a": 1})
+        self.assertEqual(calls, [("outer", "request"), ("inner", "request"),
+                                 ("inner", b'{"a": 1}'),
+                                 ("outer", {"a": 1})])
+
+    def test_transform(self):
+        """
+        Middleware may change the request before passing it on, and the
+        response before returning it.
+        """
+        def transform(request, proceed):
+            request.headers["X-Trace"] = "t1"
+            d = proceed(request)
+
+            @d.addCallback
+            def transformed(response):
+                response.body = response.headers["x-answer"][0]
+                return response
+            return d
+        self.api.middleware.insert(0, transform)
+        d = self.api.makeRequest(["a"])
+        factory = self.reactor.sslClients[-1][2]
+        self.assertEqual(factory.headers["X-Trace"], "t1")
+        self.assertEqual(factory.headers["Authorization"], self.token_header)
+        self.respond(headers=b"X-Answer: 42\r\n")
+        self.assertEqual(self.successResultOf(d), "42")
+
+    def test_removed(self):
+        """
+        Built-in middleware may be removed.
+        """
+        self.api.middleware.remove(self.api.jsonMiddleware)
+        d = self.api.makeRequest(["a"])
+        self.respond()
+        self.assertEqual(self.successResultOf(d), b'{"a": 1}')
+
+
+class GithubApiThreadedDecodeTests(_RespondingTestCase):
+    """
+    Tests for decoding large JSON bodies in a thread.
+    """
 
-        self.api.makeRequest = fake_makeRequest
-        data = self.successResultOf(self.api.makeRequestAllPages([]))
+    def setUp(self):
+        super(GithubApiThreadedDecodeTests, self).setUp()
+        self.api.jsonThreadThreshold = 10
+        self.inThread = []
+        self.reactor.callFromThread = lambda f, *args: f(*args)
+        self.api.threadPool = self
 
-        self.assertEqual(calls, [([], i) for i in range(len(pages))])
-        self.assertEqual(data, pages)
+    def callInThreadWithCallback(self, onResult, f, *args):
+        def run():
+            try:
+                result = f(*args)
+            except:
+                onResult(False, Failure())
+            else:
+                onResult(True, result)
+        self.inThread.append(run)
 
-    def test_makeRequestAllPages_single_page(self):
+    def test_large_body(self):
         """
-        A single page resource is retrieved and returned.
+        Bodies above the threshold are decoded in the thread pool, and the
+        time it took is recorded.
         """
-        pages = [{"page": 1}]
-        headers = [{}]
-        self.assert_makeRequestAllPages_downloads(pages, headers)
+        d = self.api.makeRequest(["a"])
+        self.respond(b'{"a": "long enough"}')
+        self.assertNoResult(d)
+        self.inThread.pop()()
+        self.assertEqual(self.successResultOf(d), {"a": "long enough"})
+        self.assertEqual(self.api.threadedDecodes, 1)
+        self.assertTrue(self.api.threadedDecodeTime >= 0)
 
-    def test_makeRequestAllPages_multiple_pages(self):
+    def test_small_body(self):
         """
-        All pages of a multi-page resource are retrieved and returned
-        together.
+        Bodies up to the threshold are decoded in the reactor thread.
         """
-        pages = [{"page": 1}, {"page": 2}, {"page": 3}]
-        headers = [{"link": ['<https://something>; rel="next"']},
-                   {"link": ['<https://else>; rel="next", '
-                             '<https://something>; rel="last"']},
-                   {"link": ['<https://else>; rel="last"']}]
-        self.assert_makeRequestAllPages_downloads(pages, headers)
+        d = self.api.makeRequest(["a"])
+        self.respond(b'[1]')
+        self.assertEqual(self.successResultOf(d), [1])
+        self.assertEqual(self.api.threadedDecodes, 0)
+
+    def test_disabled(self):
+        """
+        Without a threshold, every body is decoded in the reactor thread.
+        """
+        self.api.jsonThreadThreshold = None
+        d = self.api.makeRequest(["a"])
+        self.respond(b'{"a": "long enough"}')
+        self.assertEqual(self.successResultOf(d), {"a": "long enough"})
+
+    def test_invalid(self):
+        """
+        Failures to decode in a thread are reported.
+        """
+        d = self.api.makeRequest(["a"])
+        self.respond(b'{"a": "not JSON')
+        self.inThread.pop()()
+        self.failureResultOf(d, ValueError)
+
+    def test_pages_not_truncated(self):
+        """
+        A response arriving while a page is decoded does not stop
+        L{GithubApi.makeRequestAllPages} from fetching the next page.
+        """
+        d = self.api.makeRequestAllPages(["a"])
+        self.respond(b'["long enough"]',
+                     headers=b'Link: <https://next>; rel="next"\r\n')
+        self.api.makeRequest(["b"])
+        self.respond(b'[1]')
+        self.inThread.pop()()
+        self.assertEqual(len(self.reactor.sslClients), 3)
+        self.respond(b'[2]')
+        self.assertEqual(self.successResultOf(d), ["long enough", 2])
 
 
 class _EndpointTestCase(SynchronousTestCase):
@@ -381,7 +1298,7 @@ class TestReposEndpoint(_EndpointTestCase):
         events_iter = iter(events)
         calls = []
 
-        def fake_makeRequest(path, page):
+        def fake_makeRequest(path, post=None, method='GET', page=0):
             calls.append((path, page))
             event = next(events_iter, None)
             return succeed([] if event is None else [event])
@@ -392,7 +1309,7 @@ class TestReposEndpoint(_EndpointTestCase):
 
         self.assertEqual(calls, [
             (["repos", repo_user, repo_name, "events"], i)
-            for i in range(len(expected_events) + 1)])
+            for i in range(1, len(expected_events) + 2)])
         self.assertEqual(data, expected_events)
 
     def test_getEvents_ok(self):
@@ -603,6 +1520,266 @@ class TestReposEndpoint(_EndpointTestCase):
         self.assertEqual('test-context', request['kwargs']['post']['context'])
 
 
+class ReposEndpointArchiveTests(_GithubApiTestCase):
+    """
+    Tests for L{txgithub.api.ReposEndpoint.downloadArchive}.
+    """
+
+    def setUp(self):
+        super(ReposEndpointArchiveTests, self).setUp()
+        self.api = GitHubAPI(self.oauth_token, baseURL="https://baseurl/",
+                             reactor=self.reactor)
+        self.patch(ReposEndpoint, 'archiveChunkSize', 4)
+        self.path = self.mktemp()
+        self.progress = []
+
+    def respond(self, status, headers=(), chunks=()):
+        """
+        Answer the last request with C{status}, C{headers} and the body
+        C{chunks}, returning its factory.
+        """
+        factory = self.reactor.sslClients[-1][2]
+        protocol = factory.buildProtocol("ignored")
+        protocol.makeConnection(StringTransport())
+        headers = list(headers)
+        if status.startswith(b"20"):
+            headers.append((b"Content-Length",
+                            str(sum(len(chunk) for chunk in chunks))))
+        protocol.dataReceived(
+            b"HTTP/1.0 " + status + b"\r\n" +
+            b"".join(b"%s: %s\r\n" % header for header in headers) +
+            b"\r\n")
+        for chunk in chunks:
+            protocol.dataReceived(chunk)
+        protocol.connectionLost(Failure(CONNECTION_DONE))
+        return factory
+
+    def download(self, dest, **kwargs):
+        return self.api.repos.downloadArchive(
+            'user', 'repo', dest, ref='v1',
+            progress=lambda *args: self.progress.append(args), **kwargs)
+
+    def test_redirect_followed(self):
+        """
+        The redirect to the archive is followed, without the token if it
+        leads to another host, and the archive is written to the file.
+        """
+        d = self.download(self.path)
+        factory = self.respond(
+            b"302 Found",
+            [(b"Location", b"https://codeload.example/user/repo/tar/v1")])
+        self.assertEqual(factory.url,
+                         "https://baseurl/repos/user/repo/tarball/v1")
+
+        factory = self.reactor.sslClients[-1][2]
+        self.assertEqual(factory.host, "codeload.example")
+        self.assertNotIn("Authorization", factory.headers)
+        self.respond(b"200 OK", chunks=[b"abc", b"defgh", b"ij"])
+
+        self.assertEqual(self.successResultOf(d), 10)
+        with open(self.path, "rb") as f:
+            self.assertEqual(f.read(), b"abcdefghij")
+        self.assertEqual(self.progress, [(3, 10), (8, 10), (10, 10)])
+
+    def test_fixed_size_writes(self):
+        """
+        The archive is written to a file object in chunks of
+        C{archiveChunkSize} bytes, the remainder last.
+        """
+        writes = []
+
+        class Recorder(object):
+            write = writes.append
+
+        d = self.download(Recorder(), archive_format='zipball')
+        self.respond(b"200 OK", chunks=[b"abc", b"defghijkl", b"mn"])
+        self.successResultOf(d)
+        self.assertEqual(writes, [b"abcd", b"efgh", b"ijkl", b"mn"])
+
+    def test_no_deadline(self):
+        """
+        By default, neither the request for the archive nor the one
+        following its redirect is limited by the client's C{timeout}.
+        """
+        d = self.download(self.path)
+        self.reactor.advance(self.api.timeout)
+        self.respond(
+            b"302 Found",
+            [(b"Location", b"https://codeload.example/user/repo/tar/v1")])
+        self.reactor.advance(self.api.timeout)
+        self.assertNoResult(d)
+        self.assertEqual(len(self.reactor.sslClients), 2)
+
+    def test_idle_timeout(self):
+        """
+        A download fails once nothing has been received for
+        C{archiveIdleTimeout} seconds.
+        """
+        d = self.download(self.path)
+        protocol = self.reactor.sslClients[-1][2].buildProtocol("ignored")
+        protocol.makeConnection(StringTransport())
+        self.reactor.advance(ReposEndpoint.archiveIdleTimeout)
+        self.assertTrue(protocol.transport.disconnecting)
+        protocol.connectionLost(Failure(CONNECTION_DONE))
+        self.failureResultOf(d, TimeoutError)
+
+    def test_same_host_redirect_authorized(self):
+        """
+        The token is sent along a redirect to the API's own host.
+        """
+        self.download(self.path)
+        self.respond(b"302 Found", [(b"Location", b"/elsewhere")])
+        factory = self.reactor.sslClients[-1][2]
+        self.assertEqual(factory.url, "https://baseurl/elsewhere")
+        self.assertEqual(factory.headers["Authorization"], self.token_header)
+
+    def test_redirect_limit(self):
+        """
+        Only C{maxRedirects} redirects are followed.
+        """
+        self.patch(ReposEndpoint, 'maxRedirects', 1)
+        d = self.download(self.path)
+        self.respond(b"302 Found", [(b"Location", b"/a")])
+        self.respond(b"302 Found", [(b"Location", b"/b")])
+        self.failureResultOf(d, PageRedirect)
+
+    def test_resume(self):
+        """
+        A resumed download asks for the rest of the file, and appends a
+        partial response to it.
+        """
+        with open(self.path, "wb") as f:
+            f.write(b"abc")
+        d = self.download(self.path, resume=True)
+        factory = self.reactor.sslClients[-1][2]
+        self.assertEqual(factory.headers["Range"], "bytes=3-")
+        self.respond(b"206 Partial Content", chunks=[b"def"])
+        self.assertEqual(self.successResultOf(d), 6)
+        with open(self.path, "rb") as f:
+            self.assertEqual(f.read(), b"abcdef")
+        self.assertEqual(self.progress, [(6, 6)])
+
+    def test_resume_refused(self):
+        """
+        If the whole archive is sent in spite of the range request, the
+        file is rewritten.
+        """
+        with open(self.path, "wb") as f:
+            f.write(b"stale")
+        d = self.download(self.path, resume=True)
+        self.respond(b"200 OK", chunks=[b"new"])
+        self.successResultOf(d)
+        with open(self.path, "rb") as f:
+            self.assertEqual(f.read(), b"new")
+
+    def test_failure_keeps_partial_file(self):
+        """
+        What was received before a failure is kept, to be resumed.
+        """
+        d = self.download(self.path)
+        factory = self.reactor.sslClients[-1][2]
+        protocol = factory.buildProtocol("ignored")
+        protocol.makeConnection(StringTransport())
+        protocol.dataReceived(b"HTTP/1.0 200 OK\r\n"
+                              b"Content-Length: 10\r\n\r\nabcde")
+        protocol.connectionLost(Failure(ConnectionRefusedError()))
+        self.failureResultOf(d)
+        with open(self.path, "rb") as f:
+            self.assertEqual(f.read(), b"abcde")
+
+    def test_bad_format(self):
+        """
+        An unknown archive format raises a L{ValueError}.
+        """
+        self.assertRaises(ValueError, self.api.repos.downloadArchive,
+                          'user', 'repo', self.path, archive_format='rar')
+
+
+class TestReposEndpointCombinedStatus(_EndpointTestCase):
+    """
+    Tests for L{ReposEndpoint.getCombinedStatus}.
+    """
+
+    sha = "6dcb09b5b57875f334f61aebed695e2e4193db5e"
+
+    def setUp(self):
+        super(TestReposEndpointCombinedStatus, self).setUp()
+        self.repos = self.github.repos
+
+    def getCombinedStatus(self, pages, ref=None):
+        """
+        Get the combined status of C{ref}, served as C{pages}.
+        """
+        pages = list(pages)
+        calls = []
+
+        def fake_makeRequest(url_args, page, fullResponse):
+            calls.append((url_args, page))
+            content = pages.pop(0)
+            headers = {"link": ['<https://next>; rel="next"']} if pages else {}
+            return succeed(Response('200', headers, content))
+
+        self.github.makeRequest = fake_makeRequest
+        result = self.successResultOf(self.repos.getCombinedStatus(
+            "user", "repo", ref or self.sha))
+        return result, calls
+
+    def test_all_pages(self):
+        """
+        The statuses of every page are combined.
+        """
+        result, calls = self.getCombinedStatus([
+            {"state": "success", "statuses": [{"state": "success"}]},
+            {"state": "success", "statuses": [{"state": "failure"}]},
+        ])
+        self.assertEqual(result, {"state": "success",
+                                  "statuses": [{"state": "success"},
+                                               {"state": "failure"}]})
+        self.assertEqual(calls, [
+            (["repos", "user", "repo", "commits", self.sha, "status"], 1),
+            (["repos", "user", "repo", "commits", self.sha, "status"], 2)])
+
+    def test_terminal_sha_cached(self):
+        """
+        The combined status of a full SHA whose contexts have all
+        finished is cached.
+        """
+        status = {"state": "failure", "statuses": [{"state": "error"}]}
+        first, calls = self.getCombinedStatus([status])
+        second, calls = self.getCombinedStatus([])
+        self.assertEqual(calls, [])
+        self.assertEqual(second, first)
+
+    def test_pending_not_cached(self):
+        """
+        The combined status is not cached while a context is pending.
+        """
+        status = {"state": "failure", "statuses": [{"state": "pending"}]}
+        self.getCombinedStatus([status])
+        result, calls = self.getCombinedStatus([status])
+        self.assertEqual(len(calls), 1)
+
+    def test_branch_not_cached(self):
+        """
+        The combined status of a branch is not cached.
+        """
+        status = {"state": "success", "statuses": [{"state": "success"}]}
+        self.getCombinedStatus([status], ref="master")
+        result, calls = self.getCombinedStatus([status], ref="master")
+        self.assertEqual(len(calls), 1)
+
+    def test_cache_bounded(self):
+        """
+        Only the most recently used combined statuses are cached.
+        """
+        self.repos._combinedStatuses.maxEntries = 1
+        status = {"state": "success", "statuses": []}
+        self.getCombinedStatus([status])
+        self.getCombinedStatus([status], ref="f" * 40)
+        result, calls = self.getCombinedStatus([status])
+        self.assertEqual(len(calls), 1)
+
+
 class TestGistsEndpoint(_EndpointTestCase):
     """
     Tests for L{GistsEndpoint}
@@ -679,6 +1856,40 @@ class TestPullsEndpoint(_EndpointTestCase):
         """
         self.assertIs(self.github.pulls, self.pulls)
 
+    def test_list(self):
+        """
+        list fetches every page of pull requests, with the given filters.
+        """
+        calls = []
+
+        def fake_makeRequestPages(url_args, pageReceived, params):
+            calls.append((url_args, params))
+            pageReceived([1])
+            pageReceived([2])
+            return succeed(None)
+
+        self.github.makeRequestPages = fake_makeRequestPages
+        d = self.pulls.list('user', 'repo', state='closed', sort='updated',
+                            direction='asc')
+        self.assertEqual(self.successResultOf(d), [1, 2])
+        self.assertEqual(calls, [(
+            ['repos', 'user', 'repo', 'pulls'],
+            {'state': 'closed', 'sort': 'updated', 'direction': 'asc'})])
+
+    def test_list_fails_with_bad_state(self):
+        """
+        list raises a ValueError when given an invalid state.
+        """
+        with self.assertRaises(ValueError):
+            self.pulls.list('user', 'repo', state='merged')
+
+    def test_list_fails_with_bad_direction(self):
+        """
+        list raises a ValueError when given an invalid direction.
+        """
+        with self.assertRaises(ValueError):
+            self.pulls.list('user', 'repo', direction='up')
+
     def test_edit_fails_when_empty(self):
         """
         edit raises a ValueError when no parameters are provided.
@@ -755,6 +1966,70 @@ class TestPullsEndpoint(_EndpointTestCase):
                                       'body': 'some body',
                                       'state': 'closed'})
 
+    def fake_diff(self, diff):
+        """
+        Make the diff of pull requests C{diff}, streamed in two chunks.
+        """
+        calls = []
+
+        def fake_makeRequest(url_args, headers, bodyReceived):
+            calls.append((url_args, headers))
+            bodyReceived(diff[:10])
+            bodyReceived(diff[10:])
+            return succeed(None)
+        self.github.makeRequest = fake_makeRequest
+        return calls
+
+    DIFF = (b"diff --git a/f b/f\n--- a/f\n+++ b/f\n"
+            b"@@ -1,2 +1,2 @@\n-a\n+b\n c\n"
+            b"@@ -9 +9 @@\n-x\n+y")
+
+    def test_getDiff(self):
+        """
+        getDiff requests the diff media type and delivers its hunks.
+        """
+        calls = self.fake_diff(self.DIFF)
+        hunks = []
+        d = self.pulls.getDiff('user', 'repo', 5, hunks.append)
+        self.successResultOf(d)
+        self.assertEqual(calls, [
+            (['repos', 'user', 'repo', 'pulls', '5'],
+             {'Accept': 'application/vnd.github.diff'})])
+        self.assertEqual([(hunk.path, hunk.position) for hunk in hunks],
+                         [('f', 1), ('f', 5)])
+        self.assertEqual(hunks[-1].lines, [b'-x', b'+y'])
+
+    def test_getDiff_request(self):
+        """
+        getDiff makes its request for a pull request's number given as an
+        C{int}.
+        """
+        reactor = MemoryReactorClock()
+        github = GitHubAPI(oauth2_token='fake-token', reactor=reactor)
+        hunks = []
+        d = github.pulls.getDiff('user', 'repo', 5, hunks.append)
+        factory = reactor.sslClients[-1][2]
+        self.assertEqual(factory.url,
+                         HOSTED_BASE_URL + 'repos/user/repo/pulls/5')
+        protocol = factory.buildProtocol(None)
+        protocol.makeConnection(StringTransport())
+        protocol.dataReceived(b"HTTP/1.0 200 OK\r\n"
+                              b"Content-Length: %d\r\n\r\n" % len(self.DIFF) +
+                              self.DIFF)
+        protocol.connectionLost(Failure(CONNECTION_DONE))
+        self.successResultOf(d)
+        self.assertEqual([(hunk.path, hunk.position) for hunk in hunks],
+                         [('f', 1), ('f', 5)])
+
+    def test_getDiffIndex(self):
+        """
+        getDiffIndex maps lines of the new files to diff positions.
+        """
+        self.fake_diff(self.DIFF)
+        index = self.successResultOf(self.pulls.getDiffIndex('u', 'r', 5))
+        self.assertEqual([index.position('f', line) for line in [1, 2, 9]],
+                         [2, 3, 6])
+
 
 class TestIssueCommentsEndpoint(_EndpointTestCase):
     """
@@ -807,8 +2082,8 @@ class TestReviewCommentsEndpoint(_EndpointTestCase):
         makeRequestAllPages_returns = "makeRequestAllPages"
         calls = []
 
-        def fake_makeRequestAllPages(path):
-            calls.append(path)
+        def fake_makeRequestAllPages(path, params):
+            calls.append((path, params))
             return makeRequestAllPages_returns
 
         self.github.makeRequestAllPages = fake_makeRequestAllPages
@@ -816,7 +2091,53 @@ class TestReviewCommentsEndpoint(_EndpointTestCase):
         self.assertIs(self.reviews.getRepoComments("user", "name"),
                       makeRequestAllPages_returns)
         self.assertEqual(
-            calls, [["repos", "user", "name", "pulls", "comments"]])
+            calls, [(["repos", "user", "name", "pulls", "comments"], {})])
+
+    def test_getRepoComments_since(self):
+        """
+        Review comments can be filtered by update time and sorted.
+        """
+        calls = []
+
+        def fake_makeRequestAllPages(path, params):
+            calls.append(params)
+
+        self.github.makeRequestAllPages = fake_makeRequestAllPages
+        self.reviews.getRepoComments("user", "name",
+                                     since="2016-01-01T00:00:00Z",
+                                     sort="updated", direction="asc")
+        self.assertEqual(calls, [{"since": "2016-01-01T00:00:00Z",
+                                  "sort": "updated", "direction": "asc"}])
+
+    def test_getRepoComments_bad_sort(self):
+        """
+        getRepoComments raises a ValueError when given an invalid sort.
+        """
+        with self.assertRaises(ValueError):
+            self.reviews.getRepoComments("user", "name", sort="position")
+        with self.assertRaises(ValueError):
+            self.reviews.getRepoComments("user", "name", direction="up")
+
+    def test_getRepoCommentsPages(self):
+        """
+        getRepoCommentsPages hands over each page as it arrives.
+        """
+        calls = []
+
+        def fake_makeRequestPages(path, pageReceived, params, etagCache):
+            calls.append((path, params, etagCache))
+            pageReceived([1])
+            return succeed(None)
+
+        self.github.makeRequestPages = fake_makeRequestPages
+        pages = []
+        cache = ETagCache()
+        self.successResultOf(self.reviews.getRepoCommentsPages(
+            "user", "name", pages.append, sort="created", etagCache=cache))
+        self.assertEqual(pages, [[1]])
+        self.assertEqual(calls, [(
+            ["repos", "user", "name", "pulls", "comments"],
+            {"sort": "created"}, cache)])
 
     def test_getPullRequestComments(self):
         """
@@ -876,7 +2197,7 @@ class TestReviewCommentsEndpoint(_EndpointTestCase):
             "commit_id": "6dcb09b5b57875f334f61aebed695e2e4193db5e",
             "path": "file1.txt",
             "position": 4
-        }, request["kwargs"]["data"])
+        }, request["kwargs"]["post"])
 
     def test_replyToComment(self):
         """
@@ -899,7 +2220,7 @@ class TestReviewCommentsEndpoint(_EndpointTestCase):
         self.assertEqual({
             "body": "Nice change",
             "in_reply_to": 4,
-        }, request["kwargs"]["data"])
+        }, request["kwargs"]["post"])
 
     def test_editComment(self):
         """
@@ -917,8 +2238,44 @@ class TestReviewCommentsEndpoint(_EndpointTestCase):
         request = self._github_requests[0]
         self.assertEqual(request['args'][0],
                          ['repos', 'repo', 'name', 'pulls', "comments", "123"])
-        self.assertEqual("POST", request["kwargs"]["method"])
-        self.assertEqual({"body": "Nice change"}, request["kwargs"]["data"])
+        self.assertEqual("PATCH", request["kwargs"]["method"])
+        self.assertEqual({"body": "Nice change"}, request["kwargs"]["post"])
+
+    def test_writes_indexed(self):
+        """
+        When the endpoint has an index, comments created, replied, edited
+        and deleted through it are reflected in the index.
+        """
+        self.reviews.index = ReviewCommentIndex()
+        url = "https://api.github.com/repos/user/repo/pulls/123"
+        comment = {"id": 1, "pull_request_url": url, "path": "a.py",
+                   "position": 4}
+        reply = {"id": 2, "pull_request_url": url, "path": "a.py",
+                 "position": 4, "in_reply_to_id": 1}
+
+        self._github_responses = [comment]
+        self.reviews.createComment("user", "repo", 123, "body", "sha",
+                                   "a.py", 4)
+        self._github_responses = [reply]
+        self.reviews.replyToComment("user", "repo", 123, "body", 1)
+        self.assertEqual(
+            self.reviews.index.find(("user", "repo"), 123, "a.py", 4),
+            [comment])
+        self.assertEqual(
+            self.reviews.index.find(("user", "repo"), 123, "a.py", 4, 1),
+            [reply])
+
+        edited = dict(comment, body="edited")
+        self._github_responses = [edited]
+        self.reviews.editComment("user", "repo", 1, "edited")
+        self.assertEqual(
+            self.reviews.index.find(("user", "repo"), 123, "a.py", 4),
+            [edited])
+
+        self._github_responses = [None]
+        self.reviews.deleteComment("user", "repo", 1)
+        self.assertEqual(
+            self.reviews.index.find(("user", "repo"), 123, "a.py", 4), [])
 
     def test_deleteComment(self):
         """
@@ -936,3 +2293,554 @@ class TestReviewCommentsEndpoint(_EndpointTestCase):
         self.assertEqual(request['args'][0],
                          ['repos', 'repo', 'name', 'pulls', "comments", "123"])
         self.assertEqual("DELETE", request["kwargs"]["method"])
+
+
+class TestGraphQLEndpoint(SynchronousTestCase):
+    """
+    Tests for L{GraphQLEndpoint}.
+    """
+
+    def setUp(self):
+        self.clock = Clock()
+        self.github = GitHubAPI(oauth2_token='fake-token', reactor=self.clock)
+        self.github.makeRequest = self.fake_makeRequest
+        self.graphql = self.github.graphql
+        self.requests = []
+        self.responses = []
+
+    def fake_makeRequest(self, url_args, method, post):
+        self.requests.append((url_args, method, post))
+        self.responses.append(Deferred())
+        return self.responses[-1]
+
+    def test_same_graphql_object(self):
+        """
+        The L{GraphQLEndpoint} is lazily created once.
+        """
+        self.assertIs(self.github.graphql, self.graphql)
+
+    def test_batched(self):
+        """
+        Lookups made in the same reactor iteration are sent as one
+        aliased query, and each receives its own result.
+        """
+        first = self.graphql.query('viewer { login }')
+        second = self.graphql.query('repository(name: "a") { id }')
+        self.assertEqual(self.requests, [])
+
+        self.clock.advance(0)
+        self.assertEqual(self.requests, [(
+            ['graphql'], 'POST',
+            {'query': 'query { l0: viewer { login } '
+                      'l1: repository(name: "a") { id } '
+                      'rateLimit { cost remaining resetAt } }'})])
+
+        self.responses[0].callback({'data': {
+            'l0': {'login': 'me'}, 'l1': {'id': 'X'},
+            'rateLimit': {'cost': 1, 'remaining': 4999,
+                          'resetAt': 'soon'}}})
+        self.assertEqual(self.successResultOf(first), {'login': 'me'})
+        self.assertEqual(self.successResultOf(second), {'id': 'X'})
+        self.assertEqual(self.graphql.rateLimit['remaining'], 4999)
+        self.assertEqual(self.graphql.cost, 1)
+
+    def test_max_lookups(self):
+        """
+        Batches hold at most C{maxLookups} lookups, and are sent
+        concurrently.
+        """
+        self.graphql.maxLookups = 2
+        for i in range(5):
+            self.graphql.query('viewer { login }')
+        self.clock.advance(0)
+        self.assertEqual(len(self.requests), 3)
+
+    def test_max_nodes(self):
+        """
+        Batches stay within C{maxNodes}.
+        """
+        self.graphql.maxNodes = 100
+        self.graphql.query('a', nodes=60)
+        self.graphql.query('b', nodes=60)
+        self.graphql.query('c', nodes=40)
+        self.clock.advance(0)
+        self.assertEqual(len(self.requests), 2)
+        self.assertIn('l0: b l1: c', self.requests[1][2]['query'])
+
+    def test_lookup_errors(self):
+        """
+        Errors reported for a lookup fail only that lookup.
+        """
+        first = self.graphql.query('a')
+        second = self.graphql.query('b')
+        self.clock.advance(0)
+        error = {'path': ['l1', 'x'], 'message': 'not found'}
+        self.responses[0].callback({'data': {'l0': 1, 'l1': None},
+                                    'errors': [error]})
+        self.assertEqual(self.successResultOf(first), 1)
+        failure = self.failureResultOf(second, GraphQLError)
+        self.assertEqual(failure.value.args, ([error],))
+
+    def test_general_errors(self):
+        """
+        Errors not attributed to a lookup fail the whole batch.
+        """
+        first = self.graphql.query('a')
+        self.clock.advance(0)
+        self.responses[0].callback({'errors': [{'message': 'syntax'}]})
+        self.failureResultOf(first, GraphQLError)
+
+    def test_request_failure(self):
+        """
+        A failed request fails every lookup of its batch.
+        """
+        first = self.graphql.query('a')
+        second = self.graphql.query('b')
+        self.clock.advance(0)
+        self.responses[0].errback(ZeroDivisionError())
+        self.failureResultOf(first, ZeroDivisionError)
+        self.failureResultOf(second, ZeroDivisionError)
+
+    def test_cancelled_not_sent(self):
+        """
+        Lookups cancelled before their batch is sent are left out.
+        """
+        first = self.graphql.query('a')
+        first.cancel()
+        self.failureResultOf(first, CancelledError)
+        self.graphql.query('b')
+        self.clock.advance(0)
+        self.assertEqual(self.requests[0][2]['query'],
+                         'query { l0: b rateLimit { cost remaining resetAt } }')
+
+    def test_pullRequest(self):
+        """
+        L{GraphQLEndpoint.pullRequest} looks up fields of a pull request.
+        """
+        d = self.graphql.pullRequest('user', 'repo', 12, 'title')
+        self.clock.advance(0)
+        self.assertIn('l0: repository(owner: "user", name: "repo") '
+                      '{ pullRequest(number: 12) { title } }',
+                      self.requests[0][2]['query'])
+        self.responses[0].callback(
+            {'data': {'l0': {'pullRequest': {'title': 'T'}}}})
+        self.assertEqual(self.successResultOf(d), {'title': 'T'})
+
+
+class TestChecksEndpoint(SynchronousTestCase):
+    """
+    Tests for L{txgithub.api.ChecksEndpoint}.
+    """
+
+    def setUp(self):
+        self.api = GitHubAPI(oauth2_token='fake-token')
+        self.requests = []
+        self.responses = []
+        self.api.makeRequest = self.fake_makeRequest
+        self.checks = self.api.checks
+        self.checks.maxAnnotations = 2
+        self.checks.concurrency = 2
+        self.output = {'title': 'lint', 'summary': 'warnings'}
+
+    def fake_makeRequest(self, url_args, method, post):
+        self.requests.append((url_args, method, post))
+        d = Deferred()
+        self.responses.append(d)
+        return d
+
+    def annotations(self, count):
+        return [{'path': 'f', 'start_line': i, 'end_line': i,
+                 'annotation_level': 'warning', 'message': 'w'}
+                for i in range(count)]
+
+    def batch(self, request):
+        return [annotation['start_line']
+                for annotation in request[2]['output'].get('annotations', [])]
+
+    def test_same_checks_object(self):
+        """
+        The L{ChecksEndpoint} is lazily created once.
+        """
+        self.assertIs(self.api.checks, self.checks)
+
+    def test_create(self):
+        """
+        A check run with few annotations is created in a single request.
+        """
+        d = self.checks.createCheckRun('u', 'r', 'lint', 'abc',
+                                       conclusion='success',
+                                       output=self.output,
+                                       annotations=self.annotations(2))
+        self.assertEqual(len(self.requests), 1)
+        url_args, method, post = self.requests[0]
+        self.assertEqual((url_args, method),
+                         (['repos', 'u', 'r', 'check-runs'], 'POST'))
+        self.assertEqual(post['conclusion'], 'success')
+        self.assertEqual(post['head_sha'], 'abc')
+        self.assertEqual(self.batch(self.requests[0]), [0, 1])
+        self.responses[0].callback({'id': 7})
+        self.assertEqual(self.successResultOf(d), {'id': 7})
+
+    def test_batches(self):
+        """
+        Annotations are sent in batches, the later ones with bounded
+        concurrency, and the fields completing the run go with the last
+        request once every other batch has been sent.
+        """
+        d = self.checks.createCheckRun('u', 'r', 'lint', 'abc',
+                                       status='completed',
+                                       conclusion='failure',
+                                       output=self.output,
+                                       annotations=self.annotations(9))
+        self.assertNotIn('conclusion', self.requests[0][2])
+        self.assertNotIn('status', self.requests[0][2])
+        self.responses[0].callback({'id': 7})
+
+        self.assertEqual([self.batch(request) for request in self.requests],
+                         [[0, 1], [2, 3], [4, 5]])
+        self.assertEqual(self.requests[1][:2],
+                         (['repos', 'u', 'r', 'check-runs', '7'], 'PATCH'))
+        self.responses[2].callback({'id': 7})
+        self.responses[1].callback({'id': 7})
+        self.assertEqual(len(self.requests), 4)
+        self.assertNotIn('conclusion', self.requests[-1][2])
+
+        self.responses[3].callback({'id': 7})
+        self.assertEqual([self.batch(request) for request in self.requests],
+                         [[0, 1], [2, 3], [4, 5], [6, 7], [8]])
+        last = self.requests[-1][2]
+        self.assertEqual((last['status'], last['conclusion']),
+                         ('completed', 'failure'))
+        self.assertNoResult(d)
+        self.responses[4].callback({'id': 7, 'status': 'completed'})
+        self.assertEqual(self.successResultOf(d)['status'], 'completed')
+
+    def test_batch_failure(self):
+        """
+        A failed batch fails the call, and the run is not completed.
+        """
+        d = self.checks.updateCheckRun('u', 'r', 7, conclusion='success',
+                                       output=self.output,
+                                       annotations=self.annotations(8))
+        self.assertEqual(self.requests[0][:2],
+                         (['repos', 'u', 'r', 'check-runs', '7'], 'PATCH'))
+        self.responses[0].callback({'id': 7})
+        self.responses[1].errback(Error(b"422"))
+        self.responses[2].callback({'id': 7})
+        self.failureResultOf(d, Error)
+        self.assertEqual(len(self.requests), 3)
+
+    def test_annotations_need_output(self):
+        """
+        Annotations cannot be sent without an output.
+        """
+        self.assertRaises(ValueError, self.checks.createCheckRun,
+                          'u', 'r', 'lint', 'abc',
+                          annotations=self.annotations(1))
+
+    def test_bad_status(self):
+        """
+        An invalid status raises a L{ValueError}.
+        """
+        self.assertRaises(ValueError, self.checks.updateCheckRun,
+                          'u', 'r', 7, status='done')
+
+
+class TestGitDataEndpoint(SynchronousTestCase):
+    """
+    Tests for L{txgithub.api.GitDataEndpoint}.
+    """
+
+    def setUp(self):
+        self.api = GitHubAPI(oauth2_token='fake-token')
+        self.requests = []
+        self.responses = {}
+        self.api.makeRequest = self.fake_makeRequest
+        self.git = self.api.git
+        self.git.concurrency = 2
+
+    def fake_makeRequest(self, url_args, params=None):
+        self.requests.append((url_args, params))
+        d = Deferred()
+        self.responses.setdefault(url_args[-1], []).append(d)
+        return d
+
+    def sha(self, char):
+        return char * 40
+
+    def test_same_git_object(self):
+        """
+        The L{GitDataEndpoint} is lazily created once.
+        """
+        self.assertIs(self.api.git, self.git)
+
+    def test_blob_cached(self):
+        """
+        A blob is requested once, and then served from the cache, even
+        for another repository.
+        """
+        sha = self.sha('a')
+        d = self.git.getBlob('u', 'r', sha)
+        self.assertEqual(self.requests,
+                         [(['repos', 'u', 'r', 'git', 'blobs', sha], None)])
+        self.responses[sha][0].callback({'sha': sha, 'content': 'eA=='})
+        self.assertEqual(self.successResultOf(d)['content'], 'eA==')
+
+        d = self.git.getBlob('other', 'repo', sha)
+        self.assertEqual(self.successResultOf(d)['content'], 'eA==')
+        self.assertEqual(len(self.requests), 1)
+
+    def test_kinds_cached_separately(self):
+        """
+        Commits and trees are cached apart from blobs, and recursive
+        listings apart from flat ones.
+        """
+        sha = self.sha('b')
+        self.git.getCommit('u', 'r', sha)
+        self.responses[sha][0].callback({'sha': sha, 'message': 'm'})
+        self.git.getTree('u', 'r', sha)
+        self.responses[sha][1].callback({'sha': sha, 'tree': []})
+        self.git.getTree('u', 'r', sha, recursive=True)
+        self.assertEqual(self.requests[-1][1], {'recursive': '1'})
+        self.assertEqual(len(self.requests), 3)
+
+        self.successResultOf(self.git.getCommit('u', 'r', sha))
+        self.successResultOf(self.git.getTree('u', 'r', sha))
+        self.assertEqual(len(self.requests), 3)
+
+    def test_named_tree_cached_by_sha(self):
+        """
+        A tree requested by branch name is always requested, and cached
+        under its SHA.
+        """
+        sha = self.sha('c')
+        for i in range(2):
+            self.git.getTree('u', 'r', 'master')
+            self.responses['master'][i].callback({'sha': sha, 'tree': []})
+        self.assertEqual(len(self.requests), 2)
+        self.successResultOf(self.git.getTree('u', 'r', sha))
+        self.assertEqual(len(self.requests), 2)
+
+    def test_cache_bounded(self):
+        """
+        Only the C{maxObjects} most recently used objects are kept.
+        """
+        self.patch(GitDataEndpoint, 'maxObjects', 1)
+        git = GitDataEndpoint(self.api)
+        for char in 'de':
+            git.getBlob('u', 'r', self.sha(char))
+            self.responses[self.sha(char)][0].callback(
+                {'sha': self.sha(char)})
+        git.getBlob('u', 'r', self.sha('d'))
+        self.assertEqual(len(self.requests), 3)
+
+    def test_getTreeBlobs(self):
+        """
+        The blobs of a recursive tree are fetched concurrently, within the
+        limit, each distinct blob once and only if not cached.
+        """
+        tree, cached = self.sha('0'), self.sha('1')
+        self.git.getBlob('u', 'r', cached)
+        self.responses[cached][0].callback({'sha': cached, 'content': 'c'})
+
+        entries = [('a', 'blob', '2'), ('b', 'blob', '3'), ('dir', 'tree', '4'),
+                   ('dir/c', 'blob', '5'), ('dir/d', 'blob', '2'),
+                   ('e', 'blob', '1')]
+        d = self.git.getTreeBlobs('u', 'r', tree)
+        self.assertEqual(self.requests[-1],
+                         (['repos', 'u', 'r', 'git', 'trees', tree],
+                          {'recursive': '1'}))
+        self.responses[tree][0].callback({'sha': tree, 'tree': [
+            {'path': path, 'type': kind, 'sha': self.sha(char)}
+            for path, kind, char in entries]})
+
+        fetched = [url_args[-1] for url_args, params in self.requests[2:]]
+        self.assertEqual(sorted(fetched), [self.sha('2'), self.sha('3')])
+        self.responses[fetched[0]][0].callback(
+            {'sha': fetched[0], 'content': fetched[0][0]})
+        self.assertEqual(len(self.requests), 5)
+        for char in '35':
+            if self.sha(char) in self.responses:
+                self.responses[self.sha(char)][0].callback(
+                    {'sha': self.sha(char), 'content': char})
+        self.assertEqual(len(self.requests), 5)
+
+        blobs = self.successResultOf(d)
+        self.assertEqual(
+            dict((path, blob['content']) for path, blob in blobs.items()),
+            {'a': '2', 'b': '3', 'dir/c': '5', 'dir/d': '2', 'e': 'c'})
+
+    def test_getTreeBlobs_failure(self):
+        """
+        A failure to fetch a blob fails the whole fetch.
+        """
+        tree = self.sha('0')
+        d = self.git.getTreeBlobs('u', 'r', tree)
+        self.responses[tree][0].callback({'sha': tree, 'tree': [
+            {'path': 'a', 'type': 'blob', 'sha': self.sha('1')}]})
+        self.responses[self.sha('1')][0].errback(Error(b"404"))
+        self.failureResultOf(d, Error)
+
+
+class TestSearchEndpoint(SynchronousTestCase):
+    """
+    Tests for L{txgithub.api.SearchEndpoint}.
+    """
+
+    def setUp(self):
+        self.clock = Clock()
+        self.clock.advance(1000)
+        self.api = GitHubAPI(oauth2_token='fake-token', reactor=self.clock)
+        self.requests = []
+        self.responses = []
+        self.api.makeRequest = self.fake_makeRequest
+        self.search = self.api.search
+        self.pages = []
+
+    def fake_makeRequest(self, url_args, page, params, fullResponse):
+        self.requests.append((url_args, page, params))
+        d = Deferred()
+        self.responses.append(d)
+        return d
+
+    def respond(self, index, items, hasNext=True, remaining=10,
+                total=5000):
+        """
+        Answer request C{index} with C{items}, reporting C{remaining}
+        searches until the rate limit resets at time 1060.
+        """
+        headers = {}
+        if hasNext:
+            headers['link'] = ['<https://next>; rel="next"']
+        self.api.rateLimits['search'] = dict(limit=30, remaining=remaining,
+                                             reset=1060)
+        self.responses[index].callback(Response(
+            '200', headers, {'total_count': total, 'items': items}))
+
+    def test_same_search_object(self):
+        """
+        The L{SearchEndpoint} is lazily created once.
+        """
+        self.assertIs(self.api.search, self.search)
+
+    def test_pages_streamed(self):
+        """
+        Pages of results are delivered as they arrive, until the last.
+        """
+        d = self.search.code('addClass repo:o/r', self.pages.append,
+                             sort='indexed', order='asc')
+        self.assertEqual(self.requests, [
+            (['search', 'code'], 1,
+             {'q': 'addClass repo:o/r', 'per_page': 100, 'sort': 'indexed',
+              'order': 'asc'})])
+        self.respond(0, [1, 2])
+        self.assertEqual(self.pages, [[1, 2]])
+        self.assertEqual(self.requests[1][1], 2)
+        self.respond(1, [3], hasNext=False)
+        self.assertEqual(self.pages, [[1, 2], [3]])
+        self.assertEqual(self.successResultOf(d), 5000)
+
+    def test_result_ceiling(self):
+        """
+        No more than C{maxResults} results are delivered.
+        """
+        self.search.maxResults = 3
+        d = self.search.issues('is:open', self.pages.append)
+        self.respond(0, [1, 2])
+        self.respond(1, [3, 4])
+        self.assertEqual(self.pages, [[1, 2], [3]])
+        self.assertEqual(len(self.requests), 2)
+        self.successResultOf(d)
+
+    def test_stop_early(self):
+        """
+        Pagination stops when C{pageReceived} returns C{False}.
+        """
+        d = self.search.repositories('txgithub', lambda items: False)
+        self.respond(0, [1])
+        self.successResultOf(d)
+        self.assertEqual(len(self.requests), 1)
+
+    def test_rate_limited(self):
+        """
+        While the search rate limit is used up, requests wait for it to
+        reset, counting those in flight.
+        """
+        self.search.search('users', 'a', self.pages.append)
+        self.respond(0, [1], remaining=2)
+        self.search.search('users', 'b', self.pages.append)
+        self.assertEqual(len(self.requests), 3)
+        self.search.search('users', 'c', self.pages.append)
+        self.assertEqual(len(self.requests), 3)
+
+        self.clock.advance(59)
+        self.assertEqual(len(self.requests), 3)
+        self.clock.advance(1)
+        self.assertEqual(len(self.requests), 4)
+        self.assertEqual(self.requests[-1][2]['q'], 'c')
+
+    def test_limit_unknown(self):
+        """
+        Until an answer reports the search rate limit, a single request is
+        sent at a time.
+        """
+        self.search.search('users', 'a', self.pages.append)
+        self.search.search('users', 'b', self.pages.append)
+        self.search.search('users', 'c', self.pages.append)
+        self.assertEqual(len(self.requests), 1)
+        self.respond(0, [1], hasNext=False)
+        self.assertEqual([request[2]['q'] for request in self.requests],
+                         ['a', 'b', 'c'])
+
+    def test_cancel_waiting(self):
+        """
+        Cancelling a search waiting for the rate limit to reset takes its
+        request off the queue.
+        """
+        d = self.search.search('commits', 'fix', self.pages.append)
+        self.respond(0, [1], remaining=0)
+        d.cancel()
+        self.failureResultOf(d, CancelledError)
+        self.clock.advance(60)
+        self.assertEqual(len(self.requests), 1)
+
+    def test_cancel_in_flight(self):
+        """
+        Cancelling a search cancels its request in flight, freeing its
+        slot for the next search.
+        """
+        d = self.search.search('users', 'a', self.pages.append)
+        self.search.search('users', 'b', self.pages.append)
+        d.cancel()
+        self.failureResultOf(d, CancelledError)
+        self.assertTrue(self.responses[0].called)
+        self.assertEqual([request[2]['q'] for request in self.requests],
+                         ['a', 'b'])
+        self.assertEqual(self.search._inFlight, 1)
+
+    def test_exhausted_waits_for_reset(self):
+        """
+        A search answered with no remaining searches waits for the reset
+        before fetching its next page.
+        """
+        self.search.search('commits', 'fix', self.pages.append)
+        self.respond(0, [1], remaining=0)
+        self.assertEqual(len(self.requests), 1)
+        self.clock.advance(60)
+        self.assertEqual(len(self.requests), 2)
+
+    def test_failure(self):
+        """
+        A failed request fails the search and frees its slot.
+        """
+        d = self.search.search('code', 'x', self.pages.append)
+        self.responses[0].errback(Error(b"422"))
+        self.failureResultOf(d, Error)
+        self.assertEqual(self.search._inFlight, 0)
+
+    def test_bad_kind(self):
+        """
+        An unknown kind of search raises a L{ValueError}.
+        """
+        self.assertRaises(ValueError, self.search.search, 'gists', 'x',
+                          self.pages.append)
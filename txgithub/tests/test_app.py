@@ -0,0 +1,195 @@
+"""
+Tests for L{txgithub.app}.
+"""
+import base64
+import json
+
+from OpenSSL import crypto
+from twisted.internet.defer import Deferred, TimeoutError
+from twisted.internet.task import Clock
+from twisted.trial.unittest import SynchronousTestCase
+from twisted.web.error import Error
+
+from txgithub.app import AppTokenProvider, makeJWT
+
+
+def _decode(part):
+    return base64.urlsafe_b64decode(part + '=' * (-len(part) % 4))
+
+
+class _KeyTestCase(SynchronousTestCase):
+    """
+    Makes an RSA key, and a certificate to verify its signatures with.
+    """
+
+    def setUp(self):
+        self.key = crypto.PKey()
+        self.key.generate_key(crypto.TYPE_RSA, 1024)
+        self.pem = crypto.dump_privatekey(crypto.FILETYPE_PEM, self.key)
+        self.cert = crypto.X509()
+        self.cert.set_pubkey(self.key)
+
+
+class MakeJWTTests(_KeyTestCase):
+    """
+    Tests for L{makeJWT}.
+    """
+
+    def test_claims(self):
+        """
+        The token is issued by the app, backdated a minute, and expires
+        after C{lifetime} seconds.
+        """
+        header, payload, signature = makeJWT(
+            42, self.pem, 1000, lifetime=300).split('.')
+        self.assertEqual(json.loads(_decode(header)),
+                         {'alg': 'RS256', 'typ': 'JWT'})
+        self.assertEqual(json.loads(_decode(payload)),
+                         {'iat': 940, 'exp': 1300, 'iss': '42'})
+
+    def test_signature(self):
+        """
+        The token is signed with the private key, using SHA-256.
+        """
+        token = makeJWT(42, self.key, 1000)
+        signingInput, signature = token.rsplit('.', 1)
+        self.assertIsNone(crypto.verify(self.cert, _decode(signature),
+                                        signingInput, 'sha256'))
+
+
+class AppTokenProviderTests(_KeyTestCase):
+    """
+    Tests for L{AppTokenProvider}.
+    """
+
+    def setUp(self):
+        super(AppTokenProviderTests, self).setUp()
+        self.clock = Clock()
+        # 2016-07-11T22:00:00Z
+        self.clock.advance(1468274400)
+        self.calls = []
+        self.provider = AppTokenProvider(
+            42, self.pem, baseURL='https://ghe/api/v3', reactor=self.clock,
+            refreshMargin=300, _getPage=self.fake_getPage)
+
+    def fake_getPage(self, url, method, headers, timeout):
+        self.assertEqual(timeout, self.provider.mintTimeout)
+        self.calls.append((url, method, headers, Deferred()))
+        return self.calls[-1][-1]
+
+    def mint(self, index, token, expires_at='2016-07-11T23:00:00Z'):
+        self.calls[index][-1].callback(json.dumps(
+            {'token': token, 'expires_at': expires_at}))
+
+    def test_mint(self):
+        """
+        An installation token is minted with a JWT of the app.
+        """
+        d = self.provider.getToken(7)
+        url, method, headers, response = self.calls[0]
+        self.assertEqual((url, method),
+                         ('https://ghe/api/v3/app/installations/7/'
+                          'access_tokens', 'POST'))
+        scheme, jwt = headers['Authorization'].split(' ')
+        self.assertEqual(scheme, 'Bearer')
+        self.assertEqual(json.loads(_decode(jwt.split('.')[1]))['iss'], '42')
+        self.mint(0, 'tok1')
+        self.assertEqual(self.successResultOf(d), 'tok1')
+
+    def test_cached_per_installation(self):
+        """
+        Tokens are cached per installation, and concurrent requests share
+        a single mint.
+        """
+        first = self.provider.getToken(7)
+        second = self.provider.getToken(7)
+        self.provider.getToken(8)
+        self.assertEqual(len(self.calls), 2)
+        self.mint(0, 'tok7')
+        self.assertEqual(self.successResultOf(first), 'tok7')
+        self.assertEqual(self.successResultOf(second), 'tok7')
+        self.assertEqual(
+            self.successResultOf(self.provider.forInstallation(7)()), 'tok7')
+        self.assertEqual(len(self.calls), 2)
+
+    def test_refresh_before_expiry(self):
+        """
+        A new token is minted in the background C{refreshMargin} seconds
+        before expiry, while the old one is still served.
+        """
+        self.provider.getToken(7)
+        self.mint(0, 'old')
+        self.clock.advance(3299)
+        self.assertEqual(len(self.calls), 1)
+        self.clock.advance(1)
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(self.successResultOf(self.provider.getToken(7)),
+                         'old')
+        self.mint(1, 'new', expires_at='2016-07-12T00:00:00Z')
+        self.assertEqual(self.successResultOf(self.provider.getToken(7)),
+                         'new')
+
+    def test_refresh_failure_retried(self):
+        """
+        A failed refresh is logged and retried while the token is valid.
+        """
+        self.provider.getToken(7)
+        self.mint(0, 'old')
+        self.clock.advance(3300)
+        self.calls[1][-1].errback(Error(b"500"))
+        self.assertEqual(len(self.flushLoggedErrors(Error)), 1)
+        self.assertEqual(self.successResultOf(self.provider.getToken(7)),
+                         'old')
+        self.clock.advance(self.provider.retryDelay)
+        self.assertEqual(len(self.calls), 3)
+
+    def test_expired(self):
+        """
+        An expired token is not served.
+        """
+        self.provider.getToken(7)
+        self.mint(0, 'old')
+        self.provider.stop()
+        self.clock.advance(3600)
+        d = self.provider.getToken(7)
+        self.assertNoResult(d)
+        self.mint(1, 'new')
+        self.assertEqual(self.successResultOf(d), 'new')
+
+    def test_mint_failure(self):
+        """
+        A failure to mint a token is reported to those waiting for it.
+        """
+        d = self.provider.getToken(7)
+        self.calls[0][-1].errback(Error(b"401"))
+        self.failureResultOf(d, Error)
+
+    def test_unparseable_response(self):
+        """
+        A response which cannot be parsed fails those waiting for the
+        token, and the next request mints again.
+        """
+        d = self.provider.getToken(7)
+        self.calls[0][-1].callback(json.dumps({'token': 'tok1'}))
+        self.failureResultOf(d, KeyError)
+        self.provider.getToken(7)
+        self.assertEqual(len(self.calls), 2)
+
+    def test_expiry_offset(self):
+        """
+        Expiry times with a numeric offset are understood.
+        """
+        self.provider.getToken(7)
+        self.mint(0, 'old', expires_at='2016-07-12T01:00:00+02:00')
+        self.clock.advance(3299)
+        self.assertEqual(len(self.calls), 1)
+        self.clock.advance(1)
+        self.assertEqual(len(self.calls), 2)
+
+    def test_mint_timeout(self):
+        """
+        Minting a token fails after C{mintTimeout} seconds.
+        """
+        d = self.provider.getToken(7)
+        self.clock.advance(self.provider.mintTimeout)
+        self.failureResultOf(d, TimeoutError)
@@ -0,0 +1,139 @@
+"""
+Tests for L{txgithub.diff}.
+"""
+from twisted.trial.unittest import SynchronousTestCase
+
+from txgithub.diff import DiffParser, DiffPositionIndex
+
+
+DIFF = b"""\
+diff --git a/README b/README
+index 1234567..89abcde 100644
+--- a/README
++++ b/README
+@@ -1,3 +1,4 @@
+ one
+-two
++deux
++trois
+ four
+@@ -10,2 +11,3 @@ section
+ ten
++eleven
+ twelve
+\\ No newline at end of file
+diff --git a/old.txt b/old.txt
+deleted file mode 100644
+index 1234567..0000000
+--- a/old.txt
++++ /dev/null
+@@ -1 +0,0 @@
+-gone
+diff --git a/image.png b/image.png
+new file mode 100644
+Binary files /dev/null and b/image.png differ
+"""
+
+
+class DiffParserTests(SynchronousTestCase):
+    """
+    Tests for L{DiffParser}.
+    """
+
+    def parse(self, data, chunkSize):
+        hunks = []
+        parser = DiffParser(hunks.append)
+        for i in range(0, len(data), chunkSize):
+            parser.dataReceived(data[i:i + chunkSize])
+        parser.finish()
+        return hunks
+
+    def test_hunks(self):
+        """
+        Every hunk is delivered with its file, ranges, the diff position
+        of its first line, and its lines.  Positions count every line
+        below the first hunk header of a file, including later hunk
+        headers.
+        """
+        hunks = self.parse(DIFF, len(DIFF))
+        self.assertEqual(
+            [(hunk.path, hunk.oldStart, hunk.oldCount, hunk.newStart,
+              hunk.newCount, hunk.position) for hunk in hunks],
+            [("README", 1, 3, 1, 4, 1),
+             ("README", 10, 2, 11, 3, 7),
+             ("old.txt", 1, 1, 0, 0, 1)])
+        self.assertEqual(hunks[0].lines,
+                         [b" one", b"-two", b"+deux", b"+trois", b" four"])
+        self.assertEqual(hunks[1].lines[-1],
+                         b"\\ No newline at end of file")
+
+    def test_chunked(self):
+        """
+        The diff may be fed in chunks splitting lines anywhere.
+        """
+        self.assertEqual(self.parse(DIFF, 7), self.parse(DIFF, len(DIFF)))
+
+    def test_incremental(self):
+        """
+        A hunk is delivered as soon as the next one starts.
+        """
+        hunks = []
+        parser = DiffParser(hunks.append)
+        parser.dataReceived(DIFF[:DIFF.index(b"@@ -10")])
+        self.assertEqual(hunks, [])
+        parser.dataReceived(b"@@ -10,2 +11,3 @@\n")
+        self.assertEqual(len(hunks), 1)
+
+    def test_malformed_hunk_header(self):
+        """
+        A malformed hunk header raises L{ValueError}.
+        """
+        parser = DiffParser(lambda hunk: None)
+        self.assertRaises(ValueError, parser.dataReceived, b"@@ nonsense\n")
+
+
+class DiffPositionIndexTests(SynchronousTestCase):
+    """
+    Tests for L{DiffPositionIndex}.
+    """
+
+    def setUp(self):
+        self.index = DiffPositionIndex()
+        parser = DiffParser(self.index.addHunk)
+        parser.dataReceived(DIFF)
+        parser.finish()
+
+    def test_position(self):
+        """
+        Lines of the new version of a file map to their diff position.
+        """
+        positions = [(line, self.index.position("README", line))
+                     for line in [1, 2, 3, 4, 11, 12, 13]]
+        self.assertEqual(positions,
+                         [(1, 1), (2, 3), (3, 4), (4, 5),
+                          (11, 7), (12, 8), (13, 9)])
+
+    def test_outside_diff(self):
+        """
+        Lines outside the diff, and files not in it, have no position.
+        """
+        self.assertIsNone(self.index.position("README", 5))
+        self.assertIsNone(self.index.position("README", 0))
+        self.assertIsNone(self.index.position("README", 14))
+        self.assertIsNone(self.index.position("other", 1))
+
+    def test_compact(self):
+        """
+        Consecutive lines are stored as runs.
+        """
+        starts, positions, lengths = self.index._runs["README"]
+        self.assertEqual(list(zip(starts, positions, lengths)),
+                         [(1, 1, 1), (2, 3, 3), (11, 7, 3)])
+
+    def test_paths(self):
+        """
+        The paths of the files with hunks are listed.
+        """
+        self.assertEqual(self.index.paths(), ["README", "old.txt"])
+        self.assertIn("README", self.index)
+        self.assertNotIn("image.png", self.index)
@@ -0,0 +1,206 @@
+"""
+Tests for L{txgithub.events}.
+"""
+from twisted.internet.defer import Deferred, fail, succeed
+from twisted.internet.task import Clock
+from twisted.trial.unittest import SynchronousTestCase
+from twisted.web.error import Error
+
+from txgithub.api import GithubApi
+from txgithub.events import EventMerger
+
+
+class FakeRepos(object):
+    def __init__(self):
+        self.events = {}
+        self.calls = []
+
+    def getEvents(self, repo_user, repo_name, until_id=None):
+        self.calls.append(((repo_user, repo_name), until_id))
+        events = self.events.pop((repo_user, repo_name), [])
+        if isinstance(events, Exception):
+            return fail(events)
+        return succeed(events)
+
+
+class FakeApi(object):
+    def __init__(self):
+        self.reactor = Clock()
+        # 2016-07-11T22:00:00Z
+        self.reactor.advance(1468274400)
+        self.rateLimits = {}
+        self.repos = FakeRepos()
+
+
+def event(id, created_at):
+    return {'id': str(id), 'created_at': '2016-07-11T%sZ' % (created_at,)}
+
+
+class EventMergerTests(SynchronousTestCase):
+    """
+    Tests for L{EventMerger}.
+    """
+
+    def setUp(self):
+        self.api = FakeApi()
+        self.received = []
+        self.merger = EventMerger(
+            self.api, [('u', 'a'), ('u', 'b')],
+            lambda repo, event: self.received.append((repo, event['id'])),
+            maxSeen=3, maxBuffered=5)
+
+    def test_merged(self):
+        """
+        The events of all repositories are delivered oldest first.
+        """
+        self.api.repos.events = {
+            ('u', 'a'): [event(3, '21:30:00'), event(1, '21:10:00')],
+            ('u', 'b'): [event(4, '21:40:00'), event(2, '21:20:00')]}
+        self.successResultOf(self.merger.poll())
+        self.assertEqual(self.received,
+                         [(('u', 'a'), '1'), (('u', 'b'), '2'),
+                          (('u', 'a'), '3'), (('u', 'b'), '4')])
+        self.assertEqual(self.merger.marks, {('u', 'a'): '3',
+                                             ('u', 'b'): '4'})
+
+    def test_polls_since_mark(self):
+        """
+        Repositories are polled for the events since the newest seen.
+        """
+        self.api.repos.events = {('u', 'a'): [event(3, '21:30:00')]}
+        self.merger.poll()
+        self.merger.poll()
+        self.assertEqual(self.api.repos.calls[2:],
+                         [(('u', 'a'), '3'), (('u', 'b'), None)])
+
+    def test_held_until_watermark(self):
+        """
+        Events created after a round started are held back until the next
+        round, in which older events of other repositories may turn up.
+        """
+        self.api.repos.events = {('u', 'a'): [event(2, '22:00:30')]}
+        self.merger.poll()
+        self.assertEqual(self.received, [])
+        self.assertEqual(len(self.merger), 1)
+        self.api.reactor.advance(60)
+        self.api.repos.events = {('u', 'b'): [event(1, '22:00:10')]}
+        self.merger.poll()
+        self.assertEqual([id for _, id in self.received], ['1', '2'])
+
+    def test_duplicates(self):
+        """
+        Events already delivered are dropped.
+        """
+        self.api.repos.events = {('u', 'a'): [event(1, '21:10:00')],
+                                 ('u', 'b'): [event(1, '21:10:00')]}
+        self.merger.poll()
+        self.assertEqual(len(self.received), 1)
+        self.assertEqual(self.merger.duplicates, 1)
+
+    def test_backpressure(self):
+        """
+        No event is delivered until the Deferred returned for the previous
+        one fires, and no round is started while too many events wait.
+        """
+        waiting = []
+
+        def eventReceived(repo, event):
+            waiting.append(Deferred())
+            return waiting[-1]
+        self.merger.eventReceived = eventReceived
+        self.api.repos.events = {
+            ('u', 'a'): [event(i, '21:0%d:00' % i) for i in range(6)]}
+        self.merger.poll()
+        self.assertEqual(len(waiting), 1)
+        calls = len(self.api.repos.calls)
+        self.merger.poll()
+        self.assertEqual(len(self.api.repos.calls), calls)
+        waiting[0].callback(None)
+        self.assertEqual(len(waiting), 2)
+        self.merger.poll()
+        self.assertEqual(len(self.api.repos.calls), calls + 2)
+
+    def test_rate_limit_reserve(self):
+        """
+        No round is started while fewer than C{reserve} requests are left,
+        until the rate limit resets.
+        """
+        now = self.api.reactor.seconds()
+        self.api.rateLimits['core'] = dict(limit=5000, remaining=10,
+                                           reset=now + 60)
+        self.merger.poll()
+        self.assertEqual(self.api.repos.calls, [])
+        self.api.reactor.advance(60)
+        self.merger.poll()
+        self.assertEqual(len(self.api.repos.calls), 2)
+
+    def test_poll_failure(self):
+        """
+        A failure to poll a repository is logged, and the other
+        repositories' events are still delivered.
+        """
+        self.api.repos.events = {('u', 'a'): Error(b"500"),
+                                 ('u', 'b'): [event(1, '21:10:00')]}
+        self.successResultOf(self.merger.poll())
+        self.assertEqual(len(self.flushLoggedErrors(Error)), 1)
+        self.assertEqual(self.received, [(('u', 'b'), '1')])
+
+    def test_start(self):
+        """
+        Once started, the merger polls every C{interval} seconds.
+        """
+        self.merger.start()
+        self.assertEqual(len(self.api.repos.calls), 2)
+        self.api.reactor.advance(self.merger.interval)
+        self.assertEqual(len(self.api.repos.calls), 4)
+        self.merger.stop()
+        self.api.reactor.advance(self.merger.interval)
+        self.assertEqual(len(self.api.repos.calls), 4)
+
+
+class EventMergerGetEventsTests(SynchronousTestCase):
+    """
+    Tests for L{EventMerger} polling with L{txgithub.api.ReposEndpoint.
+    getEvents}.
+    """
+
+    def setUp(self):
+        clock = Clock()
+        clock.advance(1468274400)
+        self.api = GithubApi("token", reactor=clock)
+        self.requests = []
+        self.pages = {}
+        self.api.makeRequest = self.fake_makeRequest
+        self.received = []
+        self.merger = EventMerger(
+            self.api, [('u', 'a')],
+            lambda repo, event: self.received.append(event['id']))
+
+    def fake_makeRequest(self, url_args, post=None, method='GET', page=0):
+        self.requests.append((url_args, page))
+        if len(self.requests) > 20:
+            self.fail("getEvents does not stop paging")
+        return succeed(self.pages.get(page, []))
+
+    def test_first_poll(self):
+        """
+        The first poll of a repository fetches its pages of events, from
+        page 1, until an empty one.
+        """
+        self.pages = {1: [event(3, '21:30:00'), event(2, '21:20:00')],
+                      2: [event(1, '21:10:00')]}
+        self.successResultOf(self.merger.poll())
+        self.assertEqual([page for _, page in self.requests], [1, 2, 3])
+        self.assertEqual(self.received, ['1', '2', '3'])
+
+    def test_next_poll(self):
+        """
+        Later polls stop at the newest event already seen.
+        """
+        self.pages = {1: [event(1, '21:10:00')]}
+        self.merger.poll()
+        self.pages = {1: [event(2, '21:20:00'), event(1, '21:10:00')]}
+        del self.requests[:]
+        self.merger.poll()
+        self.assertEqual([page for _, page in self.requests], [1])
+        self.assertEqual(self.received, ['1', '2'])
@@ -0,0 +1,139 @@
+"""
+Tests for L{txgithub.hooks}.
+"""
+from twisted.internet.defer import fail, succeed
+from twisted.trial.unittest import SynchronousTestCase
+from twisted.web.error import Error
+
+from txgithub.api import GithubApi, Response
+from txgithub.hooks import HookReconciler
+
+
+class HookReconcilerTests(SynchronousTestCase):
+    """
+    Tests for L{HookReconciler}.
+    """
+
+    def setUp(self):
+        self.hooks = {}
+        self.unchanged = set()
+        self.requests = []
+        self.github = GithubApi(oauth2_token='fake-token')
+        self.github.makeRequest = self.fake_makeRequest
+        self.reconciler = HookReconciler(self.github, concurrency=2)
+
+        self.config = {'url': 'https://ci/hook', 'content_type': 'json',
+                       'secret': 'sekrit'}
+        self.events = ['push', 'pull_request']
+
+    def fake_makeRequest(self, url_args, post=None, method='GET', page=0,
+                         etagCache=None, fullResponse=False):
+        """
+        Serve the hooks in C{self.hooks}, pretending listings of
+        repositories in C{self.unchanged} were not modified.
+        """
+        repo = tuple(url_args[1:3])
+        if method != 'GET':
+            self.requests.append((method, url_args, post))
+            return succeed(None)
+        etagCache.lookups += 1
+        if repo in self.unchanged:
+            etagCache.hits += 1
+        if repo not in self.hooks:
+            return fail(Error(b"404", b"Not Found"))
+        return succeed(Response('200', {}, self.hooks[repo]))
+
+    def hook(self, id, url='https://ci/hook', events=None, active=True,
+             **config):
+        """
+        Make a hook as returned by GitHub.
+        """
+        config.setdefault('content_type', 'json')
+        config.setdefault('secret', '********')
+        config['url'] = url
+        return {'id': id, 'name': 'web', 'config': config,
+                'events': self.events if events is None else events,
+                'active': active}
+
+    def reconcile(self, repos):
+        return self.successResultOf(self.reconciler.reconcile(
+            repos, 'web', self.config, self.events))
+
+    def test_create_missing(self):
+        """
+        The hook is created on repositories that do not have it.
+        """
+        self.hooks[('user', 'a')] = [self.hook(1, url='https://other')]
+        summary = self.reconcile([('user', 'a')])
+        self.assertEqual(self.requests, [
+            ('POST', ['repos', 'user', 'a', 'hooks'],
+             dict(name='web', config=self.config, events=self.events,
+                  active=True))])
+        self.assertEqual(summary['created'], 1)
+        self.assertEqual(summary['callsMade'], 2)
+
+    def test_unchanged(self):
+        """
+        Repositories whose hook matches the specification are left
+        alone.  Event order and masked secrets do not matter.
+        """
+        self.hooks[('user', 'a')] = [
+            self.hook(1, events=list(reversed(self.events)))]
+        summary = self.reconcile([('user', 'a')])
+        self.assertEqual(self.requests, [])
+        self.assertEqual(summary['unchanged'], 1)
+        self.assertEqual(summary['callsSaved'], 1)
+
+    def test_edit(self):
+        """
+        A hook differing from the specification is edited.
+        """
+        self.hooks[('user', 'a')] = [self.hook(7, active=False)]
+        summary = self.reconcile([('user', 'a')])
+        self.assertEqual(self.requests, [
+            ('PATCH', ['repos', 'user', 'a', 'hooks', '7'],
+             dict(name='web', config=self.config, events=self.events,
+                  active=True))])
+        self.assertEqual(summary['edited'], 1)
+
+    def test_edit_config(self):
+        """
+        A hook whose configuration differs is edited.
+        """
+        self.hooks[('user', 'a')] = [self.hook(7, content_type='form')]
+        self.assertEqual(self.reconcile([('user', 'a')])['edited'], 1)
+
+    def test_delete_duplicates(self):
+        """
+        Extra copies of the hook are deleted.
+        """
+        self.hooks[('user', 'a')] = [self.hook(1), self.hook(2)]
+        summary = self.reconcile([('user', 'a')])
+        self.assertEqual(self.requests, [
+            ('DELETE', ['repos', 'user', 'a', 'hooks', '2'], None)])
+        self.assertEqual(summary['deleted'], 1)
+        self.assertEqual(summary['unchanged'], 1)
+
+    def test_not_modified(self):
+        """
+        Listings answered with 304 Not Modified are counted as saved
+        calls.
+        """
+        self.hooks[('user', 'a')] = [self.hook(1)]
+        self.hooks[('user', 'b')] = [self.hook(1)]
+        self.unchanged.add(('user', 'a'))
+        summary = self.reconcile([('user', 'a'), ('user', 'b')])
+        self.assertEqual(summary['notModified'], 1)
+        self.assertEqual(summary['callsMade'], 2)
+        self.assertEqual(summary['callsSaved'], 3)
+
+    def test_failures_collected(self):
+        """
+        A failure on one repository is reported without stopping the
+        others.
+        """
+        self.hooks[('user', 'b')] = []
+        summary = self.reconcile([('user', 'a'), ('user', 'b')])
+        self.assertEqual(list(summary['failed']), [('user', 'a')])
+        summary['failed'][('user', 'a')].trap(Error)
+        self.assertEqual(summary['created'], 1)
@@ -0,0 +1,202 @@
+"""
+Tests for L{txgithub.outbox}.
+"""
+from twisted.internet.defer import Deferred
+from twisted.internet.error import ConnectionRefusedError
+from twisted.internet.task import Clock
+from twisted.trial.unittest import SynchronousTestCase
+from twisted.web.error import Error
+
+from txgithub.api import GithubApi
+from txgithub.outbox import Outbox
+
+
+class OutboxTests(SynchronousTestCase):
+    """
+    Tests for L{Outbox}.
+    """
+
+    def setUp(self):
+        self.clock = Clock()
+        self.api = GithubApi("token", reactor=self.clock)
+        self.requests = []
+        self.api.makeRequest = self.fake_makeRequest
+        self.path = self.mktemp()
+        self.outbox = Outbox(self.api, self.path)
+
+    def fake_makeRequest(self, url_args, method, post, timeout):
+        self.requests.append((url_args, method, post, timeout, Deferred()))
+        return self.requests[-1][-1]
+
+    def test_delivered(self):
+        """
+        A write is recorded, sent, and removed once GitHub answers it.
+        """
+        d = self.outbox.send(['repos', 'u', 'r', 'statuses', 'abc'],
+                             post={'state': 'success'})
+        self.assertEqual(self.outbox.depth(), 1)
+        url_args, method, post, timeout, response = self.requests[0]
+        self.assertEqual((url_args, method, post, timeout),
+                         (['repos', 'u', 'r', 'statuses', 'abc'], 'POST',
+                          {'state': 'success'}, None))
+        response.callback({'id': 1})
+        self.assertEqual(self.successResultOf(d), {'id': 1})
+        self.assertEqual(self.outbox.depth(), 0)
+
+    def test_survives_restart(self):
+        """
+        Writes not delivered are sent again by the next outbox started on
+        the same database.
+        """
+        self.outbox.send(['repos', 'u', 'r', 'statuses', 'abc'],
+                         post={'state': 'success'})
+        outbox = Outbox(self.api, self.path)
+        self.assertEqual(outbox.depth(), 1)
+        outbox.start()
+        self.assertEqual(len(self.requests), 2)
+        self.assertEqual(self.requests[1][:3],
+                         (['repos', 'u', 'r', 'statuses', 'abc'], 'POST',
+                          {'state': 'success'}))
+        self.assertIsInstance(self.requests[1][0][0], str)
+        self.requests[1][-1].callback({})
+        self.assertEqual(outbox.depth(), 0)
+
+    def test_retried(self):
+        """
+        Writes failing because GitHub is unavailable are resent with
+        exponential backoff until they are delivered.
+        """
+        d = self.outbox.send(['gists'], post={})
+        self.requests[0][-1].errback(ConnectionRefusedError())
+        self.clock.advance(self.outbox.retryDelay)
+        self.requests[1][-1].errback(Error(b"502"))
+        self.clock.advance(self.outbox.retryDelay * 2 - 1)
+        self.assertEqual(len(self.requests), 2)
+        self.assertNoResult(d)
+        self.clock.advance(1)
+        self.requests[2][-1].callback({'id': 3})
+        self.assertEqual(self.successResultOf(d), {'id': 3})
+        self.assertEqual(self.outbox.depth(), 0)
+
+    def test_refused(self):
+        """
+        Writes GitHub refuses are dropped.
+        """
+        d = self.outbox.send(['gists'], post={})
+        self.requests[0][-1].errback(Error(b"422"))
+        self.failureResultOf(d, Error)
+        self.assertEqual(self.outbox.depth(), 0)
+
+    def forbidden(self, index, headers):
+        """
+        Answer request C{index} with a 403 with C{headers}.
+        """
+        reason = Error(b"403", b"Forbidden")
+        reason.response_headers = headers
+        self.requests[index][-1].errback(reason)
+
+    def test_rate_limited(self):
+        """
+        Writes refused with a 403 because the rate limit is used up are
+        resent.
+        """
+        d = self.outbox.send(['gists'], post={})
+        self.forbidden(0, {'x-ratelimit-remaining': ['0']})
+        self.clock.advance(self.outbox.retryDelay)
+        self.forbidden(1, {'retry-after': ['60']})
+        self.clock.advance(self.outbox.retryDelay * 2)
+        self.requests[2][-1].callback({'id': 3})
+        self.assertEqual(self.successResultOf(d), {'id': 3})
+
+    def test_forbidden(self):
+        """
+        Writes refused with a 403 for any other reason are dropped.
+        """
+        d = self.outbox.send(['gists'], post={})
+        self.forbidden(0, {'x-ratelimit-remaining': ['4000']})
+        self.failureResultOf(d, Error)
+        self.assertEqual(self.outbox.depth(), 0)
+
+    def test_max_attempts(self):
+        """
+        Writes which failed C{maxAttempts} times are dropped.
+        """
+        self.outbox.maxAttempts = 2
+        d = self.outbox.send(['gists'], post={})
+        self.requests[0][-1].errback(Error(b"502"))
+        self.clock.advance(self.outbox.retryDelay)
+        self.requests[1][-1].errback(Error(b"502"))
+        self.failureResultOf(d, Error)
+        self.assertEqual(self.outbox.depth(), 0)
+        self.clock.advance(self.outbox.maxRetryDelay)
+        self.assertEqual(len(self.requests), 2)
+
+    def test_superseded(self):
+        """
+        A write with the same key as an undelivered one replaces it, and
+        both are answered once it is delivered.
+        """
+        first = self.outbox.send(['s'], post={'state': 'pending'},
+                                 key=('s', 'ctx'))
+        self.requests[0][-1].errback(ConnectionRefusedError())
+        second = self.outbox.send(['s'], post={'state': 'success'},
+                                  key=('s', 'ctx'))
+        self.assertEqual(self.outbox.depth(), 1)
+        self.assertEqual(self.outbox.compacted, 1)
+        self.requests[1][-1].callback({'state': 'success'})
+        self.assertEqual(self.successResultOf(first), {'state': 'success'})
+        self.assertEqual(self.successResultOf(second), {'state': 'success'})
+        self.clock.advance(self.outbox.maxRetryDelay)
+        self.assertEqual(len(self.requests), 2)
+
+    def test_same_key_in_order(self):
+        """
+        A write is not sent while one with the same key is being sent.
+        """
+        self.outbox.send(['s'], post={'state': 'pending'}, key=('s', 'ctx'))
+        self.outbox.send(['t'], post={}, key=('t', 'ctx'))
+        self.outbox.send(['s'], post={'state': 'success'}, key=('s', 'ctx'))
+        self.assertEqual([request[0] for request in self.requests],
+                         [['s'], ['t']])
+        self.requests[0][-1].errback(Error(b"502"))
+        self.assertEqual(self.requests[2][2], {'state': 'success'})
+        self.clock.advance(self.outbox.maxRetryDelay)
+        self.assertEqual(len(self.requests), 3)
+
+    def test_createStatus(self):
+        """
+        Commit statuses are sent through the outbox of the API, keyed by
+        their commit and context.
+        """
+        self.api.outbox = self.outbox
+        self.api.repos.createStatus('u', 'r', 'abc', 'pending',
+                                    context='ci')
+        self.requests[0][-1].errback(Error(b"502"))
+        self.api.repos.createStatus('u', 'r', 'abc', 'success',
+                                    context='ci')
+        self.api.repos.createStatus('u', 'r', 'abc', 'success',
+                                    context='lint')
+        self.assertEqual(self.outbox.depth(), 2)
+        self.assertEqual([request[2]['state'] for request in self.requests],
+                         ['pending', 'success', 'success'])
+
+    def test_createStatus_timeout(self):
+        """
+        The timeout of a commit status sent through the outbox is that of
+        every attempt to send it.
+        """
+        self.api.outbox = self.outbox
+        self.api.repos.createStatus('u', 'r', 'abc', 'pending', timeout=2)
+        self.requests[0][-1].errback(Error(b"502"))
+        self.clock.advance(self.outbox.retryDelay)
+        self.assertEqual([request[3] for request in self.requests], [2, 2])
+
+    def test_issue_comment(self):
+        """
+        Issue comments are sent through the outbox of the API.
+        """
+        self.api.outbox = self.outbox
+        self.api.comments.create('u', 'r', '1', 'hello')
+        self.assertEqual(self.requests[0][:3],
+                         (['repos', 'u', 'r', 'issues', '1', 'comments'],
+                          'POST', {'body': 'hello'}))
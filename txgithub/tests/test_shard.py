@@ -0,0 +1,333 @@
+"""
+Tests for L{txgithub.shard}.
+"""
+import json
+import struct
+
+from twisted.internet.defer import Deferred, fail, succeed
+from twisted.internet.error import ProcessTerminated
+from twisted.internet.task import Clock
+from twisted.python.failure import Failure
+from twisted.test.proto_helpers import MemoryReactorClock, StringTransport
+from twisted.trial.unittest import SynchronousTestCase
+from twisted.web.error import Error
+
+from txgithub import shard, token
+from txgithub.api import GithubApi
+from txgithub.shard import (EVENT_FIELDS, HashRing, ShardPool,
+                            ShardedEventMerger, WorkerError, _ShardWorker)
+
+
+def frame(message):
+    data = json.dumps(message)
+    return struct.pack('!I', len(data)) + data
+
+
+def unframe(data):
+    messages = []
+    while data:
+        length, = struct.unpack('!I', data[:4])
+        messages.append(json.loads(data[4:4 + length]))
+        data = data[4 + length:]
+    return messages
+
+
+class ProcessTransport(StringTransport):
+    stdinClosed = False
+
+    def closeStdin(self):
+        self.stdinClosed = True
+
+
+class FakeReactor(Clock):
+    def __init__(self):
+        Clock.__init__(self)
+        self.processes = []
+
+    def spawnProcess(self, processProtocol, executable, args, env):
+        self.processes.append((processProtocol, args, env))
+        processProtocol.makeConnection(ProcessTransport())
+
+
+class HashRingTests(SynchronousTestCase):
+    """
+    Tests for L{HashRing}.
+    """
+
+    def test_spread(self):
+        """
+        Keys are spread over all nodes.
+        """
+        ring = HashRing(['a', 'b', 'c'])
+        counts = {}
+        for i in range(3000):
+            node = ring.nodeFor('repo%d' % (i,))
+            counts[node] = counts.get(node, 0) + 1
+        self.assertEqual(sorted(counts), ['a', 'b', 'c'])
+        self.assertTrue(min(counts.values()) > 500, counts)
+
+    def test_consistent(self):
+        """
+        Adding a node only moves keys to it.
+        """
+        before = HashRing(['a', 'b', 'c'])
+        after = HashRing(['a', 'b', 'c', 'd'])
+        for i in range(1000):
+            key = 'repo%d' % (i,)
+            self.assertIn(after.nodeFor(key), (before.nodeFor(key), 'd'))
+
+
+class ShardPoolTests(SynchronousTestCase):
+    """
+    Tests for L{ShardPool}.
+    """
+
+    def setUp(self):
+        self.reactor = FakeReactor()
+        self.pool = ShardPool(self.reactor, 2, 'secret',
+                              baseURL='https://ghe/api/v3/',
+                              executable='python')
+        self.pool.start()
+
+    def workerFor(self, repo):
+        name = self.pool._ring.nodeFor(repo)
+        return self.pool._workers[name]
+
+    def test_spawn(self):
+        """
+        A worker process is spawned for every shard, with the token in
+        its environment.
+        """
+        self.assertEqual(len(self.reactor.processes), 2)
+        processProtocol, args, env = self.reactor.processes[0]
+        self.assertEqual(args, ['python', '-m', 'txgithub.shard',
+                                'https://ghe/api/v3/'])
+        self.assertEqual(env['GITHUB_TOKEN'], 'secret')
+
+    def test_getEvents(self):
+        """
+        Polls are sent to the worker of the repository, and answered with
+        the events it sends back.
+        """
+        d = self.pool.getEvents('u', 'r', until_id='7')
+        worker = self.workerFor('u/r')
+        request, = unframe(worker.transport.value())
+        self.assertEqual(request, {'id': 1, 'repo': ['u', 'r'],
+                                   'until_id': '7',
+                                   'fields': list(EVENT_FIELDS)})
+        worker.outReceived(frame(dict(id=1, events=[{'id': '8'}],
+                                      rateLimit=dict(limit=5000,
+                                                     remaining=10,
+                                                     reset=100))))
+        self.assertEqual(self.successResultOf(d), [{'id': '8'}])
+        self.assertEqual(self.pool.rateLimits['core']['remaining'], 10)
+
+    def test_whole_events(self):
+        """
+        Without C{fields}, the workers are asked for whole events.
+        """
+        pool = ShardPool(self.reactor, 1, 'secret', fields=None)
+        pool.start()
+        pool.getEvents('u', 'r')
+        worker, = pool._workers.values()
+        request, = unframe(worker.transport.value())
+        self.assertIsNone(request['fields'])
+
+    def test_error(self):
+        """
+        Failures to poll are reported by the worker.
+        """
+        d = self.pool.getEvents('u', 'r')
+        self.workerFor('u/r').outReceived(frame(dict(id=1, error='500')))
+        self.failureResultOf(d, WorkerError)
+
+    def test_rate_limit_reports(self):
+        """
+        The fewest requests left in the latest rate limit window are kept.
+        """
+        self.pool.rateLimitReported(dict(limit=5000, remaining=10, reset=1))
+        self.pool.rateLimitReported(dict(limit=5000, remaining=20, reset=1))
+        self.assertEqual(self.pool.rateLimits['core']['remaining'], 10)
+        self.pool.rateLimitReported(dict(limit=5000, remaining=4000,
+                                         reset=2))
+        self.assertEqual(self.pool.rateLimits['core']['remaining'], 4000)
+
+    def test_restart(self):
+        """
+        A worker which ends fails its pending polls, and is restarted.
+        """
+        d = self.pool.getEvents('u', 'r')
+        worker = self.workerFor('u/r')
+        worker.processEnded(Failure(ProcessTerminated(1)))
+        self.failureResultOf(d, ProcessTerminated)
+        self.failureResultOf(self.pool.getEvents('u', 'r'), WorkerError)
+        self.reactor.advance(self.pool.restartDelay)
+        self.assertEqual(len(self.reactor.processes), 3)
+        self.assertIsNot(self.workerFor('u/r'), worker)
+
+    def test_stop(self):
+        """
+        Stopping the pool closes the workers' input, and they are not
+        restarted.
+        """
+        self.pool.stop()
+        for processProtocol, _, _ in self.reactor.processes:
+            self.assertTrue(processProtocol.transport.stdinClosed)
+            processProtocol.processEnded(Failure(ProcessTerminated(0)))
+        self.reactor.advance(self.pool.restartDelay)
+        self.assertEqual(len(self.reactor.processes), 2)
+
+
+class ShardedEventMergerTests(SynchronousTestCase):
+    """
+    Tests for L{ShardedEventMerger}.
+    """
+
+    def test_merged(self):
+        """
+        The events polled by the workers are merged.
+        """
+        reactor = FakeReactor()
+        reactor.advance(1468274400)
+        received = []
+        merger = ShardedEventMerger(
+            reactor, 'secret', [('u', 'a')],
+            lambda repo, event: received.append(event['id']), workers=1,
+            interval=60)
+        merger.start()
+        worker, _, _ = reactor.processes[0]
+        worker.outReceived(frame(dict(id=1, events=[
+            {'id': '2', 'created_at': '2016-07-11T21:00:00Z'},
+            {'id': '1', 'created_at': '2016-07-11T20:00:00Z'}])))
+        self.assertEqual(received, ['1', '2'])
+        merger.stop()
+        self.assertTrue(worker.transport.stdinClosed)
+
+
+class FakeRepos(object):
+    def __init__(self, result):
+        self.result = result
+        self.calls = []
+
+    def getEvents(self, repo_user, repo_name, until_id=None):
+        self.calls.append((repo_user, repo_name, until_id))
+        return self.result
+
+
+class FakeApi(object):
+    def __init__(self, result):
+        self.rateLimits = {}
+        self.repos = FakeRepos(result)
+
+
+class ShardWorkerTests(SynchronousTestCase):
+    """
+    Tests for L{_ShardWorker}.
+    """
+
+    def serve(self, api, fields=None):
+        worker = _ShardWorker(api)
+        self.transport = StringTransport()
+        worker.channel.makeConnection(self.transport)
+        worker.channel.dataReceived(frame(dict(id=3, repo=['u', 'r'],
+                                               until_id=None,
+                                               fields=fields)))
+        return unframe(self.transport.value())
+
+    def test_events(self):
+        """
+        The worker polls the repository, and answers with the events and
+        the rate limit.
+        """
+        api = FakeApi(succeed([{'id': '1'}]))
+        api.rateLimits['core'] = dict(limit=5000, remaining=10, reset=1)
+        self.assertEqual(self.serve(api),
+                         [dict(id=3, events=[{'id': '1'}],
+                               rateLimit=dict(limit=5000, remaining=10,
+                                              reset=1))])
+        self.assertEqual(api.repos.calls, [('u', 'r', None)])
+        self.assertIsInstance(api.repos.calls[0][0], str)
+
+    def test_projected(self):
+        """
+        Only the requested fields of the events are sent to the parent.
+        """
+        event = {'id': '1', 'created_at': '2016-07-11T21:00:00Z',
+                 'type': 'PushEvent', 'public': True,
+                 'org': {'login': 'o', 'avatar_url': 'https://avatars/o'}}
+        api = FakeApi(succeed([event]))
+        reply, = self.serve(api, fields=list(EVENT_FIELDS))
+        self.assertEqual(reply['events'],
+                         [{'id': '1', 'created_at': '2016-07-11T21:00:00Z',
+                           'type': 'PushEvent'}])
+        self.assertNotIn(b'avatar_url', self.transport.value())
+        self.assertNotIn(b'public', self.transport.value())
+
+    def test_error(self):
+        """
+        Failures are answered with their message.
+        """
+        api = FakeApi(fail(Error(b"500", b"Server Error")))
+        reply, = self.serve(api)
+        self.assertEqual(reply['id'], 3)
+        self.assertIn('500', reply['error'])
+
+    def test_pending(self):
+        """
+        The answer is sent once the poll is over.
+        """
+        api = FakeApi(Deferred())
+        self.assertEqual(self.serve(api), [])
+
+    def test_first_poll(self):
+        """
+        The first poll of a repository, through the real
+        L{txgithub.api.ReposEndpoint.getEvents}, pages through its events
+        and is answered.
+        """
+        api = GithubApi("token", reactor=Clock())
+        pages = {1: [{'id': '2'}], 2: [{'id': '1'}]}
+        requested = []
+
+        def fake_makeRequest(url_args, post=None, method='GET', page=0):
+            requested.append(page)
+            if len(requested) > 20:
+                self.fail("getEvents does not stop paging")
+            return succeed(pages.get(page, []))
+        api.makeRequest = fake_makeRequest
+        reply, = self.serve(api)
+        self.assertEqual(requested, [1, 2, 3])
+        self.assertEqual(reply['events'], [{'id': '2'}, {'id': '1'}])
+
+
+class MainTests(SynchronousTestCase):
+    """
+    Tests for L{txgithub.shard.main}.
+    """
+
+    def test_serves_stdio(self):
+        """
+        The worker gets its token, serves polls from standard input, and
+        stops the reactor once standard input is closed.
+        """
+        reactor = MemoryReactorClock()
+        protocols = []
+
+        def standardIO(protocol):
+            protocols.append(protocol)
+            protocol.makeConnection(StringTransport())
+        self.patch(token, 'getToken', lambda: succeed('secret'))
+        self.patch(shard.log, 'startLogging', lambda f: None)
+        shard.main(['shard', 'https://ghe/api/v3/'], reactor, standardIO)
+        protocol, = protocols
+
+        reactor.hasStopped = False
+        protocol.dataReceived(frame(dict(id=1, repo=['u', 'r'],
+                                         until_id=None,
+                                         fields=['id'])))
+        factory = reactor.sslClients[-1][2]
+        self.assertEqual(factory.url,
+                         'https://ghe/api/v3/repos/u/r/events?page=1')
+        self.assertEqual(factory.headers['Authorization'], 'token secret')
+        protocol.connectionLost(None)
+        self.assertTrue(reactor.hasStopped)
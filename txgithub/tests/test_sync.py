@@ -0,0 +1,283 @@
+"""
+Tests for L{txgithub.sync}.
+"""
+from twisted.internet.defer import succeed
+from twisted.internet.task import Clock
+from twisted.trial.unittest import SynchronousTestCase
+
+from txgithub.api import GithubApi, Response
+from txgithub.sync import (PullRequestSync,
+                           ReviewCommentIndex,
+                           ReviewCommentSync)
+
+
+def pull(number, updated_at):
+    """
+    Make a pull request as listed by GitHub.
+    """
+    return {'number': number, 'updated_at': updated_at}
+
+
+class PullRequestSyncTests(SynchronousTestCase):
+    """
+    Tests for L{PullRequestSync}.
+    """
+
+    def setUp(self):
+        self.pages = []
+        self.requests = []
+        self.github = GithubApi(oauth2_token='fake-token')
+        self.github.makeRequest = self.fake_makeRequest
+        self.sync = PullRequestSync(self.github)
+
+    def fake_makeRequest(self, url_args, page, params, fullResponse):
+        """
+        Serve C{self.pages}, most recently updated first.
+        """
+        self.requests.append((url_args, page, params))
+        headers = {}
+        if page < len(self.pages):
+            headers['link'] = ['<https://next>; rel="next"']
+        return succeed(Response('200', headers, self.pages[page - 1]))
+
+    def test_first_sync(self):
+        """
+        The first sync returns every pull request, listing them most
+        recently updated first.
+        """
+        self.pages = [[pull(2, '2016-01-02T00:00:00Z')],
+                      [pull(1, '2016-01-01T00:00:00Z')]]
+        result = self.successResultOf(self.sync.sync('user', 'repo'))
+        self.assertEqual([p['number'] for p in result], [2, 1])
+        self.assertEqual([page for _, page, _ in self.requests], [1, 2])
+        self.assertEqual(self.requests[0][0], ['repos', 'user', 'repo',
+                                               'pulls'])
+        self.assertEqual(self.requests[0][2], {'state': 'all',
+                                               'sort': 'updated',
+                                               'direction': 'desc'})
+        self.assertEqual(self.sync.marks[('user', 'repo')],
+                         ('2016-01-02T00:00:00Z', [2]))
+
+    def test_incremental(self):
+        """
+        Later syncs only return pull requests updated since, and stop
+        paginating at the first older one.
+        """
+        self.sync.marks[('user', 'repo')] = ('2016-01-02T00:00:00Z', [2])
+        self.pages = [[pull(3, '2016-01-03T00:00:00Z'),
+                       pull(2, '2016-01-02T00:00:00Z'),
+                       pull(1, '2016-01-01T00:00:00Z')],
+                      [pull(0, '2015-01-01T00:00:00Z')]]
+        result = self.successResultOf(self.sync.sync('user', 'repo'))
+        self.assertEqual([p['number'] for p in result], [3])
+        self.assertEqual(len(self.requests), 1)
+        self.assertEqual(self.sync.marks[('user', 'repo')],
+                         ('2016-01-03T00:00:00Z', [3]))
+
+    def test_same_timestamp(self):
+        """
+        A pull request updated in the same second as the mark, but not
+        seen yet, is returned and remembered.
+        """
+        self.sync.marks[('user', 'repo')] = ('2016-01-02T00:00:00Z', [2])
+        self.pages = [[pull(2, '2016-01-02T00:00:00Z'),
+                       pull(5, '2016-01-02T00:00:00Z'),
+                       pull(1, '2016-01-01T00:00:00Z')]]
+        result = self.successResultOf(self.sync.sync('user', 'repo'))
+        self.assertEqual([p['number'] for p in result], [5])
+        self.assertEqual(self.sync.marks[('user', 'repo')],
+                         ('2016-01-02T00:00:00Z', [5, 2]))
+
+    def test_nothing_changed(self):
+        """
+        When nothing changed, nothing is returned and the mark is kept.
+        """
+        mark = ('2016-01-02T00:00:00Z', [2])
+        self.sync.marks[('user', 'repo')] = mark
+        self.pages = [[pull(2, '2016-01-02T00:00:00Z')]]
+        self.assertEqual(self.successResultOf(self.sync.sync('user', 'repo')),
+                         [])
+        self.assertEqual(self.sync.marks[('user', 'repo')], mark)
+
+    def test_marks_per_repo(self):
+        """
+        Each repository has its own mark.
+        """
+        self.pages = [[pull(1, '2016-01-01T00:00:00Z')]]
+        self.successResultOf(self.sync.sync('user', 'a'))
+        self.assertEqual(len(self.successResultOf(
+            self.sync.sync('user', 'b'))), 1)
+
+
+def comment(id, updated_at):
+    """
+    Make a review comment as listed by GitHub.
+    """
+    return {'id': id, 'updated_at': updated_at}
+
+
+class ReviewCommentSyncTests(SynchronousTestCase):
+    """
+    Tests for L{ReviewCommentSync}.
+    """
+
+    def setUp(self):
+        self.clock = Clock()
+        self.comments = []
+        self.requests = []
+        self.github = GithubApi(oauth2_token='fake-token', reactor=self.clock)
+        self.github.makeRequest = self.fake_makeRequest
+        self.sync = ReviewCommentSync(self.github, fullSyncInterval=60)
+
+    def fake_makeRequest(self, url_args, page, params, etagCache,
+                         fullResponse):
+        """
+        Serve C{self.comments} on a single page, honouring C{since}.
+        """
+        self.requests.append((url_args, params, etagCache))
+        since = params.get('since', '')
+        return succeed(Response('200', {}, [c for c in self.comments
+                                            if c['updated_at'] >= since]))
+
+    def test_first_sync(self):
+        """
+        The first sync returns every comment.
+        """
+        self.comments = [comment(1, '2016-01-01T00:00:00Z'),
+                         comment(2, '2016-01-02T00:00:00Z')]
+        changed, deleted = self.successResultOf(
+            self.sync.sync('user', 'repo'))
+        self.assertEqual(changed, self.comments)
+        self.assertEqual(deleted, [])
+        self.assertEqual(self.requests, [
+            (['repos', 'user', 'repo', 'pulls', 'comments'],
+             {'sort': 'updated', 'direction': 'asc'}, None)])
+        self.assertEqual(self.sync.marks[('user', 'repo')],
+                         ('2016-01-02T00:00:00Z', [2]))
+        self.assertEqual(self.sync.known[('user', 'repo')], set([1, 2]))
+
+    def test_incremental(self):
+        """
+        Later syncs ask only for comments updated since the mark, and
+        skip the ones already seen at the mark.
+        """
+        self.comments = [comment(1, '2016-01-01T00:00:00Z'),
+                         comment(2, '2016-01-02T00:00:00Z')]
+        self.successResultOf(self.sync.sync('user', 'repo'))
+        del self.requests[:]
+
+        self.comments.append(comment(3, '2016-01-03T00:00:00Z'))
+        changed, deleted = self.successResultOf(
+            self.sync.sync('user', 'repo'))
+        self.assertEqual(changed, [comment(3, '2016-01-03T00:00:00Z')])
+        self.assertEqual(self.requests[0][1]['since'],
+                         '2016-01-02T00:00:00Z')
+        self.assertEqual(len(self.requests), 1)
+
+    def test_deletions(self):
+        """
+        Once the full sync interval has passed, deleted comments are
+        found with a conditional listing of all comments.
+        """
+        self.comments = [comment(1, '2016-01-01T00:00:00Z'),
+                         comment(2, '2016-01-02T00:00:00Z')]
+        self.successResultOf(self.sync.sync('user', 'repo'))
+        del self.comments[0]
+
+        changed, deleted = self.successResultOf(
+            self.sync.sync('user', 'repo'))
+        self.assertEqual(deleted, [])
+
+        self.clock.advance(60)
+        del self.requests[:]
+        changed, deleted = self.successResultOf(
+            self.sync.sync('user', 'repo'))
+        self.assertEqual(changed, [])
+        self.assertEqual(deleted, [1])
+        self.assertEqual(self.requests[1][1:], ({}, self.sync.etagCache))
+        self.assertEqual(self.sync.known[('user', 'repo')], set([2]))
+
+    def test_index(self):
+        """
+        The changes found are applied to the sync's index.
+        """
+        self.sync.index = ReviewCommentIndex()
+        self.comments = [review_comment(1), review_comment(2, position=2)]
+        self.successResultOf(self.sync.sync('user', 'repo'))
+        self.assertEqual(len(self.sync.index), 2)
+
+        del self.comments[0]
+        self.clock.advance(60)
+        self.successResultOf(self.sync.sync('user', 'repo'))
+        self.assertEqual(self.sync.index.find(('user', 'repo'), 12,
+                                              'a.py', 1), [])
+        self.assertEqual(len(self.sync.index), 1)
+
+
+def review_comment(id, pull_number=12, path='a.py', position=1,
+                   in_reply_to_id=None, updated_at='2016-01-01T00:00:00Z'):
+    """
+    Make a review comment as returned by GitHub.
+    """
+    comment = {
+        'id': id,
+        'pull_request_url':
+            'https://api.github.com/repos/user/repo/pulls/%d' % pull_number,
+        'path': path,
+        'position': position,
+        'updated_at': updated_at,
+    }
+    if in_reply_to_id is not None:
+        comment['in_reply_to_id'] = in_reply_to_id
+    return comment
+
+
+class ReviewCommentIndexTests(SynchronousTestCase):
+    """
+    Tests for L{ReviewCommentIndex}.
+    """
+
+    def setUp(self):
+        self.index = ReviewCommentIndex()
+        self.repo = ('user', 'repo')
+
+    def test_find(self):
+        """
+        Comments are found by pull request, path, position and the
+        comment they reply to.
+        """
+        first = review_comment(1)
+        reply = review_comment(2, in_reply_to_id=1)
+        other = review_comment(3, position=2)
+        for comment in [reply, first, other]:
+            self.index.add(self.repo, comment)
+
+        self.assertEqual(self.index.find(self.repo, 12, 'a.py', 1), [first])
+        self.assertEqual(self.index.find(self.repo, '12', 'a.py', 1,
+                                         in_reply_to=1), [reply])
+        self.assertEqual(self.index.find(self.repo, 12, 'a.py', 2), [other])
+        self.assertEqual(self.index.find(self.repo, 13, 'a.py', 1), [])
+        self.assertEqual(self.index.find(('user', 'other'), 12, 'a.py', 1),
+                         [])
+
+    def test_update(self):
+        """
+        Adding a comment again replaces its earlier version.
+        """
+        self.index.add(self.repo, review_comment(1))
+        self.index.add(self.repo, review_comment(1, position=None))
+        self.assertEqual(self.index.find(self.repo, 12, 'a.py', 1), [])
+        self.assertEqual(self.index.find(self.repo, 12, 'a.py', None),
+                         [review_comment(1, position=None)])
+        self.assertEqual(len(self.index), 1)
+
+    def test_remove(self):
+        """
+        Removed comments are no longer found.  Removing an unknown
+        comment does nothing.
+        """
+        self.index.add(self.repo, review_comment(1))
+        self.index.remove(self.repo, 1)
+        self.index.remove(self.repo, 1)
+        self.assertEqual(self.index.find(self.repo, 12, 'a.py', 1), [])
+        self.assertEqual(len(self.index), 0)
@@ -140,6 +140,11 @@ class GetTokenTests(SynchronousTestCase):
         self.getProcessOutput_calls = []
         self.getProcessOutput_deferred = Deferred()
         self.patch(token, "getProcessOutput", self.fake_getProcessOutput)
+        self.patch(os, "environ", {})
+        self.patch(token, "_resolved", None)
+        self.patch(token, "_waiters", None)
+        self.tokenFile = self.mktemp()
+        self.patch(token, "TOKEN_FILE", self.tokenFile)
 
     def fake_getProcessOutput(self, executable, args, env):
         """
@@ -161,3 +166,66 @@ class GetTokenTests(SynchronousTestCase):
 
         token_deferred.callback("some token\n")
         self.assertEqual(self.successResultOf(token_deferred), "some token")
+
+    def test_explicit(self):
+        """
+        An explicit token is used as is.
+        """
+        self.assertEqual(self.successResultOf(token.getToken("explicit")),
+                         "explicit")
+        self.assertEqual(self.getProcessOutput_calls, [])
+
+    def test_environment(self):
+        """
+        The token is taken from the environment before git is asked.
+        """
+        os.environ["GITHUB_TOKEN"] = "env token\n"
+        self.assertEqual(self.successResultOf(token.getToken()), "env token")
+        self.assertEqual(self.getProcessOutput_calls, [])
+
+    def test_git_config_once(self):
+        """
+        git is only run once per process; later and concurrent calls reuse
+        its answer.
+        """
+        first = token.getToken()
+        second = token.getToken()
+        self.getProcessOutput_deferred.callback("some token\n")
+        self.assertEqual(self.successResultOf(first), "some token")
+        self.assertEqual(self.successResultOf(second), "some token")
+        self.assertEqual(self.successResultOf(token.getToken()),
+                         "some token")
+        self.assertEqual(len(self.getProcessOutput_calls), 1)
+
+    def test_token_file(self):
+        """
+        Without a git configuration setting, the token is read from the
+        token file.
+        """
+        with open(self.tokenFile, "w") as f:
+            f.write("file token\nrest\n")
+        d = token.getToken()
+        self.getProcessOutput_deferred.callback("")
+        self.assertEqual(self.successResultOf(d), "file token")
+
+    def test_git_failure(self):
+        """
+        If git cannot be run, the token file is still read.
+        """
+        with open(self.tokenFile, "w") as f:
+            f.write("file token")
+        d = token.getToken()
+        self.getProcessOutput_deferred.errback(OSError("no git"))
+        self.assertEqual(self.successResultOf(d), "file token")
+
+    def test_not_found(self):
+        """
+        An empty token is returned if none is found, and the lookup is
+        tried again on the next call.
+        """
+        d = token.getToken()
+        self.getProcessOutput_deferred.callback("")
+        self.assertEqual(self.successResultOf(d), "")
+        self.getProcessOutput_deferred = Deferred()
+        token.getToken()
+        self.assertEqual(len(self.getProcessOutput_calls), 2)
@@ -0,0 +1,159 @@
+"""
+Tests for L{txgithub.webhook}.
+"""
+import hashlib
+import hmac
+import io
+import json
+import urllib
+
+from twisted.internet.defer import fail
+from twisted.internet.task import Clock
+from twisted.trial.unittest import SynchronousTestCase
+from twisted.web.test.requesthelper import DummyRequest
+
+from txgithub.webhook import WebhookResource
+
+
+class WebhookResourceTests(SynchronousTestCase):
+    """
+    Tests for L{WebhookResource}.
+    """
+
+    def setUp(self):
+        self.clock = Clock()
+        self.secret = b"secret"
+        self.resource = WebhookResource(self.secret, reactor=self.clock,
+                                        maxDeliveries=2)
+        self.handled = []
+        self.resource.addHandler("push", self.handler)
+
+    def handler(self, event, payload):
+        """
+        A handler that records its calls.
+        """
+        self.handled.append((event, payload))
+
+    def post(self, body, event="push", delivery="1", signature=None,
+             contentType=b"application/json",
+             header=b"X-Hub-Signature-256"):
+        """
+        Deliver C{body} to the resource, returning the request and the
+        rendered response.
+        """
+        if signature is None:
+            signature = "sha256=" + hmac.new(self.secret, body,
+                                             hashlib.sha256).hexdigest()
+        request = DummyRequest([])
+        request.method = b"POST"
+        request.content = io.BytesIO(body)
+        request.requestHeaders.setRawHeaders(b"Content-Type", [contentType])
+        request.requestHeaders.setRawHeaders(b"X-GitHub-Event", [event])
+        request.requestHeaders.setRawHeaders(b"X-GitHub-Delivery",
+                                             [delivery])
+        request.requestHeaders.setRawHeaders(header, [signature])
+        return request, self.resource.render(request)
+
+    def test_dispatch(self):
+        """
+        A signed delivery is acknowledged and then dispatched to the
+        handlers of its event.
+        """
+        request, response = self.post(b'{"ref": "master"}')
+        self.assertEqual(request.responseCode, 202)
+        self.assertEqual(self.handled, [])
+
+        self.clock.advance(0)
+        self.assertEqual(self.handled, [("push", {"ref": "master"})])
+
+    def test_wildcard_handler(self):
+        """
+        Handlers registered for C{'*'} receive every event.
+        """
+        self.resource.addHandler("*", self.handler)
+        self.post(b"{}", event="status")
+        self.clock.advance(0)
+        self.assertEqual(self.handled, [("status", {})])
+
+    def test_removeHandler(self):
+        """
+        A removed handler is no longer called.
+        """
+        self.resource.removeHandler("push", self.handler)
+        self.post(b"{}")
+        self.clock.advance(0)
+        self.assertEqual(self.handled, [])
+
+    def test_sha1_signature(self):
+        """
+        The older SHA-1 signature header is accepted.
+        """
+        body = b"{}"
+        signature = "sha1=" + hmac.new(self.secret, body,
+                                       hashlib.sha1).hexdigest()
+        request, response = self.post(body, signature=signature,
+                                      header=b"X-Hub-Signature")
+        self.assertEqual(request.responseCode, 202)
+
+    def test_bad_signature(self):
+        """
+        Deliveries with a bad signature are refused.
+        """
+        request, response = self.post(b"{}", signature="sha256=00")
+        self.assertEqual(request.responseCode, 403)
+        self.clock.advance(0)
+        self.assertEqual(self.handled, [])
+
+    def test_missing_signature(self):
+        """
+        Deliveries without a signature are refused.
+        """
+        request, response = self.post(b"{}", header=b"X-Other")
+        self.assertEqual(request.responseCode, 403)
+
+    def test_bad_payload(self):
+        """
+        Deliveries whose payload is not JSON are rejected.
+        """
+        request, response = self.post(b"not json")
+        self.assertEqual(request.responseCode, 400)
+
+    def test_form_payload(self):
+        """
+        Form encoded payloads are decoded.
+        """
+        body = urllib.urlencode({"payload": '{"a": 1}'})
+        self.post(body, contentType=b"application/x-www-form-urlencoded")
+        self.clock.advance(0)
+        self.assertEqual(self.handled, [("push", {"a": 1})])
+
+    def test_duplicate_delivery(self):
+        """
+        A redelivery is acknowledged but not dispatched again.
+        """
+        self.post(b"{}", delivery="1")
+        request, response = self.post(b"{}", delivery="1")
+        self.assertEqual(request.responseCode, 200)
+        self.clock.advance(0)
+        self.assertEqual(len(self.handled), 1)
+
+    def test_deliveries_bounded(self):
+        """
+        Only the most recent delivery IDs are remembered.
+        """
+        for delivery in ["1", "2", "3", "1"]:
+            self.post(b"{}", delivery=delivery)
+        self.clock.advance(0)
+        self.assertEqual(len(self.handled), 4)
+
+    def test_handler_failure_logged(self):
+        """
+        Failures of handlers are logged and do not stop other handlers.
+        """
+        self.resource.addHandler("push", lambda event, payload: fail(
+            ZeroDivisionError()))
+        self.resource.addHandler("*", self.handler)
+        self.post(b"{}")
+        self.clock.advance(0)
+        self.assertEqual(len(self.handled), 2)
+        self.assertEqual(len(self.flushLoggedErrors(ZeroDivisionError)), 1)
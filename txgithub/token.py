@@ -2,7 +2,7 @@ import os
 import json
 import base64
 
-from twisted.web import client
+from twisted.internet import defer
 from twisted.internet.utils import getProcessOutput
 
 from txgithub.constants import HOSTED_BASE_URL
@@ -10,7 +10,11 @@ from txgithub.constants import HOSTED_BASE_URL
 def createToken(username, password,
                 note, note_url,
                 scopes, baseURL=None,
-                _getPage=client.getPage):
+                _getPage=None):
+    if _getPage is None:
+        # twisted.web.client is slow to import, and most scripts only
+        # need getToken
+        from twisted.web.client import getPage as _getPage
     baseURL = baseURL or HOSTED_BASE_URL
     if baseURL[-1] != '/':
         baseURL += '/'
@@ -37,7 +41,75 @@ def createToken(username, password,
     return d
 
 
-def getToken():
+# where getToken looks for a token, after the explicit value
+TOKEN_ENVIRONMENT_VARIABLE = 'GITHUB_TOKEN'
+TOKEN_FILE = os.path.join('~', '.config', 'txgithub', 'token')
+
+# the token found by getToken, looked up once per process, and the
+# callers waiting for the lookup in progress
+_resolved = None
+_waiters = None
+
+
+def _fromEnvironment():
+    return os.environ.get(TOKEN_ENVIRONMENT_VARIABLE, '').strip()
+
+
+def _fromGitConfig():
     d = getProcessOutput('git', ('config', '--get', 'github.token'), env=os.environ)
     d.addCallback(str.strip)
+    # git may not be installed
+    d.addErrback(lambda reason: '')
+    return d
+
+
+def _fromFile():
+    try:
+        with open(os.path.expanduser(TOKEN_FILE)) as f:
+            return f.readline().strip()
+    except IOError:
+        return ''
+
+
+def getToken(token=None):
+    """
+    Find a token: the explicit C{token} if given, then the
+    C{GITHUB_TOKEN} environment variable, then the C{github.token} git
+    configuration setting, then the first line of L{TOKEN_FILE}.
+
+    Once found, the token is reused for the rest of the process, without
+    looking it up again.
+
+    @return: A Deferred firing with the token, or an empty string if none
+        was found.
+    """
+    global _resolved, _waiters
+    if token:
+        return defer.succeed(token)
+    if _resolved:
+        return defer.succeed(_resolved)
+    if _waiters is not None:
+        d = defer.Deferred()
+        _waiters.append(d)
+        return d
+
+    found = _fromEnvironment()
+    if found:
+        _resolved = found
+        return defer.succeed(found)
+
+    _waiters = []
+
+    def remember(found):
+        global _resolved, _waiters
+        waiters, _waiters = _waiters, None
+        if found:
+            _resolved = found
+        for waiter in waiters:
+            waiter.callback(found)
+        return found
+
+    d = _fromGitConfig()
+    d.addCallback(lambda found: found or _fromFile())
+    d.addCallback(remember)
     return d
@@ -0,0 +1,135 @@
+# This file is part of txgithub.  txgithub is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+"""
+A twisted.web resource receiving webhook deliveries, for hooks managed with
+L{txgithub.api.ReposEndpoint.createHook}.
+"""
+
+import collections
+import hashlib
+import hmac
+import json
+import urlparse
+
+from twisted.internet import defer
+from twisted.python import log
+from twisted.web import resource
+
+__all__ = ["WebhookResource"]
+
+
+# signature headers, in order of preference, with their digest
+_SIGNATURE_HEADERS = [
+    (b'X-Hub-Signature-256', 'sha256', hashlib.sha256),
+    (b'X-Hub-Signature', 'sha1', hashlib.sha1),
+]
+
+
+class WebhookResource(resource.Resource):
+    """
+    Receives webhook deliveries, and dispatches their payloads to the
+    handlers registered for their event.
+
+    Deliveries whose signature does not match C{secret} are refused.
+    Redelivered payloads are recognised by their delivery ID and not
+    dispatched again.  Handlers are called in a later reactor iteration,
+    after the delivery has been acknowledged.
+    """
+
+    isLeaf = True
+
+    def __init__(self, secret, reactor=None, maxDeliveries=1000):
+        """
+        :param secret: The secret configured for the hook.
+        :param maxDeliveries: How many delivery IDs to remember for
+                              deduplication.
+        """
+        resource.Resource.__init__(self)
+        self.secret = secret
+        if reactor is None:
+            from twisted.internet import reactor
+        self.reactor = reactor
+        self.maxDeliveries = maxDeliveries
+        self._handlers = {}
+        self._deliveries = collections.OrderedDict()
+
+    def addHandler(self, event, handler):
+        """
+        Call C{handler} with the event name and decoded payload of every
+        delivery of C{event}, or of every delivery if C{event} is C{'*'}.
+        The handler may return a Deferred.
+        """
+        self._handlers.setdefault(event, []).append(handler)
+
+    def removeHandler(self, event, handler):
+        self._handlers[event].remove(handler)
+
+    def verifySignature(self, request, body):
+        """
+        Is C{body} signed with our secret, according to the signature
+        headers of C{request}?
+        """
+        for header, name, digest in _SIGNATURE_HEADERS:
+            signature = request.getHeader(header)
+            if signature is None:
+                continue
+            expected = name + '=' + hmac.new(
+                self.secret, body, digest).hexdigest()
+            return hmac.compare_digest(expected, signature)
+        return False
+
+    def _parsePayload(self, request, body):
+        contentType = request.getHeader(b'Content-Type') or b''
+        if contentType.startswith(b'application/x-www-form-urlencoded'):
+            body = urlparse.parse_qs(body).get('payload', [''])[0]
+        return json.loads(body)
+
+    def _isDuplicate(self, delivery):
+        if delivery is None:
+            return False
+        if delivery in self._deliveries:
+            return True
+        self._deliveries[delivery] = None
+        while len(self._deliveries) > self.maxDeliveries:
+            self._deliveries.popitem(last=False)
+        return False
+
+    def render_POST(self, request):
+        body = request.content.read()
+        if not self.verifySignature(request, body):
+            request.setResponseCode(403)
+            return b'bad signature'
+
+        try:
+            payload = self._parsePayload(request, body)
+        except ValueError:
+            request.setResponseCode(400)
+            return b'bad payload'
+
+        event = request.getHeader(b'X-GitHub-Event')
+        if self._isDuplicate(request.getHeader(b'X-GitHub-Delivery')):
+            request.setResponseCode(200)
+            return b'duplicate delivery'
+
+        self.reactor.callLater(0, self._dispatch, event, payload)
+        request.setResponseCode(202)
+        return b''
+
+    def _dispatch(self, event, payload):
+        for handler in (self._handlers.get(event, []) +
+                        self._handlers.get('*', [])):
+            d = defer.maybeDeferred(handler, event, payload)
+            d.addErrback(log.err, "error handling %s webhook" % (event,))